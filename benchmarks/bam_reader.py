@@ -0,0 +1,88 @@
+#!/bin/env python
+"""
+Benchmark the samtools text path against the native BAM decoder used by
+ReadArray.from_alignment_file.
+
+usage:
+python benchmarks/bam_reader.py Aligned.out.bam [--gtf annotations.gtf]
+
+Without --gtf, only record decoding and multialignment grouping are timed. With --gtf,
+a full ReadArray is also constructed with each reader and the results are compared.
+"""
+
+import argparse
+import shutil
+import time
+import numpy as np
+from seqc.alignment import sam
+
+
+def time_multialignments(reader):
+    """iterate over all multialignments, touching every field used by ReadArray
+
+    :param reader: sam.Reader or sam.BamReader
+    :return (float, int, int): seconds elapsed, number of reads, number of alignments
+    """
+    start = time.time()
+    n_reads, n_alignments = 0, 0
+    for ma in reader.iter_multialignments():
+        for a in ma:
+            a.rname, a.strand, a.pos
+            n_alignments += 1
+        a.cell, a.rmt, a.n_poly_t
+        n_reads += 1
+    return time.time() - start, n_reads, n_alignments
+
+
+def time_read_array(bamfile, translator, reader):
+    from seqc.read_array import ReadArray
+
+    start = time.time()
+    ra, _ = ReadArray.from_alignment_file(
+        bamfile, translator, required_poly_t=0, reader=reader
+    )
+    return time.time() - start, ra
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("bamfile", help="name-grouped .bam file produced by STAR")
+    parser.add_argument("--gtf", default=None, help="annotations.gtf of the index")
+    parser.add_argument("--max-transcript-length", default=1000, type=int)
+    args = parser.parse_args()
+
+    readers = {"native": sam.BamReader(args.bamfile)}
+    if shutil.which("samtools"):
+        readers["samtools"] = sam.Reader(args.bamfile)
+    else:
+        print("samtools was not found; only the native reader will be timed.")
+
+    for name, reader in readers.items():
+        seconds, n_reads, n_alignments = time_multialignments(reader)
+        print(
+            "{:<9} decode: {:8.2f}s  {:>12,d} reads  {:>12,d} alignments  "
+            "{:>10,.0f} alignments/s".format(
+                name, seconds, n_reads, n_alignments, n_alignments / seconds
+            )
+        )
+
+    if args.gtf:
+        from seqc.sequence.gtf import GeneIntervals
+
+        translator = GeneIntervals(args.gtf, args.max_transcript_length)
+        arrays = {}
+        for name in readers:
+            seconds, arrays[name] = time_read_array(args.bamfile, translator, name)
+            print("{:<9} ReadArray: {:8.2f}s".format(name, seconds))
+        if len(arrays) == 2:
+            native, text = arrays["native"], arrays["samtools"]
+            identical = (
+                np.array_equal(native.data, text.data)
+                and (native.genes != text.genes).nnz == 0
+                and (native.positions != text.positions).nnz == 0
+            )
+            print("ReadArrays identical: {}".format(identical))
+
+
+if __name__ == "__main__":
+    main()
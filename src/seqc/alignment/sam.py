@@ -1,6 +1,7 @@
 from collections import namedtuple
 from subprocess import Popen, PIPE
 import shutil
+import struct
 import gzip
 
 
@@ -139,6 +140,10 @@ class SamRecord:
             self._parse_name_field()
             return self._parsed_name_field.name
 
+    @property
+    def n_poly_t(self) -> int:
+        return self.poly_t.count("T") + self.poly_t.count("N")
+
     @property
     def is_mapped(self):
         return False if (int(self.flag) & 4) else True
@@ -244,7 +249,10 @@ class Reader:
     def iter_multialignments(self):
         """yields tuples of all alignments for each fastq record"""
         sam_iter = iter(self)
-        fq = [next(sam_iter)]
+        try:
+            fq = [next(sam_iter)]
+        except StopIteration:  # no records, e.g. the aligner failed
+            return
         for record in sam_iter:
             if record.qname == fq[0].qname:
                 fq.append(record)
@@ -252,3 +260,213 @@ class Reader:
                 yield tuple(fq)
                 fq = [record]
         yield tuple(fq)
+
+
+class StreamReader(Reader):
+    """Sam reader over an open stream of SAM text, such as STAR's stdout when it is run
+    with --outStd SAM. The stream can only be iterated over once.
+    """
+
+    def __init__(self, fobj, tee=None):
+        """
+        :param fobj: binary file object producing SAM text, including the header
+        :param tee: optional binary file object to which every line read from fobj,
+          including the header, is also written (e.g. the stdin of samtools view -b)
+        """
+        self._samfile = getattr(fobj, "name", "<stream>")
+        self._fobj = fobj
+        self._tee = tee
+
+    def __iter__(self):
+        """return an iterator over all non-header records in the stream"""
+        tee = self._tee
+        try:
+            for line in self._fobj:
+                if tee is not None:
+                    tee.write(line)
+                if line.startswith(b"@"):
+                    continue
+                yield SamRecord(line.decode().strip().split("\t"))
+        finally:
+            self._fobj.close()
+
+
+class BamRecord:
+    """Record decoded directly from a binary BAM alignment block.
+
+    Only the fields needed to construct a ReadArray are decoded. Field types match
+    SamRecord, so either record type can be consumed by the same code.
+    """
+
+    __slots__ = ["qname", "flag", "rname", "pos", "_parsed_name_field"]
+
+    NameField = SamRecord.NameField
+
+    def __init__(self, qname: str, flag: int, rname: str, pos: int):
+        self.qname = qname
+        self.flag = flag
+        self.rname = rname
+        self.pos = pos
+        self._parsed_name_field = None
+
+    def __repr__(self):
+        return "<BamRecord {!r} {!s}:{!s} flag={!s}>".format(
+            self.qname, self.rname, self.pos, self.flag
+        )
+
+    def _parse_name_field(self):
+        fields, name = self.qname.split(";")
+        processed_fields = fields.split(":")
+        processed_fields.append(name)
+        self._parsed_name_field = self.NameField(*processed_fields)
+
+    @property
+    def pool(self) -> str:
+        if self._parsed_name_field is None:
+            self._parse_name_field()
+        return self._parsed_name_field.pool
+
+    @property
+    def rmt(self) -> str:
+        if self._parsed_name_field is None:
+            self._parse_name_field()
+        return self._parsed_name_field.rmt
+
+    @property
+    def cell(self) -> str:
+        if self._parsed_name_field is None:
+            self._parse_name_field()
+        return self._parsed_name_field.cell
+
+    @property
+    def poly_t(self) -> str:
+        if self._parsed_name_field is None:
+            self._parse_name_field()
+        return self._parsed_name_field.poly_t
+
+    @property
+    def name(self) -> str:
+        if self._parsed_name_field is None:
+            self._parse_name_field()
+        return self._parsed_name_field.name
+
+    @property
+    def n_poly_t(self) -> int:
+        return self.poly_t.count("T") + self.poly_t.count("N")
+
+    @property
+    def is_mapped(self):
+        return not self.flag & 4
+
+    @property
+    def is_unmapped(self):
+        return not self.is_mapped
+
+    @property
+    def strand(self):
+        return "-" if self.flag & 16 else "+"
+
+
+class BamReader:
+    """BAM reader that decodes BGZF-compressed alignment blocks in-process.
+
+    Unlike Reader, this does not shell out to samtools and never formats or splits
+    SAM text. BGZF files are a series of concatenated gzip members, so they can be
+    decompressed with the standard library; each alignment block is then unpacked
+    with struct. Only qname, flag, rname and pos are decoded.
+    """
+
+    _block_fields = struct.Struct("<iiBBHHHi")  # refID ... l_seq
+    _chunk_size = 1 << 22
+
+    def __init__(self, bamfile: str):
+        """
+        :param bamfile: str, location of a .bam file
+
+        usage:
+        if rd = BamReader(bamfile)
+        :method __iter__: iterate over the .bam file's records (also usable in for loop)
+        :method __len__: return the number of alignments in the file
+        :method iter_multialignments: return tuples of multiple alignments, all from the
+           same fastq record
+        """
+        self._bamfile = bamfile
+        try:
+            with gzip.open(bamfile, "rb") as f:
+                self._read_header(f)
+        except (OSError, EOFError, ValueError, struct.error):
+            raise ValueError(
+                "%s is an invalid bamfile. Please check file formatting." % bamfile
+            )
+
+    @property
+    def bamfile(self):
+        return self._bamfile
+
+    @staticmethod
+    def _read_header(fobj):
+        """consume the BAM header from fobj
+
+        :param fobj: open, decompressed binary file object positioned at the start of
+          the BAM stream
+        :return [str]: reference sequence names, indexed by BAM refID
+        """
+        if fobj.read(4) != b"BAM\1":
+            raise ValueError("missing BAM magic string")
+        (l_text,) = struct.unpack("<i", fobj.read(4))
+        fobj.read(l_text)
+        (n_ref,) = struct.unpack("<i", fobj.read(4))
+        references = []
+        for _ in range(n_ref):
+            (l_name,) = struct.unpack("<i", fobj.read(4))
+            references.append(fobj.read(l_name)[:-1].decode())
+            fobj.read(4)  # l_ref
+        return references
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        """return an iterator over all records in bamfile"""
+        unpack_from = self._block_fields.unpack_from
+        with gzip.open(self.bamfile, "rb") as f:
+            references = self._read_header(f)
+            buf = f.read(self._chunk_size)
+            offset = 0
+            while True:
+                if len(buf) - offset < 4:
+                    chunk = f.read(self._chunk_size)
+                    if not chunk:
+                        break
+                    buf = buf[offset:] + chunk
+                    offset = 0
+                    continue
+                (block_size,) = struct.unpack_from("<i", buf, offset)
+                end = offset + 4 + block_size
+                if end > len(buf):
+                    chunk = f.read(max(self._chunk_size, block_size))
+                    if not chunk:
+                        raise ValueError("%s is truncated." % self.bamfile)
+                    buf = buf[offset:] + chunk
+                    offset = 0
+                    continue
+                ref_id, pos, l_read_name, _, _, _, flag, _ = unpack_from(buf, offset + 4)
+                qname = buf[offset + 36 : offset + 35 + l_read_name].decode()
+                rname = references[ref_id] if ref_id >= 0 else "*"
+                yield BamRecord(qname, flag, rname, pos + 1)
+                offset = end
+
+    def iter_multialignments(self):
+        """yields tuples of all alignments for each fastq record"""
+        bam_iter = iter(self)
+        try:
+            fq = [next(bam_iter)]
+        except StopIteration:  # no records, e.g. the aligner failed
+            return
+        for record in bam_iter:
+            if record.qname == fq[0].qname:
+                fq.append(record)
+            else:
+                yield tuple(fq)
+                fq = [record]
+        yield tuple(fq)
@@ -1,7 +1,9 @@
 from subprocess import Popen, PIPE
 from multiprocessing import cpu_count
 from os import makedirs
+import os
 import shlex
+import stat
 
 
 def get_version():
@@ -29,7 +31,8 @@ def default_alignment_args(
 
     To report unaligned reads, add '--outSAMunmapped': 'Within',
 
-    :param fastq_records: str, name of fastq file
+    :param fastq_records: str, name of fastq file or of a named pipe the records are
+      written to
     :param n_threads: int or str, number of threads to allocate when calling STAR
     :param index: str, location of the STAR index
     :param output_dir: str, prefix for output files
@@ -55,28 +58,25 @@ def default_alignment_args(
         default_align_args["--readFilesCommand"] = "gunzip -c"
     if fastq_records.endswith(".bz2"):
         default_align_args["--readFilesCommand"] = "bunzip2 -c"
+    if os.path.exists(fastq_records) and stat.S_ISFIFO(os.stat(fastq_records).st_mode):
+        # records are streamed into a named pipe; let STAR read it through a command
+        # so it never tries to seek or re-open the input
+        default_align_args["--readFilesCommand"] = "cat"
     return default_align_args
 
 
-def align(
+def _alignment_command(
     fastq_file: str,
     index: str,
     n_threads: int,
     alignment_dir: str,
     reverse_fastq_file: str or bool = None,
     **kwargs
-) -> str:
-    """align a fastq file, or a paired set of fastq files
+) -> list:
+    """construct the STAR command line for align() and align_to_stdout()
 
-    :param fastq_file: str, location of a fastq file
-    :param index: str, folder containing the STAR index
-    :param n_threads: int, number of parallel alignment processes to spawn
-    :param alignment_dir: str, directory for output data
-    :param reverse_fastq_file: optional, location of reverse paired-end fastq file
-    :param kwargs: additional kwargs for STAR, passed without the leading '--'
-    :return: str, .sam file location
+    :return: list, STAR command
     """
-
     runtime_args = default_alignment_args(fastq_file, n_threads, index, alignment_dir)
 
     for k, v in kwargs.items():  # overwrite or add any arguments passed from cmdline
@@ -105,7 +105,30 @@ def align(
         for pair in runtime_args.items():
             cmd.extend(pair)
 
-    cmd = shlex.split(" ".join(cmd))
+    return shlex.split(" ".join(cmd))
+
+
+def align(
+    fastq_file: str,
+    index: str,
+    n_threads: int,
+    alignment_dir: str,
+    reverse_fastq_file: str or bool = None,
+    **kwargs
+) -> str:
+    """align a fastq file, or a paired set of fastq files
+
+    :param fastq_file: str, location of a fastq file
+    :param index: str, folder containing the STAR index
+    :param n_threads: int, number of parallel alignment processes to spawn
+    :param alignment_dir: str, directory for output data
+    :param reverse_fastq_file: optional, location of reverse paired-end fastq file
+    :param kwargs: additional kwargs for STAR, passed without the leading '--'
+    :return: str, .sam file location
+    """
+    cmd = _alignment_command(
+        fastq_file, index, n_threads, alignment_dir, reverse_fastq_file, **kwargs
+    )
     aln = Popen(cmd, stderr=PIPE, stdout=PIPE)
     _, err = aln.communicate()
     if err:
@@ -114,6 +137,53 @@ def align(
     return alignment_dir + "Aligned.out.bam"
 
 
+class AlignmentStream:
+    """STAR alignment that writes unsorted SAM records to stdout as they are produced.
+
+    Records can be consumed while STAR is still aligning, e.g. with
+    sam.StreamReader(stream.stdout). STAR's stderr is written to
+    alignment_dir/Log.stderr.out; call wait() once stdout has been consumed.
+    """
+
+    def __init__(
+        self,
+        fastq_file: str,
+        index: str,
+        n_threads: int,
+        alignment_dir: str,
+        reverse_fastq_file: str or bool = None,
+        **kwargs
+    ):
+        """
+        :param fastq_file: str, location of a fastq file
+        :param index: str, folder containing the STAR index
+        :param n_threads: int, number of parallel alignment processes to spawn
+        :param alignment_dir: str, directory for output data
+        :param reverse_fastq_file: optional, location of reverse paired-end fastq file
+        :param kwargs: additional kwargs for STAR, passed without the leading '--'
+        """
+        kwargs.update(outSAMtype="SAM", outStd="SAM")
+        cmd = _alignment_command(
+            fastq_file, index, n_threads, alignment_dir, reverse_fastq_file, **kwargs
+        )
+        self._stderr_file = alignment_dir + "Log.stderr.out"
+        with open(self._stderr_file, "wb") as stderr:
+            self._proc = Popen(cmd, stdout=PIPE, stderr=stderr)
+
+    @property
+    def stdout(self):
+        return self._proc.stdout
+
+    def wait(self) -> None:
+        """wait for STAR to exit, raising ChildProcessError if it reported an error"""
+        self._proc.stdout.close()
+        self._proc.wait()
+        with open(self._stderr_file, "rb") as f:
+            err = f.read()
+        if err or self._proc.returncode != 0:
+            raise ChildProcessError(err or self._proc.returncode)
+
+
 def create_index(
     fasta: str, gtf: str, genome_dir: str, read_length: int = 75, **kwargs
 ) -> None:
@@ -12,64 +12,76 @@ def ten_x_barcode_correction(
     """
     Correct reads with incorrect barcodes according to the correct barcodes files.
     Reads with barcodes that have too many errors are filtered out.
+
+    Observed barcodes that are not valid are corrected to the valid observed barcode
+    one Hamming distance away that has the most reads; ties go to the first candidate
+    in the order of seqc.sequence.barcodes.generate_hamming_dist_1. All observed
+    barcodes are processed at once with array operations.
+
     :param ra: seqc.read_array.ReadArray object
     :param platform: the platform object
     :param barcode_files: the list of the paths of barcode files
     :param max_ed: maximum allowed Hamming distance from known cell barcodes
     :param default_error_rate: assumed sequencing error rate
-    :return:
+    :return float, pd.DataFrame: error rate, and the mapping of each corrected
+      barcode (CR) to its correction (CB)
     """
 
-    # Read the barcodes into lists
-    valid_barcodes = set()
-    for barcode_file in barcode_files:
-        with open(barcode_file, "r") as f:
-            valid_barcodes = set(
-                [DNA3Bit.encode(line.strip()) for line in f.readlines()]
-            )
+    # Read the barcodes of all files
+    whitelist = seqc.sequence.barcodes.BarcodeIndex.from_file(*barcode_files)
 
-    # Group reads by cells
-    indices_grouped_by_cells = ra.group_indices_by_cell(multimapping=True)
+    # Group reads by cells: reads are mapped to the index of their cell in cells, and
+    # counts holds the number of reads of each cell
+    passing = np.flatnonzero(
+        (ra.data["status"] & ra.filtering_mask("gene_not_unique")) == 0
+    )
+    cells, read_cells, counts = np.unique(
+        ra.data["cell"][passing], return_inverse=True, return_counts=True
+    )
+    # extract_barcodes works on arrays for the single-barcode 10x platforms
+    barcodes = np.asarray(platform.extract_barcodes(cells.copy())[0], dtype=np.int64)
 
     # Find all valid barcodes and their counts
-    valid_barcode_count = dict()
-    for inds in indices_grouped_by_cells:
-        # Extract barcodes for one of the reads
-        barcode = platform.extract_barcodes(ra.data["cell"][inds[0]])[0]
-        if barcode in valid_barcodes:
-            valid_barcode_count[barcode] = len(inds)
-
-    # Find the set of invalid barcodes and check out whether they can be corrected
-    mapping = []
-    for inds in indices_grouped_by_cells:
-
-        # Extract barcodes for one of the reads
-        barcode = platform.extract_barcodes(ra.data["cell"][inds[0]])[0]
-        if barcode not in valid_barcode_count:
-            # Identify correct barcode as one Hamming distance away with most reads
-            hammind_dist_1_barcodes = seqc.sequence.barcodes.generate_hamming_dist_1(
-                barcode
-            )
-            fat_bc = -1
-            fat_bc_count = 0
-            for bc in hammind_dist_1_barcodes:
-                if (bc in valid_barcode_count) and (
-                    valid_barcode_count[bc] > fat_bc_count
-                ):
-                    fat_bc = bc
-                    fat_bc_count = valid_barcode_count[bc]
-
-            if fat_bc < 0:
-                ra.data["status"][inds] |= ra.filter_codes["cell_error"]
-            else:
-                # record pre-/post-correction
-                for reported_cb in np.unique(ra.data["cell"][inds]):
-                    mapping.append((reported_cb, fat_bc))
-
-                # Update the read array with the correct barcode
-                ra.data["cell"][inds] = fat_bc
+    valid = whitelist.contains_many(barcodes)
+    valid_barcodes, first = np.unique(barcodes[valid], return_index=True)
+    valid_counts = counts[valid][first]
+
+    # Identify correct barcodes as one Hamming distance away with most reads
+    corrections = np.full(len(cells), -1, dtype=np.int64)
+    invalid = np.flatnonzero(~valid)
+    chunk_size = 1 << 16
+    for start in range(0, len(invalid), chunk_size):
+        rows = invalid[start : start + chunk_size]
+        neighbours = seqc.sequence.barcodes.generate_hamming_dist_1_array(
+            barcodes[rows]
+        )
+        if not len(valid_barcodes) or not neighbours.size:
+            continue
+        i = np.minimum(
+            np.searchsorted(valid_barcodes, neighbours), len(valid_barcodes) - 1
+        )
+        neighbour_counts = np.where(
+            valid_barcodes[i] == neighbours, valid_counts[i], 0
+        )
+        best = neighbour_counts.argmax(axis=1)  # first of the candidates with most reads
+        fat_bc = neighbours[np.arange(len(rows)), best]
+        corrections[rows] = np.where(
+            neighbour_counts[np.arange(len(rows)), best] > 0, fat_bc, -1
+        )
 
-    return default_error_rate, pd.DataFrame(mapping, columns=["CR", "CB"])
+    # Filter uncorrectable barcodes, and update the read array with the correct ones
+    corrected = corrections >= 0
+    failing = ~valid & ~corrected
+    ra.data["status"][passing[failing[read_cells]]] |= ra.filter_codes["cell_error"]
+    update = corrected[read_cells]
+    ra.data["cell"][passing[update]] = corrections[read_cells[update]]
+    ra.invalidate_sort("cell")
+
+    # record pre-/post-correction
+    mapping = pd.DataFrame(
+        {"CR": cells[corrected], "CB": corrections[corrected]}, columns=["CR", "CB"]
+    )
+    return default_error_rate, mapping
 
 
 def in_drop(ra, platform, barcode_files, max_ed=2, default_error_rate=0.02):
@@ -84,18 +96,13 @@ def in_drop(ra, platform, barcode_files, max_ed=2, default_error_rate=0.02):
     :return:
     """
 
-    # Read the barcodes into lists
-    valid_barcodes = []
-    for barcode_file in barcode_files:
-        with open(barcode_file, "r") as f:
-            valid_barcodes.append(
-                set(DNA3Bit.encode(line.strip()) for line in f.readlines())
-            )
+    # Index the valid barcodes of each position
+    barcode_indices = [
+        seqc.sequence.barcodes.BarcodeIndex.from_file(barcode_file)
+        for barcode_file in barcode_files
+    ]
 
-    # Containers
     num_barcodes = platform.num_barcodes
-    correct = [None] * num_barcodes
-    edit_dist = [None] * num_barcodes
 
     # Error table container
     errors = [p for p in permutations(DNA3Bit.bin2strdict.keys(), r=2)]
@@ -104,24 +111,30 @@ def in_drop(ra, platform, barcode_files, max_ed=2, default_error_rate=0.02):
         zip(DNA3Bit.bin2strdict.keys(), np.zeros(len(DNA3Bit.bin2strdict)))
     )
 
-    # Check if the barcode has to be an exact match
-    exact_match = False
-    if max_ed == 0:
-        exact_match = True
-
     # Group reads by cells
     indices_grouped_by_cells = ra.group_indices_by_cell(multimapping=True)
 
-    for inds in indices_grouped_by_cells:
-
-        # Extract barcodes for one of the reads
-        barcodes = platform.extract_barcodes(ra.data["cell"][inds[0]])
+    # Extract barcodes for one of the reads of each cell; extract_barcodes shifts its
+    # argument in place, hence the copy
+    cells = ra.data["cell"][[inds[0] for inds in indices_grouped_by_cells]]
+    observed = np.column_stack(
+        [np.asarray(b, dtype=np.int64) for b in platform.extract_barcodes(cells.copy())]
+    ).reshape(len(indices_grouped_by_cells), num_barcodes)
+
+    # Identify correct barcodes, if max_ed is 0 the barcode has to be an exact match
+    corrected = np.empty_like(observed)
+    distances = np.empty_like(observed)
+    for i in range(num_barcodes):
+        corrected[:, i], distances[:, i], _ = barcode_indices[i].find_many(
+            observed[:, i], max_dist=max_ed
+        )
 
-        # Identify correct barcode
-        for i in range(num_barcodes):
-            correct[i], edit_dist[i] = seqc.sequence.barcodes.find_correct_barcode(
-                barcodes[i], valid_barcodes[i], exact_match
-            )
+    for inds, barcodes, correct, edit_dist in zip(
+        indices_grouped_by_cells,
+        observed.tolist(),
+        corrected.tolist(),
+        distances.tolist(),
+    ):
 
         # 1. If all edit distances are 0, barcodes are correct,
         #    update the correct instance table
@@ -184,6 +197,7 @@ def in_drop(ra, platform, barcode_files, max_ed=2, default_error_rate=0.02):
             )
             err_rate[k] = default_error_rate
 
+    ra.invalidate_sort("cell")
     return err_rate, None
 
 
@@ -268,6 +282,7 @@ def drop_seq(
                 [cell_header[header_group[0]], DNA3Bit.str2bindict["N"]]
             )
             ra.data["cell"][header_group] = correct_barcode
+    ra.invalidate_sort("cell")
 
     # 2. Single UMI error
     indices_grouped_by_cells = ra.group_indices_by_cell()
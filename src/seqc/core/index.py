@@ -40,6 +40,7 @@ def index(args):
             ensemble_release=args.ensemble_release,
             read_length=args.read_length,
             valid_biotypes=args.valid_biotypes,
+            translator_cache_lengths=args.translator_cache_lengths,
         )
 
         # upload the log file (seqc_log.txt, nohup.log, Log.out)
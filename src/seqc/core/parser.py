@@ -105,6 +105,16 @@ def parse_args(args):
         help="Filename or s3 link to a .sam or .bam file containing aligned, "
         "merged sequence records.",
     )
+    i.add_argument(
+        "--barcode-sidecar",
+        metavar="BS",
+        default=None,
+        help="Binary file holding the cell barcode, rmt and poly-T count of each "
+        "merged read. When SEQC starts from barcode and genomic fastq files, merging "
+        "writes this file and names each merged read by its ordinal instead of "
+        "annotating its name. When SEQC starts from a merged fastq or alignment file "
+        "that was merged this way, a filename or s3 link to the file written then.",
+    )
     i.add_argument(
         "-r",
         "--read-array",
@@ -188,6 +198,23 @@ def parse_args(args):
         default=0.25,
         type=float,
     )
+    f.add_argument(
+        "--sort-read-array",
+        default=False,
+        action="store_true",
+        help="sort the read array by cell, gene and rmt once barcodes are corrected, "
+        "so that resolving alignments and correcting rmts reuse one cell index "
+        "instead of sorting the reads again",
+    )
+    f.add_argument(
+        "--filtered-output",
+        default="csv",
+        choices=["csv", "mtx"],
+        help='format of the filtered count matrix. "csv" writes <output-prefix>'
+        '_dense.csv one block of cells at a time; "mtx" writes the sparse matrix to '
+        "<output-prefix>_filtered_counts.mtx with barcodes (and clusters) and genes in "
+        "accompanying csv files (default=csv)",
+    )
     # right now, it doesn't do much except you can override the default value for `--max-insert-size`
     f.add_argument(
         "--filter-mode",
@@ -208,6 +235,38 @@ def parse_args(args):
         "--star-args outFilterMultimapNmax=20. Additional arguments can "
         "be provided as a white-space separated list.",
     )
+    s.add_argument(
+        "--stream-merge",
+        default=False,
+        action="store_true",
+        help="stream merged fastq records to STAR through a named pipe instead of "
+        "writing an uncompressed merged fastq file before alignment. A gzipped copy "
+        "of the merged records is written at the same time. Only used when SEQC "
+        "starts from barcode and genomic fastq files.",
+    )
+    s.add_argument(
+        "--stream-alignment",
+        default=False,
+        action="store_true",
+        help="read STAR's SAM output from a pipe and construct the read array while "
+        "alignment is running, instead of waiting for STAR to write a .bam file. A "
+        ".bam file is only written if --keep-bam or --upload-prefix is provided.",
+    )
+    s.add_argument(
+        "--keep-bam",
+        default=False,
+        action="store_true",
+        help="with --stream-alignment, also write the aligned records to "
+        "<output-prefix>_Aligned.out.bam",
+    )
+    s.add_argument(
+        "--bam-reader",
+        choices=["samtools", "native"],
+        default="samtools",
+        help="how aligned .bam records are decoded when constructing the read array. "
+        '"samtools" parses the text output of samtools view; "native" decodes BAM '
+        'records directly in python without samtools. Default="samtools"',
+    )
 
     # PROGRESS PARSER
     progress = subparsers.add_parser("progress", help="check SEQC run progress")
@@ -347,6 +406,16 @@ def parse_args(args):
         type=int,
         help="length of reads that will be aligned against this index (will be used for STAR --sjdbOverhang)",
     )
+    pindex.add_argument(
+        "--translator-cache-lengths",
+        nargs="*",
+        type=int,
+        default=[],
+        metavar="L",
+        help="write translator cache files into the index for these values of "
+        "--max-insert-size (e.g. 1000 10000), so that runs do not need to parse the "
+        "annotation. Runs create missing caches themselves when the index is writable",
+    )
 
     for parser in [pindex, p]:
         r = parser.add_argument_group("Amazon Web Services arguments")
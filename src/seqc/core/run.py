@@ -11,12 +11,15 @@ def run(args) -> None:
 
     import os
     import multiprocessing
+    import threading
+    from contextlib import contextmanager, ExitStack, suppress
+    from collections import Counter
     from seqc import log, ec2, platforms, io, version
     from seqc.sequence import fastq
     from seqc.alignment import star
     from seqc.alignment import sam
     from seqc.email_ import email_user
-    from seqc.read_array import ReadArray
+    from seqc.read_array import ReadArray, ReadArrayArchive
     from seqc.core import verify, download
     from seqc import filter
     from seqc.sequence.gtf import GeneIntervals
@@ -24,6 +27,7 @@ def run(args) -> None:
     import numpy as np
     import scipy.io
     from shutil import copyfile
+    from subprocess import Popen, PIPE
     from shutil import move as movefile
     from seqc.summary.summary import MiniSummary
     from seqc.stats.mast import run_mast
@@ -109,6 +113,15 @@ def run(args) -> None:
                 [arguments.alignment_file], dir_ + "/"
             )[0]
 
+        # the barcode sidecar of a merged fastq or alignment file is an input; when
+        # merging, it is written instead
+        if arguments.barcode_sidecar and (
+            arguments.merged_fastq or arguments.alignment_file
+        ):
+            arguments.barcode_sidecar = download.s3_data(
+                [arguments.barcode_sidecar], dir_ + "/"
+            )[0]
+
         # check if `read_array` is specified
         if arguments.read_array:
             # get the readarray fileanem (*.h5)
@@ -119,11 +132,24 @@ def run(args) -> None:
 
         return arguments
 
+    def log_merge_counts(counts):
+        """log the merge statistics reported by the platform, if any
+
+        :param Counter counts: counts collected by fastq.merge_paired
+        """
+        if counts:
+            log.info(
+                "Barcode reads by spacer path: %s."
+                % ", ".join("%s=%d" % item for item in sorted(counts.items()))
+            )
+
     def merge_fastq_files(
         technology_platform,
         barcode_fastq: [str],
         output_stem: str,
         genomic_fastq: [str],
+        n_proc: int = 1,
+        barcode_sidecar: str = None,
     ) -> (str, int):
         """annotates genomic fastq with barcode information; merging the two files.
 
@@ -134,16 +160,26 @@ def run(args) -> None:
         :param output_stem: str, stem for output files
         :param genomic_fastq: list of str names of fastq files containing genomic
           information
+        :param n_proc: int, number of processes used to merge records
+        :param barcode_sidecar: str, optional BarcodeSidecar file to write the barcodes
+          of the merged reads to
         :returns str merged_fastq: name of merged fastq file
         """
 
         log.info("Merging genomic reads and barcode annotations.")
+        merge_counts = Counter()
         merged_fastq = fastq.merge_paired(
             merge_function=technology_platform.merge_function,
             fout=output_stem + "_merged.fastq",
             genomic=genomic_fastq,
             barcode=barcode_fastq,
+            n_processes=n_proc,
+            decompressor="pigz -dc" if pigz else None,
+            merge_batch=technology_platform.merge_batch,
+            counts=merge_counts,
+            barcode_sidecar=barcode_sidecar,
         )
+        log_merge_counts(merge_counts)
 
         # delete genomic/barcode fastq files after merged.fastq creation
         # log.info('Removing original fastq file for memory management.')
@@ -180,6 +216,16 @@ def run(args) -> None:
             merged_fastq, star_index, n_proc, alignment_directory, **star_kwargs
         )
 
+        upload_manager = archive_merged_fastq(merged_fastq, aws_upload_key)
+        return bamfile, upload_manager
+
+    def archive_merged_fastq(merged_fastq, aws_upload_key) -> io.ProcessManager:
+        """gzip the merged fastq file once alignment is complete and upload it
+
+        :param merged_fastq: str, path to merged .fastq file
+        :param aws_upload_key: str, location to upload files, or None
+        :return io.ProcessManager: manager for the upload, or None
+        """
         log.info("Gzipping merged fastq file.")
         if pigz:
             pigz_zip = "pigz --best -f {fname}".format(fname=merged_fastq)
@@ -190,12 +236,30 @@ def run(args) -> None:
         pigz_proc.wait_until_complete()  # prevents slowing down STAR alignment
         merged_fastq += ".gz"  # reflect gzipped nature of file
 
+        return upload_merged_fastq(merged_fastq, aws_upload_key)
+
+    def upload_merged_fastq(merged_fastq, aws_upload_key) -> io.ProcessManager:
+        """
+        :param merged_fastq: str, path to gzipped merged .fastq file
+        :param aws_upload_key: str, location to upload files, or None
+        :return io.ProcessManager: manager for the upload, or None
+        """
         if aws_upload_key:
             log.info("Uploading gzipped merged fastq file to S3.")
-            merge_upload = "aws s3 mv {fname} {s3link}".format(
-                fname=merged_fastq, s3link=aws_upload_key
-            )
-            upload_manager = io.ProcessManager(merge_upload)
+            uploads = [
+                "aws s3 mv {fname} {s3link}".format(
+                    fname=merged_fastq, s3link=aws_upload_key
+                )
+            ]
+            # read names of the merged fastq are ordinals into the barcode sidecar,
+            # which is still needed locally to construct the read array
+            if args.barcode_sidecar:
+                uploads.append(
+                    "aws s3 cp {fname} {s3link}".format(
+                        fname=args.barcode_sidecar, s3link=aws_upload_key
+                    )
+                )
+            upload_manager = io.ProcessManager(*uploads)
             upload_manager.run_all()
         else:
             #     log.info('Removing merged fastq file for memory management.')
@@ -203,10 +267,149 @@ def run(args) -> None:
             #     io.ProcessManager(rm_merged).run_all()
 
             upload_manager = None
-        return bamfile, upload_manager
+        return upload_manager
+
+    @contextmanager
+    def streaming_merge(
+        technology_platform,
+        barcode_fastq: [str],
+        output_stem: str,
+        genomic_fastq: [str],
+        n_proc,
+        barcode_sidecar=None,
+    ):
+        """
+        Merge fastq records into a named pipe in the background, so that the
+        uncompressed merged fastq file is never written to disk. A gzipped copy of the
+        merged records is written at the same time. The pipe must be read (e.g. by
+        STAR) inside the with block.
+
+        :param technology_platform: class from platforms.py that defines the
+          characteristics of the data being processed
+        :param barcode_fastq: list of str names of fastq files containing barcode
+          information
+        :param output_stem: str, stem for output files
+        :param genomic_fastq: list of str names of fastq files containing genomic
+          information
+        :param n_proc: int, number of processes available to the run
+        :param barcode_sidecar: str, optional BarcodeSidecar file to write the barcodes
+          of the merged reads to
+        :yields str fifo, str merged_fastq: name of the named pipe, and name of the
+          gzipped merged fastq file
+        """
+        fifo = output_stem + "_merged.fastq.fifo"
+        merged_fastq = output_stem + "_merged.fastq.gz"
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+
+        merge_errors = []
+
+        def merge():
+            try:
+                merge_counts = Counter()
+                fastq.merge_paired(
+                    merge_function=technology_platform.merge_function,
+                    fout=fifo,
+                    genomic=genomic_fastq,
+                    barcode=barcode_fastq,
+                    # STAR is running at the same time and gets most of the cores
+                    n_processes=n_proc // 4,
+                    archive=merged_fastq,
+                    archive_compressor="pigz" if pigz else "gzip",
+                    decompressor="pigz -dc" if pigz else None,
+                    merge_batch=technology_platform.merge_batch,
+                    counts=merge_counts,
+                    barcode_sidecar=barcode_sidecar,
+                )
+                log_merge_counts(merge_counts)
+            except BaseException as e:
+                merge_errors.append(e)
+
+        merger = threading.Thread(target=merge, daemon=True)
+        merger.start()
+        try:
+            yield fifo, merged_fastq
+        except BaseException:
+            # the reader exited without draining the pipe; open and close its read end
+            # so that the merge fails with a broken pipe instead of blocking forever.
+            # The merge may not have opened the pipe yet, so repeat until it exits
+            while merger.is_alive():
+                os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                merger.join(timeout=0.1)
+            raise
+        finally:
+            merger.join()
+            os.remove(fifo)
+        if merge_errors:
+            raise merge_errors[0]
+
+    def merge_and_align_fastq_records(
+        technology_platform,
+        barcode_fastq: [str],
+        output_stem: str,
+        genomic_fastq: [str],
+        dir_,
+        star_args,
+        star_index,
+        n_proc,
+        aws_upload_key,
+        barcode_sidecar=None,
+    ) -> (str, str, io.ProcessManager):
+        """
+        Merge fastq records and stream them into STAR through a named pipe, so that the
+        uncompressed merged fastq file is never written to disk. A gzipped copy of the
+        merged records is written while STAR is running.
+
+        :param technology_platform: class from platforms.py that defines the
+          characteristics of the data being processed
+        :param barcode_fastq: list of str names of fastq files containing barcode
+          information
+        :param output_stem: str, stem for output files
+        :param genomic_fastq: list of str names of fastq files containing genomic
+          information
+        :param dir_: str, stem for output files
+        :param star_args: dict, extra keyword arguments for STAR
+        :param star_index: str, file path to directory containing STAR index
+        :param n_proc: int, number of STAR processes to initiate
+        :param aws_upload_key: str, location to upload files, or None
+        :param barcode_sidecar: str, optional BarcodeSidecar file to write the barcodes
+          of the merged reads to
+        :return bamfile, merged_fastq, upload_manager: (str, str, io.ProcessManager)
+          name of .bam file containing aligned reads, name of the gzipped merged fastq
+          file, and a ProcessManager for merged fastq files
+        """
+        log.info("Merging genomic reads and barcode annotations and aligning them.")
+        alignment_directory = dir_ + "/alignments/"
+        os.makedirs(alignment_directory, exist_ok=True)
+        if star_args is not None:
+            star_kwargs = dict(a.strip().split("=") for a in star_args)
+        else:
+            star_kwargs = {}
+
+        with streaming_merge(
+            technology_platform,
+            barcode_fastq,
+            output_stem,
+            genomic_fastq,
+            n_proc,
+            barcode_sidecar,
+        ) as (fifo, merged_fastq):
+            bamfile = star.align(
+                fifo, star_index, n_proc, alignment_directory, **star_kwargs
+            )
+
+        upload_manager = upload_merged_fastq(merged_fastq, aws_upload_key)
+        return bamfile, merged_fastq, upload_manager
 
     def create_read_array(
-        bamfile, index, aws_upload_key, min_poly_t, max_transcript_length
+        bamfile,
+        index,
+        aws_upload_key,
+        min_poly_t,
+        max_transcript_length,
+        bam_reader,
+        barcode_sidecar=None,
     ):
         """Create or download a ReadArray object.
 
@@ -215,17 +418,34 @@ def run(args) -> None:
         :param str index: directory containing index files
         :param str aws_upload_key: key where aws files should be uploaded
         :param int min_poly_t: minimum number of poly_t nucleotides for a read to be valid
+        :param str bam_reader: "samtools" or "native", see ReadArray.from_alignment_file
+        :param str barcode_sidecar: BarcodeSidecar file of the aligned reads, if they
+          were merged with one
         :returns ReadArray, UploadManager: ReadArray object, bamfile ProcessManager
         """
         log.info("Filtering aligned records and constructing record database.")
         # Construct translator
-        translator = GeneIntervals(
+        translator = GeneIntervals.cached(
             index + "annotations.gtf", max_transcript_length=max_transcript_length
         )
         read_array, read_names = ReadArray.from_alignment_file(
-            bamfile, translator, min_poly_t
+            bamfile,
+            translator,
+            min_poly_t,
+            reader=bam_reader,
+            barcode_sidecar=barcode_sidecar,
         )
 
+        upload_manager = store_bamfile(bamfile, aws_upload_key)
+        return read_array, upload_manager, read_names
+
+    def store_bamfile(bamfile, aws_upload_key) -> io.ProcessManager:
+        """upload bamfile to S3, or move it next to the other outputs
+
+        :param str bamfile: filename of .bam file
+        :param str aws_upload_key: key where aws files should be uploaded
+        :return io.ProcessManager: manager for the upload, or None
+        """
         # converting sam to bam and uploading to S3, else removing bamfile
         if aws_upload_key:
             log.info("Uploading bam file to S3.")
@@ -242,7 +462,92 @@ def run(args) -> None:
             #     rm_bamfile = 'rm %s' % bamfile
             #     io.ProcessManager(rm_bamfile).run_all()
             upload_manager = None
-        return read_array, upload_manager, read_names
+        return upload_manager
+
+    def align_and_create_read_array(
+        merged_fastq,
+        dir_,
+        star_args,
+        star_index,
+        n_proc,
+        aws_upload_key,
+        min_poly_t,
+        max_transcript_length,
+        keep_bam,
+        barcode_sidecar=None,
+    ):
+        """Align fastq records and construct a ReadArray from STAR's SAM output as it is
+        produced, without waiting for STAR to write a .bam file.
+
+        :param merged_fastq: str, path to merged .fastq file or named pipe
+        :param dir_: str, stem for output files
+        :param star_args: dict, extra keyword arguments for STAR
+        :param star_index: str, file path to directory containing STAR index, which also
+          contains the annotations.gtf file
+        :param n_proc: int, number of STAR processes to initiate
+        :param aws_upload_key: str, key where aws files should be uploaded. If provided,
+          a .bam file is written and uploaded.
+        :param int min_poly_t: minimum number of poly_t nucleotides for a read to be valid
+        :param max_transcript_length:
+        :param bool keep_bam: if True, a .bam file is written even if it is not uploaded
+        :param str barcode_sidecar: BarcodeSidecar file of the aligned reads, if they
+          were merged with one. It may still be written while STAR is running
+        :returns str, ReadArray, UploadManager, list: name of the .bam file (None if it
+          was not written), ReadArray object, bamfile ProcessManager, read names
+        """
+        log.info(
+            "Aligning merged fastq records, filtering aligned records and constructing "
+            "record database."
+        )
+        translator = GeneIntervals.cached(
+            star_index + "annotations.gtf", max_transcript_length=max_transcript_length
+        )
+        alignment_directory = dir_ + "/alignments/"
+        os.makedirs(alignment_directory, exist_ok=True)
+        if star_args is not None:
+            star_kwargs = dict(a.strip().split("=") for a in star_args)
+        else:
+            star_kwargs = {}
+
+        if keep_bam or aws_upload_key:
+            bamfile = alignment_directory + "Aligned.out.bam"
+            samtools = Popen(
+                ["samtools", "view", "-b", "-o", bamfile, "-"], stdin=PIPE
+            )
+            tee = samtools.stdin
+        else:
+            bamfile, samtools, tee = None, None, None
+
+        alignment = star.AlignmentStream(
+            merged_fastq, star_index, n_proc, alignment_directory, **star_kwargs
+        )
+        reader = sam.StreamReader(alignment.stdout, tee=tee)
+        try:
+            read_array, read_names = ReadArray.from_multialignments(
+                reader.iter_multialignments(), translator, min_poly_t, barcode_sidecar
+            )
+            alignment.wait()
+        except BaseException:
+            if samtools is not None:
+                samtools.kill()
+                samtools.wait()
+                with suppress(OSError):
+                    samtools.stdin.close()
+            # a failed STAR ends its output early; report STAR's error, with its
+            # stderr, instead of what the reader made of the truncated stream
+            alignment.wait()
+            raise
+
+        if samtools is None:
+            return bamfile, read_array, None, read_names
+        samtools.stdin.close()
+        if samtools.wait() != 0:
+            raise ChildProcessError(
+                "samtools exited with status %d while writing %s"
+                % (samtools.returncode, bamfile)
+            )
+        upload_manager = store_bamfile(bamfile, aws_upload_key)
+        return bamfile, read_array, upload_manager, read_names
 
     # ######################## MAIN FUNCTION BEGINS HERE ################################
 
@@ -336,7 +641,7 @@ def run(args) -> None:
 
         if args.platform == "in_drop_v5":
             platform = platform.build_cb2_barcodes(args.barcode_files)
-            log.notify("Built cb2 barcode hash for v5 barcodes.")
+            log.notify("Built cb2 barcode neighbourhood for v5 barcodes.")
 
         if merge:
             if args.min_poly_t is None:  # estimate min_poly_t if it was not provided
@@ -345,9 +650,15 @@ def run(args) -> None:
                 )
                 log.notify("Estimated min_poly_t={!s}".format(args.min_poly_t))
 
-            args.merged_fastq = merge_fastq_files(
-                platform, args.barcode_fastq, args.output_prefix, args.genomic_fastq
-            )
+            if not args.stream_merge:
+                args.merged_fastq = merge_fastq_files(
+                    platform,
+                    args.barcode_fastq,
+                    args.output_prefix,
+                    args.genomic_fastq,
+                    n_processes,
+                    args.barcode_sidecar,
+                )
 
         # SEQC was started from input other than fastq files
         if args.min_poly_t is None:
@@ -357,7 +668,63 @@ def run(args) -> None:
                 "empty --min-poly-t parameter. Continuing with --min-poly-t 0."
             )
 
-        if align:
+        stream_alignment = align and args.stream_alignment
+        if stream_alignment:
+            with ExitStack() as stack:
+                if merge and args.stream_merge:
+                    fastq_input, args.merged_fastq = stack.enter_context(
+                        streaming_merge(
+                            platform,
+                            args.barcode_fastq,
+                            args.output_prefix,
+                            args.genomic_fastq,
+                            n_processes,
+                            args.barcode_sidecar,
+                        )
+                    )
+                else:
+                    fastq_input = args.merged_fastq
+                (
+                    args.alignment_file,
+                    ra,
+                    manage_bamfile,
+                    read_names,
+                ) = align_and_create_read_array(
+                    fastq_input,
+                    output_dir,
+                    args.star_args,
+                    args.index,
+                    n_processes,
+                    args.upload_prefix,
+                    args.min_poly_t,
+                    max_insert_size,
+                    args.keep_bam,
+                    args.barcode_sidecar,
+                )
+
+            upload_merged = args.upload_prefix if merge else None
+            if merge and args.stream_merge:
+                manage_merged = upload_merged_fastq(args.merged_fastq, upload_merged)
+            else:
+                manage_merged = archive_merged_fastq(args.merged_fastq, upload_merged)
+        elif merge and args.stream_merge:
+            (
+                args.alignment_file,
+                args.merged_fastq,
+                manage_merged,
+            ) = merge_and_align_fastq_records(
+                platform,
+                args.barcode_fastq,
+                args.output_prefix,
+                args.genomic_fastq,
+                output_dir,
+                args.star_args,
+                args.index,
+                n_processes,
+                args.upload_prefix,
+                args.barcode_sidecar,
+            )
+        elif align:
             upload_merged = args.upload_prefix if merge else None
             args.alignment_file, manage_merged = align_fastq_records(
                 args.merged_fastq,
@@ -370,7 +737,9 @@ def run(args) -> None:
         else:
             manage_merged = None
 
-        if process_bamfile:
+        if stream_alignment:
+            pass  # ra, manage_bamfile and read_names were produced during alignment
+        elif process_bamfile:
             # if the starting point was a BAM file (i.e. args.alignment_file=*.bam & align=False)
             # do not upload by setting this to None
             upload_bamfile = args.upload_prefix if align else None
@@ -381,12 +750,15 @@ def run(args) -> None:
                 upload_bamfile,
                 args.min_poly_t,
                 max_insert_size,
+                args.bam_reader,
+                args.barcode_sidecar,
             )
         else:
             manage_bamfile = None
-            ra = ReadArray.load(args.read_array)
-            # fixme: the old read_array doesn't have read_names
-            read_names = None
+            with ReadArrayArchive(args.read_array) as archive:
+                ra = archive.to_read_array()
+                # None for read arrays saved without read names
+                read_names = archive.read_names()
 
         # create the first summary section here
         status_filters_section = Section.from_status_filters(
@@ -409,9 +781,15 @@ def run(args) -> None:
                     compression="gzip",
                 )
 
+            if args.sort_read_array:
+                log.info("Sorting read array.")
+                ra.sort()
+
             # Resolve multimapping
             log.info("Resolving ambiguous alignments.")
             mm_results = ra.resolve_ambiguous_alignments()
+            if args.sort_read_array:
+                ra.sort()  # only re-sorts the cells of resolved reads
 
 
 
@@ -438,7 +816,7 @@ def run(args) -> None:
                 ra.filter_low_coverage(alpha=args.low_coverage_alpha)
 
             log.info("Saving read array.")
-            ra.save(args.output_prefix + ".h5")
+            ra.save(args.output_prefix + ".h5", read_names=read_names)
 
             # generate a file with read_name, corrected cb, corrected umi
             # read_name already has pre-corrected cb & umi
@@ -464,8 +842,11 @@ def run(args) -> None:
 
         # filter non-cells
         log.info("Creating counts matrix.")
+        gene_id_map = GeneIntervals.cached_gene_id_map(
+            args.index + "annotations.gtf", max_transcript_length=max_insert_size
+        )
         sp_reads, sp_mols = ra.to_count_matrix(
-            sparse_frame=True, genes_to_symbols=args.index + "annotations.gtf"
+            sparse_frame=True, genes_to_symbols=gene_id_map
         )
 
         # Save sparse matrices
@@ -498,7 +879,7 @@ def run(args) -> None:
             molecules_lost,
             cells_lost,
             cell_description,
-        ) = filter.create_filtered_dense_count_matrix(
+        ) = filter.create_filtered_count_matrix(
             sp_mols,
             sp_reads,
             mini_summary_d,
@@ -520,6 +901,10 @@ def run(args) -> None:
             args.output_prefix + "_sparse_counts_genes.csv",
         ]
 
+        # the merged fastq and bam files name reads by their ordinal in the barcode
+        # sidecar; when merging, it was uploaded with the merged fastq
+        if args.barcode_sidecar and not merge:
+            files.append(args.barcode_sidecar)
         if os.path.exists(args.output_prefix + "_cb-correction.csv.gz"):
             files.append(args.output_prefix + "_cb-correction.csv.gz")
         if os.path.exists(args.output_prefix + "_umi-correction.csv.gz"):
@@ -587,12 +972,23 @@ def run(args) -> None:
         files += [de_gene_list_file]
 
         # adding the cluster column and write down gene-cell count matrix
-        dense_csv = args.output_prefix + "_dense.csv"
-        sp_csv.insert(
-            loc=0, column="CLUSTER", value=seqc_mini_summary.get_clustering_result()
-        )
-        sp_csv.to_csv(dense_csv)
-        files += [dense_csv]
+        clusters = np.asarray(seqc_mini_summary.get_clustering_result())
+        if args.filtered_output == "mtx":
+            filtered_mtx = args.output_prefix + "_filtered_counts.mtx"
+            scipy.io.mmwrite(filtered_mtx, sp_csv.data)
+            # row number, barcode, cluster
+            filtered_barcodes = args.output_prefix + "_filtered_counts_barcodes.csv"
+            df = np.array([np.arange(sp_csv.shape[0]), sp_csv.index, clusters]).T
+            np.savetxt(filtered_barcodes, df, fmt="%d", delimiter=",")
+            # column number, gene
+            filtered_genes = args.output_prefix + "_filtered_counts_genes.csv"
+            df = np.array([np.arange(sp_csv.shape[1]), sp_csv.columns]).T
+            np.savetxt(filtered_genes, df, fmt="%s", delimiter=",")
+            files += [filtered_mtx, filtered_barcodes, filtered_genes]
+        else:
+            dense_csv = args.output_prefix + "_dense.csv"
+            sp_csv.to_csv(dense_csv, leading_columns={"CLUSTER": clusters})
+            files += [dense_csv]
 
         if args.upload_prefix:
             # Upload count matrices files, logs, and return
@@ -42,13 +42,21 @@ def estimate_required_volume_size(args):
     # using worst-case estimates to make sure we don't run out of space, 35 = genome index
     total = (35 * 1e10) + sum(validate_and_return_size(f) for f in args.barcode_files)
 
+    # streaming the merge into STAR never writes the uncompressed merged fastq, which
+    # accounts for roughly 5x the size of the gzipped input
+    fastq_multiplier = 9 if getattr(args, "stream_merge", False) else 14
+
     # todo stopped here; remove aws dependency
     if args.barcode_fastq and args.genomic_fastq:
         total += (
-            sum(validate_and_return_size(f) for f in args.barcode_fastq) * 14 + 9e10
+            sum(validate_and_return_size(f) for f in args.barcode_fastq)
+            * fastq_multiplier
+            + 9e10
         )
         total += (
-            sum(validate_and_return_size(f) for f in args.genomic_fastq) * 14 + 9e10
+            sum(validate_and_return_size(f) for f in args.genomic_fastq)
+            * fastq_multiplier
+            + 9e10
         )
         total += validate_and_return_size(args.index)
 
@@ -72,7 +80,9 @@ def estimate_required_volume_size(args):
 
         io.BaseSpace.check_sample(args.basespace, args.basespace_token)
         total += (
-            io.BaseSpace.check_size(args.basespace, args.basespace_token) * 14 + 9e10
+            io.BaseSpace.check_size(args.basespace, args.basespace_token)
+            * fastq_multiplier
+            + 9e10
         )
 
     return ceil(total * 1e-9)
@@ -38,13 +38,22 @@ def estimate_min_poly_t(fastq_files: list, platform) -> int:
     return min(min_vals)
 
 
+def _cell_totals(counts):
+    """return the total count of each row (cell) of a sparse count matrix
+
+    :param counts: scipy.sparse matrix, cells x genes
+    :return np.ndarray: row sums
+    """
+    return np.ravel(counts.sum(axis=1))
+
+
 def low_count(molecules, is_invalid, plot=False, ax=None):
     """
     updates is_invalid to reflect cells whose molecule counts are below the inflection
     point of an ecdf constructed from cell molecule counts. Typically this reflects cells
     whose molecule counts are approximately <= 100.
 
-    :param molecules: scipy.stats.coo_matrix, molecule count matrix
+    :param molecules: scipy.sparse.csr_matrix (or coo_matrix), molecule count matrix
     :param is_invalid:  np.ndarray(dtype=bool), declares valid and invalid cells
     :param bool plot: if True, plot a summary of the filter
     :param ax: Must be passed if plot is True. Indicates the axis on which to plot the
@@ -53,7 +62,7 @@ def low_count(molecules, is_invalid, plot=False, ax=None):
     """
 
     # copy, sort, and normalize molecule sums
-    ms = np.ravel(molecules.tocsr()[~is_invalid, :].sum(axis=1))
+    ms = _cell_totals(molecules)[~is_invalid]
     idx = np.argsort(ms)[::-1]  # largest cells first
     norm_ms = ms[idx] / ms[idx].sum()  # sorted, normalized array
 
@@ -108,8 +117,8 @@ def low_coverage(molecules, reads, is_invalid, plot=False, ax=None, filter_on=Tr
 
     For best results, should be run after filter.low_count()
 
-    :param molecules: scipy.stats.coo_matrix, molecule count matrix
-    :param reads: scipy.stats.coo_matrix, read count matrix
+    :param molecules: scipy.sparse.csr_matrix (or coo_matrix), molecule count matrix
+    :param reads: scipy.sparse.csr_matrix (or coo_matrix), read count matrix
     :param is_invalid:  np.ndarray(dtype=bool), declares valid and invalid cells
     :param bool plot: if True, plot a summary of the filter
     :param ax: Must be passed if plot is True. Indicates the axis on which to plot the
@@ -117,8 +126,8 @@ def low_coverage(molecules, reads, is_invalid, plot=False, ax=None, filter_on=Tr
     :param filter_on: indicate whether low coverage filter is on
     :return: is_invalid, np.ndarray(dtype=bool), updated valid and invalid cells
     """
-    ms = np.ravel(molecules.tocsr()[~is_invalid, :].sum(axis=1))
-    rs = np.ravel(reads.tocsr()[~is_invalid, :].sum(axis=1))
+    ms = _cell_totals(molecules)[~is_invalid]
+    rs = _cell_totals(reads)[~is_invalid]
 
     if ms.shape[0] < 10 or rs.shape[0] < 10:
         log.notify(
@@ -207,7 +216,7 @@ def high_mitochondrial_rna(
     Sets any cell with a fraction of mitochondrial mRNA greater than max_mt_content to
     invalid.
 
-    :param molecules: scipy.stats.coo_matrix, molecule count matrix
+    :param molecules: scipy.sparse.csr_matrix (or coo_matrix), molecule count matrix
     :param gene_ids: np.ndarray(dtype=str) containing string gene identifiers
     :param is_invalid:  np.ndarray(dtype=bool), declares valid and invalid cells
     :param max_mt_content: float, maximum percentage of reads that can come from
@@ -220,10 +229,8 @@ def high_mitochondrial_rna(
     """
     # identify % genes that are mitochondrial
     mt_genes = np.fromiter(map(lambda x: x.startswith("MT-"), gene_ids), dtype=np.bool)
-    mt_molecules = np.ravel(
-        molecules.tocsr()[~is_invalid, :].tocsc()[:, mt_genes].sum(axis=1)
-    )
-    ms = np.ravel(molecules.tocsr()[~is_invalid, :].sum(axis=1))
+    mt_molecules = np.ravel(molecules.tocsr() @ mt_genes)[~is_invalid]
+    ms = _cell_totals(molecules)[~is_invalid]
     ratios = mt_molecules / ms
 
     if filter_on:
@@ -278,7 +285,7 @@ def low_gene_abundance(molecules, is_invalid, plot=False, ax=None, filter_on=Tru
     of molecules detected. Cells with a lower than expected number of detected genes
     are set as invalid.
 
-    :param molecules: scipy.stats.coo_matrix, molecule count matrix
+    :param molecules: scipy.sparse.csr_matrix (or coo_matrix), molecule count matrix
     :param is_invalid:  np.ndarray(dtype=bool), declares valid and invalid cells
     :param bool plot: if True, plot a summary of the filter
     :param ax: Must be passed if plot is True. Indicates the axis on which to plot the
@@ -286,8 +293,8 @@ def low_gene_abundance(molecules, is_invalid, plot=False, ax=None, filter_on=Tru
     :return: is_invalid, np.ndarray(dtype=bool), updated valid and invalid cells
     """
 
-    ms = np.ravel(molecules.tocsr()[~is_invalid, :].sum(axis=1))
-    genes = np.ravel(molecules.tocsr()[~is_invalid, :].getnnz(axis=1))
+    ms = _cell_totals(molecules)[~is_invalid]
+    genes = molecules.tocsr().getnnz(axis=1)[~is_invalid]
     x = np.log10(ms)[:, np.newaxis]
     y = np.log10(genes)
 
@@ -341,7 +348,7 @@ def low_gene_abundance(molecules, is_invalid, plot=False, ax=None, filter_on=Tru
     return is_invalid
 
 
-def create_filtered_dense_count_matrix(
+def create_filtered_count_matrix(
     molecules: SparseFrame,
     reads: SparseFrame,
     mini_summary_d,
@@ -355,20 +362,26 @@ def create_filtered_dense_count_matrix(
 ):
     """
     filter cells with low molecule counts, low read coverage, high mitochondrial content,
-    and low gene detection. Returns a dense pd.DataFrame of filtered counts, the total
+    and low gene detection. Returns a SparseFrame of filtered counts, the total
     original number of molecules (int), the number of molecules lost with each filter
-    (dict), and the number of cells lost with each filter (dict).
+    (dict), the number of cells lost with each filter (dict) and a description of the
+    molecule counts of the retained cells (pd.Series).
+
+    The count matrices are converted to csr once and every filter works on that
+    instance; genes without molecules in any retained cell are dropped from the result.
+    SparseFrame.to_csv() writes the result as a dense csv without materializing it.
 
     :param filter_mitochondrial_rna: if True, run the mitochondrial RNA filter.
     :param filter_low_count: if True, run the low count cell filter.
     :param filter_low_coverage: if True, run the low coverage filter.
+    :param filter_low_gene_abundance: if True, run the low gene abundance filter.
     :param molecules: SparseFrame
     :param reads: SparseFrame
     :param max_mt_content: the maximum percentage of mitochondrial RNA that is
     :param plot: if True, plot filtering summaries.
     :param figname: if plot is True, name of the figure to save.
     :param mini_summary_d: dictionary to store output parameters for the mini summary.
-    :return: (pd.DataFrame, int, dict, dict)
+    :return: (SparseFrame, int, dict, dict, pd.Series)
     """
 
     cells_lost = OrderedDict()
@@ -388,17 +401,17 @@ def create_filtered_dense_count_matrix(
         raise ValueError("Parameter max_mt_content must be in the interval [0, 1]")
 
     # set data structures and original molecule counts
-    molecules_data = molecules.data
-    reads_data = reads.data
+    molecules_data = molecules.data.tocsr()
+    reads_data = reads.data.tocsr()
     molecules_columns = molecules.columns
     is_invalid = np.zeros(molecules_data.shape[0], np.bool)
-    total_molecules = np.sum(molecules_data.sum(axis=1))
+    cell_molecules = _cell_totals(molecules_data)
+    total_molecules = np.sum(cell_molecules)
 
-    def additional_loss(new_filter, old_filter, data_matrix):
+    def additional_loss(new_filter, old_filter):
         new_cell_loss = np.sum(new_filter) - np.sum(old_filter)
-        data_matrix = data_matrix.tocsr()
-        total_molecule_loss = data_matrix[new_filter].sum().sum()
-        old_molecule_loss = data_matrix[old_filter].sum().sum()
+        total_molecule_loss = cell_molecules[new_filter].sum()
+        old_molecule_loss = cell_molecules[old_filter].sum()
         new_molecule_loss = total_molecule_loss - old_molecule_loss
         return new_cell_loss, new_molecule_loss
 
@@ -408,15 +421,14 @@ def create_filtered_dense_count_matrix(
     else:
         fig, ax_count, ax_cov, ax_mt, ax_gene = [None] * 5  # dummy figure
 
-    ms = np.ravel(molecules_data.tocsr()[~is_invalid, :].sum(axis=1)).sum()
-    rs = np.ravel(reads_data.tocsr()[~is_invalid, :].sum(axis=1)).sum()
-    mini_summary_d["avg_reads_per_molc"] = rs / ms
+    rs = _cell_totals(reads_data).sum()
+    mini_summary_d["avg_reads_per_molc"] = rs / total_molecules
 
     # filter low counts
     if filter_low_count:
         count_invalid = low_count(molecules_data, is_invalid, plot, ax_count)
         cells_lost["low_count"], molecules_lost["low_count"] = additional_loss(
-            count_invalid, is_invalid, molecules_data
+            count_invalid, is_invalid
         )
     else:
         count_invalid = is_invalid
@@ -426,7 +438,7 @@ def create_filtered_dense_count_matrix(
         molecules_data, reads_data, count_invalid, plot, ax_cov, filter_low_coverage
     )
     cells_lost["low_coverage"], molecules_lost["low_coverage"] = additional_loss(
-        cov_invalid, count_invalid, molecules_data
+        cov_invalid, count_invalid
     )
 
     # filter high_mt_content if requested
@@ -441,7 +453,7 @@ def create_filtered_dense_count_matrix(
         filter_mitochondrial_rna,
     )
     cells_lost["high_mt"], molecules_lost["high_mt"] = additional_loss(
-        mt_invalid, cov_invalid, molecules_data
+        mt_invalid, cov_invalid
     )
 
     # filter low gene abundance
@@ -451,25 +463,44 @@ def create_filtered_dense_count_matrix(
     (
         cells_lost["low_gene_detection"],
         molecules_lost["low_gene_detection"],
-    ) = additional_loss(gene_invalid, mt_invalid, molecules_data)
-
-    # construct dense matrix
-    dense = molecules_data.tocsr()[~gene_invalid, :].todense()
-    nonzero_gene_count = np.ravel(np.array(dense.sum(axis=0) != 0))
-    dense = dense[:, nonzero_gene_count]
-    dense = pd.DataFrame(
-        dense,
+    ) = additional_loss(gene_invalid, mt_invalid)
+
+    # construct filtered matrix, dropping genes absent from all retained cells
+    filtered = molecules_data[~gene_invalid, :]
+    nonzero_gene_count = np.ravel(filtered.sum(axis=0)) != 0
+    filtered = SparseFrame(
+        filtered[:, nonzero_gene_count].tocoo(),
         index=molecules.index[~gene_invalid],
         columns=molecules.columns[nonzero_gene_count],
     )
 
-    mini_summary_d["avg_reads_per_cell"] = rs / len(dense.index)
+    mini_summary_d["avg_reads_per_cell"] = rs / filtered.shape[0]
 
     # describe cells
-    cell_description = dense.sum(axis=1).describe()
+    cell_description = pd.Series(_cell_totals(filtered.data)).describe()
 
     if plot:
         fig.tight_layout()
         fig.savefig(figname, dpi=300, transparent=True)
 
-    return dense, total_molecules, molecules_lost, cells_lost, cell_description
+    return filtered, total_molecules, molecules_lost, cells_lost, cell_description
+
+
+def create_filtered_dense_count_matrix(
+    molecules: SparseFrame, reads: SparseFrame, *args, **kwargs
+):
+    """
+    run create_filtered_count_matrix() and return the filtered counts as a dense
+    pd.DataFrame. Prefer create_filtered_count_matrix() for large experiments; the dense
+    matrix holds every cell x gene entry in memory.
+
+    :param molecules: SparseFrame
+    :param reads: SparseFrame
+    :param args: positional arguments passed to create_filtered_count_matrix()
+    :param kwargs: keyword arguments passed to create_filtered_count_matrix()
+    :return: (pd.DataFrame, int, dict, dict, pd.Series)
+    """
+    filtered, *results = create_filtered_count_matrix(
+        molecules, reads, *args, **kwargs
+    )
+    return (filtered.to_dataframe(), *results)
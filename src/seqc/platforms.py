@@ -3,9 +3,11 @@ from seqc import rmt_correction
 from seqc import barcode_correction
 import regex as re
 from seqc.sequence.encodings import DNA3Bit
+from seqc.sequence.read_structure import ReadStructure
+from seqc.sequence.spacer import SpacerLocator
 from seqc import log
-import itertools
-from seqc.sequence.encodings import DNA3Bit
+import numpy as np
+from seqc.sequence.barcodes import BarcodeIndex
 
 # todo REMOVE POOL FROM ALL THESE CLASSES
 
@@ -14,6 +16,10 @@ class AbstractPlatform:
 
     __metaclass__ = ABCMeta
 
+    # ReadStructure of the barcode read, for platforms whose barcode reads have a fixed
+    # layout; used by merge_batch() to merge whole batches of records at once
+    read_structure = None
+
     def __init__(
         self, barcodes_len, filter_lonely_triplets=False, filter_low_count=True
     ):
@@ -90,6 +96,29 @@ class AbstractPlatform:
         """
         pass
 
+    def merge_batch(self, genomic, barcode=None, counts=None):
+        """merge a batch of genomic records with the barcode records of the same reads
+
+        Platforms that declare a read_structure merge the batch with vectorized
+        slicing, as long as its barcode reads share one length; otherwise
+        self.merge_function is called for each record.
+
+        :param FastqBatch genomic: genomic records
+        :param FastqBatch barcode: barcode records, or None
+        :param collections.Counter counts: optional counter of merge statistics;
+          platforms that locate a spacer add the number of reads that took each path
+        :return bytes: merged records
+        """
+        if self.read_structure is not None and barcode is not None:
+            merged = self.read_structure.annotate(genomic, barcode)
+            if merged is not None:
+                return merged
+        if barcode is None:
+            return b"".join(bytes(self.merge_function(g)) for g in genomic)
+        return b"".join(
+            bytes(self.merge_function(g, b)) for g, b in zip(genomic, barcode)
+        )
+
     @abstractmethod
     def primer_length(self):
         """Defines an abstract method for the primer length, which is specific to each
@@ -130,7 +159,54 @@ class AbstractPlatform:
         pass
 
 
+def _in_drop_annotations(locator, barcode, rmt_len, counts=None):
+    """build the annotations of a batch of in-drop v1/v2 barcode reads
+
+    Reads whose spacer is found at its fixed offset keep their poly-T tail; reads
+    located by the fuzzy search have an empty tail, as with the regular expression
+    they replace.
+
+    :param SpacerLocator locator: spacer locator of the platform
+    :param FastqBatch barcode: barcode records
+    :param int rmt_len: length of the rmt
+    :param collections.Counter counts: optional counter of spacer paths
+    :return [bytes]: b":".join((b"", cell, rmt, poly_t)) of each read
+    """
+    cb1_lengths, paths = locator.locate(barcode)
+    if counts is not None:
+        counts.update(locator.count_paths(paths))
+    spacer_len = len(locator.spacer)
+    annotations = []
+    for (_, seq, _, _), cb1_len, path in zip(
+        barcode.records(), cb1_lengths.tolist(), paths.tolist()
+    ):
+        if path == locator.FAILED:
+            annotations.append(b":::")
+            continue
+        seq = seq[:-1]
+        cb2 = cb1_len + spacer_len
+        rmt = cb2 + 8
+        poly_t = rmt + rmt_len
+        annotations.append(
+            b":".join(
+                (
+                    b"",
+                    seq[:cb1_len] + seq[cb2:rmt],
+                    seq[rmt:poly_t],
+                    seq[poly_t:] if path == locator.EXACT else b"",
+                )
+            )
+        )
+    return annotations
+
+
 class in_drop(AbstractPlatform):
+
+    spacer_locator = SpacerLocator(b"GAGTGATTGCTTGTGACGCCTT", min_trailing=14)
+    _spacer_pattern = re.compile(
+        b"(.{8,11}?)(GAGTGATTGCTTGTGACGCCTT){s<=2}(.{8})(.{6})(.*?)"
+    )
+
     def __init__(self):
         AbstractPlatform.__init__(self, [-1, 8])
 
@@ -184,14 +260,11 @@ class in_drop(AbstractPlatform):
         :param b: barcode fastq sequence data
         :return: annotated genomic sequence.
         """
-        pattern = re.compile(
-            b"(.{8,11}?)(GAGTGATTGCTTGTGACGCCTT){s<=2}(.{8})(.{6})(.*?)"
-        )
         cell, rmt, poly_t = self.check_spacer(b.sequence[:-1])
         if not cell:
             try:
                 cell1, spacer, cell2, rmt, poly_t = re.match(
-                    pattern, b.sequence[:-1]
+                    self._spacer_pattern, b.sequence[:-1]
                 ).groups()
                 cell = cell1 + cell2
             except AttributeError:
@@ -199,6 +272,22 @@ class in_drop(AbstractPlatform):
         g.add_annotation((b"", cell, rmt, poly_t))
         return g
 
+    def merge_batch(self, genomic, barcode=None, counts=None):
+        """merge a batch of in-drop v1 reads; equivalent to calling merge_function
+        for each record, but the spacer of all reads is located at once
+
+        :param FastqBatch genomic: genomic records
+        :param FastqBatch barcode: barcode records
+        :param collections.Counter counts: optional counter of spacer paths
+        :return bytes: merged records
+        """
+        if barcode is None:
+            return super().merge_batch(genomic, barcode, counts)
+        annotations = _in_drop_annotations(
+            self.spacer_locator, barcode, 6, counts
+        )
+        return genomic.annotate(annotations)
+
     def apply_barcode_correction(self, ra, barcode_files):
         """
         Apply barcode correction and return error rate
@@ -225,6 +314,12 @@ class in_drop(AbstractPlatform):
 
 
 class in_drop_v2(AbstractPlatform):
+
+    spacer_locator = SpacerLocator(b"GAGTGATTGCTTGTGACGCCAA", min_trailing=16)
+    _spacer_pattern = re.compile(
+        b"(.{8,11}?)(GAGTGATTGCTTGTGACGCCAA){s<=2}(.{8})(.{8})(.*?)"
+    )
+
     def __init__(self):
         AbstractPlatform.__init__(self, [-1, 8])
 
@@ -278,14 +373,11 @@ class in_drop_v2(AbstractPlatform):
         :param b: barcode fastq sequence data
         :return: annotated genomic sequence.
         """
-        pattern = re.compile(
-            b"(.{8,11}?)(GAGTGATTGCTTGTGACGCCAA){s<=2}(.{8})(.{8})(.*?)"
-        )
         cell, rmt, poly_t = self.check_spacer(b.sequence[:-1])
         if not cell:
             try:
                 cell1, spacer, cell2, rmt, poly_t = re.match(
-                    pattern, b.sequence[:-1]
+                    self._spacer_pattern, b.sequence[:-1]
                 ).groups()
                 cell = cell1 + cell2
             except AttributeError:
@@ -293,6 +385,22 @@ class in_drop_v2(AbstractPlatform):
         g.add_annotation((b"", cell, rmt, poly_t))
         return g
 
+    def merge_batch(self, genomic, barcode=None, counts=None):
+        """merge a batch of in-drop v2 reads; equivalent to calling merge_function
+        for each record, but the spacer of all reads is located at once
+
+        :param FastqBatch genomic: genomic records
+        :param FastqBatch barcode: barcode records
+        :param collections.Counter counts: optional counter of spacer paths
+        :return bytes: merged records
+        """
+        if barcode is None:
+            return super().merge_batch(genomic, barcode, counts)
+        annotations = _in_drop_annotations(
+            self.spacer_locator, barcode, 8, counts
+        )
+        return genomic.annotate(annotations)
+
     def apply_barcode_correction(self, ra, barcode_files):
         """
         Apply barcode correction and return error rate
@@ -412,13 +520,25 @@ class in_drop_v4(AbstractPlatform):
 
 
 class in_drop_v5(AbstractPlatform):
+
+    # only the fixed-offset test of check_spacer(); the identifier window lies in the
+    # part of the spacer shared with in-drop v1
+    spacer_locator = SpacerLocator(b"GAGTGATTGCTTGTGACGCCTT", fuzzy=False)
+
     def __init__(self, potential_barcodes=None):
+        """
+        :param BarcodeIndex | Iterable potential_barcodes: index of the encoded cb2
+          that check_cb2 accepts, see build_cb2_barcodes(), or an iterable of their
+          sequences
+        """
         AbstractPlatform.__init__(self, [-1, 8])
-        self.potential_barcodes = potential_barcodes
-        if self.potential_barcodes is not None:
-            self.potential_encoded_bcs = set(
-                DNA3Bit.encode(pb) for pb in self.potential_barcodes
+        if potential_barcodes is not None and not isinstance(
+            potential_barcodes, BarcodeIndex
+        ):
+            potential_barcodes = BarcodeIndex(
+                DNA3Bit.encode(pb) for pb in potential_barcodes
             )
+        self.potential_barcodes = potential_barcodes
 
     @classmethod
     def check_spacer(cls, sequence):
@@ -454,11 +574,12 @@ class in_drop_v5(AbstractPlatform):
         """
 
         # Check for cb2 length
-        if rest[:8] in self.potential_barcodes:
+        is_cb2_8, is_cb2_9 = self.is_potential_cb2([rest[:8], rest[:9]])
+        if is_cb2_8:
             cb2 = rest[:8]
             rmt = rest[8:16]
             poly_t = rest[16:]
-        elif rest[:9] in self.potential_barcodes:
+        elif is_cb2_9:
             cb2 = rest[:9]
             rmt = rest[9:17]
             poly_t = rest[17:]
@@ -467,36 +588,39 @@ class in_drop_v5(AbstractPlatform):
 
         return cb2, rmt, poly_t
 
+    def is_potential_cb2(self, sequences):
+        """vectorized membership test of sequences in self.potential_barcodes
+
+        :param list sequences: bytes sequences
+        :return np.ndarray: boolean array, True where the sequence is a potential cb2
+        """
+        sequences = np.array(sequences, dtype=np.bytes_)
+        if not sequences.size or not sequences.itemsize:
+            return np.zeros(len(sequences), dtype=bool)
+        # only sequences of A, C, G, T and N (and the padding of shorter sequences)
+        # can be encoded; no other sequence is a potential cb2
+        chars = sequences.view(np.uint8).reshape(len(sequences), -1)
+        alphabet = np.frombuffer(b"ACGTN\0", dtype=np.uint8)
+        encodable = np.all(np.isin(chars, alphabet), axis=1)
+        codes = DNA3Bit.encode_array(np.where(encodable, sequences, b""))
+        return encodable & self.potential_barcodes.contains_many(codes)
+
     @classmethod
-    def build_cb2_barcodes(cls, barcode_files, max_ed=1):
+    def build_cb2_barcodes(cls, barcode_files, max_ed=1, cache_dir=None):
         """
-        build a set of valid and invalid barcodes used to determine
-        length of cb2 in self.check_cb2
+        build the index of valid barcodes and their max_ed-mismatch variants used to
+        determine the length of cb2 in self.check_cb2. The index is cached next to the
+        cb2 barcode file (or in cache_dir) and memory-mapped by subsequent runs
 
         :param barcode_files: Valid barcodes files
         :param max_ed: number of allowable mismatches
+        :param cache_dir: directory of the cache file, see
+          BarcodeIndex.neighbourhood_cache_filename()
         :returns: new class with potential barcodes set
         """
-
-        # Build set of all potential correct and incorrect cb2
-        potential_barcodes = set()
-        cb2_file = barcode_files[1]
-        with open(cb2_file, "r") as f:
-            valid_barcodes = set([line.strip() for line in f.readlines()])
-        # This will work for any number of allowable mismatches
-        for bc in valid_barcodes:
-            potential_barcodes.add(bc)
-            for inds in itertools.combinations(range(len(bc)), max_ed):
-                invalid_bc = [[nt] for nt in bc]
-                for ind in inds:
-                    valid_nt = bc[ind]
-                    invalid_bc[ind] = [
-                        nt for nt in ["A", "C", "G", "T", "N"] if nt != valid_nt
-                    ]
-                for mut in itertools.product(*invalid_bc):
-                    potential_barcodes.add("".join(mut))
-        potential_barcodes = set([pb.encode() for pb in potential_barcodes])
-
+        potential_barcodes = BarcodeIndex.cached_neighbourhood(
+            barcode_files[1], max_ed, cache_dir
+        )
         return cls(potential_barcodes=potential_barcodes)
 
     def primer_length(self):
@@ -528,26 +652,65 @@ class in_drop_v5(AbstractPlatform):
         g.add_annotation((b"", cell, rmt, poly_t))
         return g
 
+    def merge_batch(self, genomic, barcode=None, counts=None):
+        """merge a batch of in-drop v5 reads; equivalent to calling merge_function
+        for each record, but the spacer of all reads is located at once
+
+        :param FastqBatch genomic: genomic records
+        :param FastqBatch barcode: barcode records
+        :param collections.Counter counts: optional counter of spacer paths
+        :return bytes: merged records
+        """
+        if barcode is None:
+            return super().merge_batch(genomic, barcode, counts)
+        locator = self.spacer_locator
+        cb1_lengths, paths = locator.locate(barcode)
+        if counts is not None:
+            counts.update(locator.count_paths(paths))
+        spacer_len = len(locator.spacer)
+        found = paths != locator.FAILED
+        sequences = [seq[:-1] for _, seq, _, _ in barcode.records()]
+        rests = [
+            seq[cb1_len + spacer_len :]
+            for seq, cb1_len, ok in zip(sequences, cb1_lengths.tolist(), found)
+            if ok
+        ]
+        # the cb2 length of all reads at once, as check_cb2 determines it
+        is_cb2_8 = self.is_potential_cb2([rest[:8] for rest in rests]).tolist()
+        is_cb2_9 = self.is_potential_cb2([rest[:9] for rest in rests]).tolist()
+        cb2_lengths = iter(
+            8 if i8 else 9 if i9 else 0 for i8, i9 in zip(is_cb2_8, is_cb2_9)
+        )
+        rests = iter(rests)
+        annotations = []
+        for seq, cb1_len, ok in zip(sequences, cb1_lengths.tolist(), found.tolist()):
+            if not ok:
+                annotations.append(b":::")
+                continue
+            rest, cb2_len = next(rests), next(cb2_lengths)
+            if not cb2_len:
+                annotations.append(b":::")
+                continue
+            cell = seq[:cb1_len] + rest[:cb2_len]
+            rmt = rest[cb2_len : cb2_len + 8]
+            annotations.append(b":".join((b"", cell, rmt, rest[cb2_len + 8 :])))
+        return genomic.annotate(annotations)
+
     def extract_barcodes(self, seq):
         """
         Return a list of barcodes from the sequence. A bit hacky right now.
-        Specific to v5 platform.
-        """
-        res = []
-        for bc_len in reversed(self._barcodes_lengths):
-            if bc_len == -1:  # Return the rest of the MSb's
-                res.insert(0, seq)
-                return res
-            potent_cb2 = seq & ((1 << bc_len * DNA3Bit.bits_per_base()) - 1)
-            # First assume it is length 8 through self._barcodes_lengths, then
-            # if it isn't in potentials, assume 9.
-            if potent_cb2 not in self.potential_encoded_bcs:
-                potent_cb2 = seq & ((1 << 9 * DNA3Bit.bits_per_base()) - 1)
-                bc_len = 9
-            res.insert(0, seq & ((1 << bc_len * DNA3Bit.bits_per_base()) - 1))
-            seq >>= bc_len * DNA3Bit.bits_per_base()
-
-        return res
+        Specific to v5 platform: cb2 is assumed to be 8 bases long, unless those are
+        not a potential cb2, in which case it is 9 bases long. seq may be an array of
+        encoded cells, in which case arrays of barcodes are returned.
+        """
+        bits = DNA3Bit.bits_per_base()
+        mask = (1 << 8 * bits) - 1
+        if isinstance(seq, np.ndarray):
+            is_cb2_8 = self.potential_barcodes.contains_many(seq & mask)
+            cb2_len = np.where(is_cb2_8, 8, 9) * bits
+        else:
+            cb2_len = (8 if seq & mask in self.potential_barcodes else 9) * bits
+        return [seq >> cb2_len, seq & ((1 << cb2_len) - 1)]
 
     def apply_barcode_correction(self, ra, barcode_files):
         """
@@ -575,6 +738,9 @@ class in_drop_v5(AbstractPlatform):
 
 
 class drop_seq(AbstractPlatform):
+
+    read_structure = ReadStructure("12C 8U *T")
+
     def __init__(self):
         AbstractPlatform.__init__(self, [12])
 
@@ -827,6 +993,8 @@ class ten_x(AbstractPlatform):
 class ten_x_v2(AbstractPlatform):
     # 10X version 2 chemistry
 
+    read_structure = ReadStructure("16C 10U *T")
+
     def __init__(self):
         AbstractPlatform.__init__(self, [16])
 
@@ -888,6 +1056,7 @@ class ten_x_v3(AbstractPlatform):
         self.cb_len = 16
         # 12 bp for molecular barcode (RMT/UMI)
         self.mb_len = 12
+        self.read_structure = ReadStructure("%dC %dU *T" % (self.cb_len, self.mb_len))
         AbstractPlatform.__init__(self, [self.cb_len])
 
     def primer_length(self):
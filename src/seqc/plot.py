@@ -587,7 +587,7 @@ class Diagnostics:
         if f is None:
             f = plt.gcf()
 
-        cell_size = data.sum(axis=1)
+        cell_size = np.ravel(data.sum(axis=1))
 
         plt.hist(np.log10(cell_size), bins=25, log=True)
         ax.set_xlabel("log10(cell size)")
@@ -2,15 +2,344 @@ import numpy as np
 import pandas as pd
 from seqc.alignment import sam
 from seqc.sequence.encodings import DNA3Bit
-from scipy.sparse import coo_matrix, csr_matrix
+from seqc.sequence.sidecar import BarcodeSidecar
+from scipy.sparse import csr_matrix
 import seqc.sequence.barcodes
 import tables as tb
 from itertools import permutations
-from seqc import multialignment
 from seqc.sparse_frame import SparseFrame
 from seqc import log
 from scipy.stats import hypergeom
 from collections import OrderedDict
+from numba import njit
+
+
+class _GrowableArray:
+    """1-d np.ndarray buffer with amortized O(1) appends; capacity doubles when full"""
+
+    def __init__(self, dtype, capacity=1 << 16):
+        self._array = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        if self._size == self._array.shape[0]:
+            self._reserve(self._size + 1)
+        self._array[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._array.dtype)
+        end = self._size + values.shape[0]
+        if end > self._array.shape[0]:
+            self._reserve(end)
+        self._array[self._size : end] = values
+        self._size = end
+
+    def _reserve(self, capacity):
+        capacity = max(capacity, 2 * self._array.shape[0])
+        array = np.empty(capacity, dtype=self._array.dtype)
+        array[: self._size] = self._array[: self._size]
+        self._array = array
+
+    def finalize(self):
+        """trim excess capacity and return the filled array; the buffer is emptied"""
+        array = self._array
+        array.resize(self._size, refcheck=False)
+        self._array = np.empty(0, dtype=array.dtype)
+        self._size = 0
+        return array
+
+
+class ReadArrayBuilder:
+    """Incrementally construct a ReadArray from multialignments in a single pass.
+
+    Columns are appended to growable buffers as alignments arrive, so the number of
+    reads does not need to be known in advance. Barcodes are encoded and alignments
+    are translated into genes in batches. Because alignments are appended in
+    read order, the CSR genes and positions matrices are assembled directly from the
+    per-read alignment counts when the builder is finalized.
+
+    usage:
+    builder = ReadArrayBuilder(translator)
+    for ma in sam.Reader(samfile).iter_multialignments():
+        builder.add_multialignment(ma)
+    ra, read_names = builder.to_read_array(required_poly_t)
+
+    If the reads were merged with a BarcodeSidecar, read names are read ordinals and
+    the barcodes of each read are looked up in the sidecar instead of being parsed
+    from its name.
+    """
+
+    # barcodes are encoded, and alignments translated, in batches of this many reads
+    _batch_size = 1 << 16
+
+    def __init__(self, translator, barcode_sidecar=None):
+        """
+        :param GeneIntervals translator: translator created from the .gtf annotation
+          file corresponding to the genome against which the reads were aligned
+        :param str barcode_sidecar: optional BarcodeSidecar file of the merged reads.
+          It is only read when the builder is finalized, so it may still be written
+          while alignments are added
+        """
+        self._translator = translator
+        self._barcode_sidecar = barcode_sidecar
+        self._ordinal = _GrowableArray(np.int64)
+        self._cell = _GrowableArray(np.int64)
+        self._rmt = _GrowableArray(np.int64)
+        self._n_poly_t = _GrowableArray(np.uint8)
+        self._n_alignments = _GrowableArray(np.int32)  # gene-assigned alignments
+        self._gene = _GrowableArray(np.int32)
+        self._position = _GrowableArray(np.int32)
+        self._read_names = []
+        self._pending_cells = []
+        self._pending_rmts = []
+        self._pending_chromosomes = []
+        self._pending_strands = []
+        self._pending_positions = []
+        self._pending_reads = []  # index of each pending alignment's read in the batch
+
+    def __len__(self):
+        return len(self._read_names)
+
+    def add_multialignment(self, ma):
+        """add one read to the builder
+
+        :param tuple ma: all alignments of a single read (sam.SamRecord or
+          sam.BamRecord objects), e.g. as yielded by Reader.iter_multialignments()
+        """
+        n_pending = len(self._pending_cells)
+        for a in ma:
+            self._pending_chromosomes.append(a.rname)
+            self._pending_strands.append(a.strand)
+            self._pending_positions.append(a.pos)
+            self._pending_reads.append(n_pending)
+
+        # items in ma all must have the same read name
+        a = ma[0]
+        self._read_names.append(a.qname)
+        if self._barcode_sidecar is not None:
+            try:
+                ordinal = int(a.qname)
+            except ValueError:
+                ordinal = -1
+            if ordinal < 0:
+                raise ValueError(
+                    "read name %s is not a read ordinal; the reads were not merged "
+                    "with a barcode sidecar" % repr(a.qname)
+                )
+            self._ordinal.append(ordinal)
+            self._pending_cells.append(None)  # only counts the pending reads
+        else:
+            self._pending_cells.append(a.cell)
+            self._pending_rmts.append(a.rmt)
+            self._n_poly_t.append(a.n_poly_t)
+        if n_pending + 1 == self._batch_size:
+            self._process_pending()
+
+    def _process_pending(self):
+        """encode buffered cell and rmt barcodes, translate buffered alignments into
+        genes, and move the results to the data columns"""
+        n_reads = len(self._pending_cells)
+        if not n_reads:
+            return
+        if self._barcode_sidecar is None:
+            self._cell.extend(DNA3Bit.encode_array(self._pending_cells))
+            self._rmt.extend(DNA3Bit.encode_array(self._pending_rmts))
+
+        # only alignments that translate to a unique gene are kept
+        positions = np.array(self._pending_positions, dtype=np.int64)
+        genes = self._translator.translate_many(
+            self._pending_chromosomes, self._pending_strands, positions
+        )
+        passing = genes >= 0
+        self._gene.extend(genes[passing])
+        self._position.extend(positions[passing])
+        reads = np.array(self._pending_reads, dtype=np.int64)[passing]
+        self._n_alignments.extend(np.bincount(reads, minlength=n_reads))
+
+        self._pending_cells, self._pending_rmts = [], []
+        self._pending_chromosomes, self._pending_strands = [], []
+        self._pending_positions, self._pending_reads = [], []
+
+    def to_read_array(self, required_poly_t):
+        """finalize the builder into a ReadArray; the builder is emptied
+
+        :param int required_poly_t: number of poly_t required for a read to be
+          considered a valid alignment
+        :return ReadArray, list: constructed ReadArray and the name of each read
+        """
+        self._process_pending()
+        n_alignments = self._n_alignments.finalize()
+        n_reads = n_alignments.shape[0]
+
+        data = np.recarray((n_reads,), ReadArray._dtype)
+        data["status"] = 0
+        if self._barcode_sidecar is not None:
+            barcodes = BarcodeSidecar.load(self._barcode_sidecar)
+            ordinal = self._ordinal.finalize()
+            if n_reads and ordinal.max() >= len(barcodes):
+                raise ValueError(
+                    "read ordinal %d is not in barcode sidecar %s, which holds %d "
+                    "reads"
+                    % (ordinal.max(), repr(self._barcode_sidecar), len(barcodes))
+                )
+            barcodes = barcodes[ordinal]
+            data["cell"] = barcodes["cell"]
+            data["rmt"] = barcodes["rmt"]
+            data["n_poly_t"] = barcodes["n_poly_t"]
+        else:
+            data["cell"] = self._cell.finalize()
+            data["rmt"] = self._rmt.finalize()
+            data["n_poly_t"] = self._n_poly_t.finalize()
+
+        indptr = np.zeros(n_reads + 1, dtype=np.int32)
+        np.cumsum(n_alignments, out=indptr[1:])
+        # column of each alignment within its read
+        indices = np.arange(indptr[-1], dtype=np.int32) - np.repeat(
+            indptr[:-1], n_alignments
+        )
+        shape = (n_reads, int(n_alignments.max()) if n_reads else 0)
+        gene = csr_matrix((self._gene.finalize(), indices, indptr), shape=shape)
+        position = csr_matrix(
+            (self._position.finalize(), indices.copy(), indptr.copy()), shape=shape
+        )
+
+        read_names, self._read_names = self._read_names, []
+        ra = ReadArray(data, gene, position)
+        ra.initial_filtering(required_poly_t=required_poly_t)
+        return ra, read_names
+
+
+@njit
+def _resolve_molecules(reads, starts, indptr, indices, genes):
+    """resolve the gene of ambiguously aligned molecules, see
+    ReadArray._resolve_alignments()
+
+    The reads of each molecule are grouped by their gene set (the sorted genes they
+    align to). If a molecule has more than one gene set, the gene sets are divided into
+    disjoint components; a component with several gene sets is resolved if exactly one
+    gene is common to all of them.
+
+    :param np.ndarray reads: read indices, sorted such that the reads of each molecule
+      are contiguous
+    :param np.ndarray starts: offset of each molecule in reads, followed by len(reads)
+    :param np.ndarray indptr: csr indptr of the genes matrix
+    :param np.ndarray indices: csr indices of the genes matrix
+    :param np.ndarray genes: csr data of the genes matrix
+    :return (np.ndarray, np.ndarray, np.ndarray, np.ndarray): counts of unique
+      molecules, collisions, molecules resolved as disjoint, resolved by the model and
+      ambiguous molecules; then the resolved reads, their gene, and the column of that
+      gene in the genes matrix
+    """
+    counts = np.zeros(5, dtype=np.int64)
+    resolved_reads = np.empty(len(reads), dtype=np.int64)
+    resolved_genes = np.empty(len(reads), dtype=np.int64)
+    resolved_columns = np.empty(len(reads), dtype=np.int64)
+    n_resolved = 0
+
+    for m in range(len(starts) - 1):
+        molecule = reads[starts[m] : starts[m + 1]]
+
+        # assign each read to a gene set; gene sets are stored back to back in buffer
+        n_genes = (indptr[molecule + 1] - indptr[molecule]).sum()
+        buffer = np.empty(n_genes, dtype=genes.dtype)
+        set_starts = np.zeros(len(molecule) + 1, dtype=np.int64)
+        n_sets = 0
+        read_sets = np.empty(len(molecule), dtype=np.int64)
+        for i in range(len(molecule)):
+            row = np.sort(genes[indptr[molecule[i]] : indptr[molecule[i] + 1]])
+            read_sets[i] = -1
+            for k in range(n_sets):
+                other = buffer[set_starts[k] : set_starts[k + 1]]
+                if len(other) == len(row) and np.all(other == row):
+                    read_sets[i] = k
+                    break
+            if read_sets[i] == -1:
+                buffer[set_starts[n_sets] : set_starts[n_sets] + len(row)] = row
+                set_starts[n_sets + 1] = set_starts[n_sets] + len(row)
+                read_sets[i] = n_sets
+                n_sets += 1
+
+        if n_sets == 1:
+            counts[0] += 1  # unique molecule
+            continue
+        counts[1] += 1  # cell/rmt barcode collision
+
+        # divide the gene sets into disjoint components with union-find over genes
+        unique_genes = np.unique(buffer[: set_starts[n_sets]])
+        parents = np.arange(len(unique_genes))
+        for k in range(n_sets):
+            members = np.searchsorted(
+                unique_genes, buffer[set_starts[k] : set_starts[k + 1]]
+            )
+            root = members[0]
+            while parents[root] != root:
+                root = parents[root]
+            for g in members[1:]:
+                other = g
+                while parents[other] != other:
+                    other = parents[other]
+                parents[other] = root
+        for g in range(len(parents)):
+            root = g
+            while parents[root] != root:
+                root = parents[root]
+            parents[g] = root
+        set_components = np.empty(n_sets, dtype=np.int64)
+        for k in range(n_sets):
+            set_components[k] = parents[
+                np.searchsorted(unique_genes, buffer[set_starts[k]])
+            ]
+
+        for component in np.unique(set_components):
+            component_sets = np.flatnonzero(set_components == component)
+            if len(component_sets) == 1:
+                counts[2] += 1  # resolved: disjoint
+                continue
+
+            # genes common to all gene sets of the component
+            n_common = 0
+            common = 0
+            for g in range(len(unique_genes)):
+                if parents[g] != component:
+                    continue
+                in_all = True
+                for k in component_sets:
+                    if not np.any(
+                        buffer[set_starts[k] : set_starts[k + 1]] == unique_genes[g]
+                    ):
+                        in_all = False
+                        break
+                if in_all:
+                    n_common += 1
+                    common = unique_genes[g]
+
+            if n_common != 1:
+                counts[4] += 1  # ambiguous
+                continue
+            counts[3] += 1  # resolved: model
+            for i in range(len(molecule)):
+                if set_components[read_sets[i]] != component:
+                    continue
+                read = molecule[i]
+                column = -1
+                for j in range(indptr[read], indptr[read + 1]):
+                    if genes[j] == common and (column == -1 or indices[j] < column):
+                        column = indices[j]
+                resolved_reads[n_resolved] = read
+                resolved_genes[n_resolved] = common
+                resolved_columns[n_resolved] = column
+                n_resolved += 1
+
+    return (
+        counts,
+        resolved_reads[:n_resolved],
+        resolved_genes[:n_resolved],
+        resolved_columns[:n_resolved],
+    )
 
 
 class ReadArray:
@@ -59,6 +388,12 @@ class ReadArray:
         else:
             self._ambiguous_genes = False
 
+        # set by sort(): offsets of the reads of each cell, and the rows whose gene,
+        # rmt or position changed since the last sort
+        self._cell_indptr = None
+        self._unsorted_rows = []
+        self._row_order = None
+
     @property
     def data(self):
         return self._data
@@ -180,7 +515,14 @@ class ReadArray:
                     yield i, data, gene, position
 
     @classmethod
-    def from_alignment_file(cls, alignment_file, translator, required_poly_t):
+    def from_alignment_file(
+        cls,
+        alignment_file,
+        translator,
+        required_poly_t,
+        reader="samtools",
+        barcode_sidecar=None,
+    ):
         """
         construct a ReadArray object from a samfile containing only uniquely aligned
         records
@@ -191,93 +533,68 @@ class ReadArray:
           file corresponding to the genome against which the reads in sam_file were
           aligned
         :param str alignment_file: filename of alignment file.
+        :param str reader: how .bam files are decoded. "samtools" parses the text
+          output of samtools view; "native" decodes BAM records in-process with
+          sam.BamReader. .sam files are always read as text.
+        :param str barcode_sidecar: BarcodeSidecar file holding the barcodes of the
+          reads, if they were merged with one; see ReadArrayBuilder
         :return:
         """
 
         # todo add a check for @GO query header (file matches sorting assumptions)
 
-        reader = sam.Reader(
-            alignment_file
-        )  # todo swap to pysam reader, probably faster
-
-        # todo allow reading of this from alignment summary
-        num_reads = 0
-        num_unique = 0
-        prev_alignment_name = ""
-        for alignment in reader:
-            num_reads += 1
-            if alignment.qname != prev_alignment_name:
-                num_unique += 1
-                prev_alignment_name = alignment.qname
-
-        # pre-allocate arrays
-        data = np.recarray((num_unique,), cls._dtype)
-        row = np.zeros(num_reads, dtype=np.int32)
-        col = np.zeros(num_reads, dtype=np.int8)
-        position = np.zeros(num_reads, dtype=np.int32)
-        gene = np.zeros(num_reads, dtype=np.int32)
-
-        read_names = []
-
-        # loop over multialignments
-        row_idx = 0  # identifies the read index
-        arr_idx = 0  # identifies the alignment index across all reads
-        max_ma = 0  # maximum number of alignments observed for a read
-        for ma in reader.iter_multialignments():
-            col_idx = 0  # identifies the alignment index within a read
-            for a in ma:
-                genes = translator.translate(a.rname, a.strand, a.pos)
-
-                # if gene passes filter, store passing genes and increment appropriate
-                # arr and col indices
-                if genes is not None:
-                    row[arr_idx] = row_idx
-                    col[arr_idx] = col_idx
-                    gene[arr_idx] = genes
-                    position[arr_idx] = a.pos
-                    arr_idx += 1
-                    col_idx += 1
-            max_ma = max(max_ma, col_idx)
-
-            # items in ma all must have the same read name
-            # ma[0]==ma[1]==...
-            read_names.append(ma[0].qname)
-
-            cell = seqc.sequence.encodings.DNA3Bit.encode(a.cell)
-            rmt = seqc.sequence.encodings.DNA3Bit.encode(a.rmt)
-            n_poly_t = a.poly_t.count("T") + a.poly_t.count("N")
-            data[row_idx] = (0, cell, rmt, n_poly_t)
-            row_idx += 1
-
-        # some reads will not have aligned, throw away excess allocated space before
-        # creating the ReadArray
-        row, col, position, gene = (
-            row[:arr_idx],
-            col[:arr_idx],
-            position[:arr_idx],
-            gene[:arr_idx],
-        )
+        if reader not in ("samtools", "native"):
+            raise ValueError(
+                'reader must be one of "samtools" or "native", not %s' % repr(reader)
+            )
+        if reader == "native" and alignment_file.endswith(".bam"):
+            reader = sam.BamReader(alignment_file)
+        else:
+            reader = sam.Reader(alignment_file)
 
-        gene = coo_matrix((gene, (row, col)), shape=(row_idx, max_ma), dtype=np.int32)
-        position = coo_matrix(
-            (position, (row, col)), shape=(row_idx, max_ma), dtype=np.int32
+        return cls.from_multialignments(
+            reader.iter_multialignments(), translator, required_poly_t, barcode_sidecar
         )
 
-        ra = cls(data, gene.tocsr(), position.tocsr())
-        ra.initial_filtering(required_poly_t=required_poly_t)
+    @classmethod
+    def from_multialignments(
+        cls, multialignments, translator, required_poly_t, barcode_sidecar=None
+    ):
+        """
+        construct a ReadArray object from an iterable of multialignments. Reads are
+        consumed as they are produced, so multialignments may come from a stream, e.g.
+        sam.StreamReader(star.AlignmentStream(...).stdout).iter_multialignments()
 
-        return ra, read_names
+        :param multialignments: iterable of tuples containing all alignments of one read
+        :param GeneIntervals translator: translator created from the .gtf annotation
+          file corresponding to the genome against which the reads were aligned
+        :param required_poly_t: number of poly_t required for a read to be considered
+          a valid alignment
+        :param str barcode_sidecar: BarcodeSidecar file holding the barcodes of the
+          reads, if they were merged with one; see ReadArrayBuilder
+        :return ReadArray, list: constructed ReadArray and the name of each read
+        """
+        builder = ReadArrayBuilder(translator, barcode_sidecar)
+        for ma in multialignments:
+            builder.add_multialignment(ma)
+        return builder.to_read_array(required_poly_t)
 
     def group_indices_by_cell(self, multimapping=False):
         """group the reads in ra.data by cell.
 
+        If the reads were sorted with sort(), groups are read off the cell index
+        instead of sorting the cells.
+
         :param bool multimapping: if True, then reads are not filtered if they have
           alignments to more than one gene
         :return [np.array]: list of numpy arrays, each containing all of the indices for
           reads that correspond to a group, defined as a unique combination of the
           columns specified in parameter by.
         """
-        idx = np.argsort(self.data["cell"])
+        if self._cell_indptr is not None:
+            idx = np.arange(len(self))  # rows are grouped by cell
+        else:
+            idx = np.argsort(self.data["cell"])
 
         # filter the index for reads that
         if multimapping:
@@ -293,41 +610,185 @@ class ReadArray:
         # use these break points to split the filtered index according to "by"
         return np.split(idx, breaks)
 
-    def save(self, archive_name):
+    @property
+    def is_sorted(self):
+        """True if the rows are sorted by cell, gene, rmt and position; see sort()"""
+        return self._cell_indptr is not None and not self._unsorted_rows
+
+    @property
+    def row_order(self):
+        """the row each read had before the ReadArray was first sorted, e.g. to index
+        the read names returned with the ReadArray"""
+        if self._row_order is None:
+            return np.arange(len(self))
+        return self._row_order
+
+    def _first_alignments(self):
+        """return the gene and position of each read, or of its first alignment"""
+        if self._ambiguous_genes:
+            return (
+                self.genes.getcol(0).toarray().ravel(),
+                self.positions.getcol(0).toarray().ravel(),
+            )
+        return self.genes, self.positions
+
+    def sort(self):
+        """physically sort the reads by cell, gene, rmt and position, and index the
+        rows of each cell.
+
+        Later stages reuse the index: group_indices_by_cell() does not sort, and rmt
+        correction does not re-sort the reads of each cell. Stages that change cells
+        drop the index, stages that change genes, rmts or positions record the changed
+        rows (see invalidate_sort()); calling sort() again then re-sorts only the cells
+        containing those rows.
+
+        :return np.ndarray: the permutation applied; row i is the former row order[i]
+        """
+        n = len(self)
+        if self._cell_indptr is None:
+            rows = np.arange(n)
+        elif not self._unsorted_rows:
+            return np.arange(n)
+        else:
+            changed = np.unique(np.concatenate(self._unsorted_rows))
+            groups = np.unique(
+                np.searchsorted(self._cell_indptr, changed, side="right") - 1
+            )
+            starts = self._cell_indptr[groups]
+            lengths = self._cell_indptr[groups + 1] - starts
+            ends = np.cumsum(lengths)
+            rows = np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1])
+
+        genes, positions = self._first_alignments()
+        order = np.arange(n)
+        order[rows] = rows[
+            np.lexsort(
+                (
+                    positions[rows],
+                    self.data["rmt"][rows],
+                    genes[rows],
+                    self.data["cell"][rows],
+                )
+            )
+        ]
+
+        self._data = self._data[order]
+        self._genes = self._genes[order]
+        self._positions = self._positions[order]
+        self._row_order = self.row_order[order]
+        if self._cell_indptr is None:
+            _, counts = np.unique(self.data["cell"], return_counts=True)
+            self._cell_indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=self._cell_indptr[1:])
+        self._unsorted_rows = []
+        return order
+
+    def invalidate_sort(self, column, rows=None):
+        """record that column was changed for rows, so that sort() can restore the
+        order of the reads
+
+        :param str column: "cell", "gene", "rmt" or "position". Changing cells drops
+          the cell index
+        :param np.ndarray rows: changed rows, defaults to all rows
+        """
+        if self._cell_indptr is None:
+            return
+        if column == "cell":
+            self._cell_indptr = None
+            self._unsorted_rows = []
+        elif rows is None:
+            self._unsorted_rows.append(np.arange(len(self)))
+        elif len(rows):
+            self._unsorted_rows.append(np.asarray(rows))
+
+    # layout written by save(); see ReadArrayArchive
+    _archive_version = 2
+
+    def save(self, archive_name, read_names=None, block_size=1 << 16):
         """save a ReadArray object as an hdf5 archive
 
+        Reads are stored sorted by cell, with one chunked and compressed array per
+        column, an index of the rows of each cell and a summary of the read status, so
+        that the archive can be read partially; see ReadArrayArchive.
+
         :param str archive_name: filestem for the new archive
+        :param list read_names: optional name of each read, in the order the reads had
+          before they were sorted (see row_order), saved with the reads
+        :param int block_size: number of rows per hdf5 chunk
         :return None:
         """
 
-        def store_carray(archive, array, name):
-            atom = tb.Atom.from_dtype(array.dtype)
-            store = archive.create_carray(archive.root, name, atom, array.shape)
-            store[:] = array
-            store.flush()
-
         if not archive_name.endswith(".h5"):
             archive_name += ".h5"
+        if read_names is not None and len(read_names) != len(self):
+            raise ValueError(
+                "read_names has %d entries, but the ReadArray has %d reads"
+                % (len(read_names), len(self))
+            )
+
+        if self._cell_indptr is not None:
+            order = np.arange(len(self))  # rows are grouped by cell
+        else:
+            order = np.argsort(self.data["cell"], kind="stable")
+        cells, counts = np.unique(self.data["cell"], return_counts=True)
+        cell_offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cell_offsets[1:])
+        status, status_counts = np.unique(self.data["status"], return_counts=True)
+
+        def store_earray(archive, group, name, array):
+            atom = tb.Atom.from_dtype(array.dtype)
+            store = archive.create_earray(
+                group,
+                name,
+                atom,
+                (0,),
+                chunkshape=(block_size,),
+                expectedrows=max(len(array), 1),
+            )
+            store.append(array)
+            store.flush()
 
         # construct container
         blosc5 = tb.Filters(complevel=5, complib="blosc")
-        f = tb.open_file(
+        with tb.open_file(
             archive_name, mode="w", title="Data for seqc.ReadArray", filters=blosc5
-        )
-
-        f.create_table(f.root, "data", self.data)
-
-        if self._ambiguous_genes:
-            # each array is data, indices, indptr
-            store_carray(f, self.genes.indices, "indices")
-            store_carray(f, self.genes.indptr, "indptr")
-            store_carray(f, self.genes.data, "gene_data")
-            store_carray(f, self.positions.data, "positions_data")
-        else:
-            store_carray(f, self.genes, "genes")
-            store_carray(f, self.positions, "positions")
-
-        f.close()
+        ) as f:
+            attrs = f.root._v_attrs
+            attrs.format_version = self._archive_version
+            attrs.n_reads = len(self)
+            attrs.ambiguous_genes = self._ambiguous_genes
+
+            columns = f.create_group(f.root, "columns")
+            for name in self.data.dtype.names:
+                store_earray(f, columns, name, self.data[name][order])
+            if self._ambiguous_genes:
+                # each array is data, indices, indptr
+                genes, positions = self.genes[order], self.positions[order]
+                attrs.n_alignments = genes.shape[1]
+                store_earray(f, columns, "indices", genes.indices)
+                store_earray(f, columns, "indptr", genes.indptr)
+                store_earray(f, columns, "gene_data", genes.data)
+                store_earray(f, columns, "positions_data", positions.data)
+                del genes, positions
+            else:
+                store_earray(f, columns, "genes", self.genes[order])
+                store_earray(f, columns, "positions", self.positions[order])
+
+            index = f.create_group(f.root, "index")
+            store_earray(f, index, "cells", cells)
+            store_earray(f, index, "cell_offsets", cell_offsets)
+
+            summary = f.create_group(f.root, "summary")
+            store_earray(f, summary, "status", status)
+            store_earray(f, summary, "counts", status_counts)
+
+            if read_names is not None:
+                store_earray(
+                    f,
+                    f.root,
+                    "read_names",
+                    np.array(read_names, dtype=bytes)[self.row_order[order]],
+                )
 
     @classmethod
     def load(cls, archive_name):
@@ -338,22 +799,8 @@ class ReadArray:
         :return ReadArray:
         """
 
-        f = tb.open_file(archive_name, mode="r")
-        data = f.root.data.read()
-
-        try:
-            f.get_node("/genes")
-            genes = f.root.genes.read()
-            positions = f.root.positions.read()
-        except tb.NoSuchNodeError:
-            indptr = f.root.indptr.read()
-            indices = f.root.indices.read()
-            genes = f.root.gene_data.read()
-            positions = f.root.positions_data.read()
-            genes = csr_matrix((genes, indices, indptr))
-            positions = csr_matrix((positions, indices, indptr))
-
-        return cls(data, genes, positions)
+        with ReadArrayArchive(archive_name) as archive:
+            return archive.to_read_array()
 
     # todo document me
     def resolve_ambiguous_alignments(self):
@@ -373,17 +820,18 @@ class ReadArray:
         self.positions = np.ravel(self.positions.tocsc()[:, 0].todense())
         return mm_results
 
-    # todo reconcile documentation with new method
     def _resolve_alignments(self, indices_grouped_by_cells):
         """
         Resolve ambiguously aligned molecules and edit the ReadArray data structures
         in-place to reflect the more specific gene assignments.
 
-        After loading the co alignment matrix we group the reads of the ra by cell/rmt.
-        In each group we look at the different disjoint subsetes of genes reads are
-        aligned to.
+        The reads of each cell are grouped by rmt into molecules. In each molecule we
+        look at the different disjoint subsets of genes reads are aligned to; see
+        _resolve_molecules(). All molecules are processed in a single compiled pass
+        over the csr arrays of the genes matrix.
 
-        side effect: # todo write here.
+        side effect: reads of resolved molecules lose the gene_not_unique filter, and
+        column 0 of their genes and positions holds the resolved gene and its position.
 
         :param list indices_grouped_by_cells: list of numpy arrays containing indices to
           ReadArray rows that correspond to each cell
@@ -394,90 +842,66 @@ class ReadArray:
         # Mask for reseting status on resolved genes
         mask = self.filtering_mask("gene_not_unique")
 
-        # results dictionary for tracking effect of algorithm
-        results = OrderedDict(
-            (
-                ("unique molecules", 0),
-                ("cell/rmt barcode collisions", 0),
-                ("resolved molecules: disjoint", 0),
-                ("resolved molecules: model", 0),
-                ("ambiguous molecules", 0),
-            )
+        # sort reads by cell group and then by rmt; each run is a molecule
+        lengths = [len(group) for group in indices_grouped_by_cells]
+        reads = (
+            np.concatenate(indices_grouped_by_cells).astype(np.int64)
+            if lengths
+            else np.zeros(0, dtype=np.int64)
+        )
+        groups = np.repeat(np.arange(len(lengths)), lengths)
+        rmts = self.data["rmt"][reads]
+        order = np.lexsort((rmts, groups))
+        reads, groups, rmts = reads[order], groups[order], rmts[order]
+        new_molecule = np.ones(len(reads), dtype=bool)
+        new_molecule[1:] = (groups[1:] != groups[:-1]) | (rmts[1:] != rmts[:-1])
+        starts = np.append(np.flatnonzero(new_molecule), len(reads))
+
+        genes = self.genes
+        counts, resolved, resolved_genes, columns = _resolve_molecules(
+            reads,
+            starts.astype(np.int64),
+            genes.indptr.astype(np.int64),
+            genes.indices.astype(np.int64),
+            genes.data,
         )
 
-        for cell_group in indices_grouped_by_cells:
-
-            # Sort by molecules
-            inds = cell_group[np.argsort(self.data["rmt"][cell_group])]
-            breaks = np.where(np.diff(self.data["rmt"][inds]))[0] + 1
-            indices_grouped_by_molecule = np.split(inds, breaks)
-
-            # Each molecule group
-            for mol_group in indices_grouped_by_molecule:
-
-                # Number of reads mapping to different sets of genes
-                gene_groups = {}
-                for ind in mol_group:
-                    key = tuple(np.sort(self.genes[ind].data))
-                    try:
-                        gene_groups[key].append(ind)
-                    except KeyError:
-                        gene_groups[key] = [ind]
-
-                # Return if there is only one gene group
-                if len(gene_groups) == 1:
-                    results["unique molecules"] += 1
-                    continue
+        # apply the updates in bulk
+        self.data["status"][resolved] &= mask
+        if len(resolved):
+            first = np.asarray(genes[resolved, np.zeros_like(resolved)]).ravel()
+            changed = first != resolved_genes
+            resolved, resolved_genes = resolved[changed], resolved_genes[changed]
+            columns = columns[changed]
+        if len(resolved):
+            resolved_positions = np.asarray(self.positions[resolved, columns]).ravel()
+            zeros = np.zeros_like(resolved)
+            self.genes[resolved, zeros] = resolved_genes
+            self.positions[resolved, zeros] = resolved_positions
+            self.invalidate_sort("gene", resolved)
 
-                # if it was not unique, there is a collision
-                results["cell/rmt barcode collisions"] += 1
-
-                # Divide into disjoint sets
-                uf = multialignment.UnionFind()
-                uf.union_all(gene_groups.keys())
-                set_membership, sets = uf.find_all(gene_groups.keys())
-
-                # Disambiguate each set
-                keys = np.array(list(gene_groups.keys()), dtype=object)
-                for s in sets:
-                    set_groups = keys[set_membership == s]
-
-                    # Return if the set contains only one group
-                    if len(set_groups) == 1:
-                        results["resolved molecules: disjoint"] += 1
-                        continue
-
-                    # Disambiguate if possible
-                    common = list(multialignment.intersection(set_groups))
-
-                    # Resolved if there is only one common gene
-                    if len(common) == 1:
-                        results["resolved molecules: model"] += 1
-                        for group in set_groups:
-                            # Update status
-                            self.data["status"][gene_groups[tuple(group)]] &= mask
-                            for ind in gene_groups[tuple(group)]:
-                                # Update gene and position
-                                if self.genes[ind, 0] == common[0]:
-                                    continue
-                                gene_index = (self.genes[ind] == common[0]).nonzero()[
-                                    1
-                                ][0]
-                                self.genes[ind, 0] = self.genes[ind, gene_index]
-                                self.positions[ind, 0] = self.positions[ind, gene_index]
-                    else:
-                        results["ambiguous molecules"] += 1
-                        # Todo: Likelihood model goes here
-        return results
+        # results dictionary for tracking effect of algorithm
+        return OrderedDict(
+            zip(
+                (
+                    "unique molecules",
+                    "cell/rmt barcode collisions",
+                    "resolved molecules: disjoint",
+                    "resolved molecules: model",
+                    "ambiguous molecules",
+                ),
+                (int(c) for c in counts),
+            )
+        )
 
     def create_readname_cb_umi_mapping(self, read_names, path_filename):
 
-        if read_names == None:
+        if read_names is None:
             return
 
         # index with no cell error & no rmt error
         noerr_idx = np.where(self.data["status"] == 0)[0]
-        rnames = np.array(read_names)[noerr_idx]
+        rnames = np.array(read_names)[self.row_order[noerr_idx]]
         cell = self.data["cell"][noerr_idx]
         rmt = self.data["rmt"][noerr_idx]
 
@@ -486,124 +910,96 @@ class ReadArray:
 
         df.to_csv(path_filename, index=True, compression="gzip")
 
-    # todo : document me
-    # Triplet filter from Adam
     def filter_low_coverage(self, alpha=0.25):
+        """Triplet filter from Adam: flag the reads at positions of a gene that hold
+        significantly many lonely triplets.
 
-        use_inds = np.where(self.data["status"] == 0)[0]
-        cell = self.data["cell"][use_inds]
-        position = self.positions[use_inds]
-        rmt = self.data["rmt"][use_inds]
-        genes = self.genes[use_inds]
-
-        # A triplet is a (cell, position, rmt) triplet in each gene
-        df = pd.DataFrame(
-            {"gene": genes, "cell": cell, "position": position, "rmt": rmt}
-        )
-        grouped = df.groupby(["gene", "position"])
-        # This gives the gene followed by the number of triplets at each position
-        # Summing across each gene will give the number of total triplets in gene
-        num_per_position = (
-            grouped["position"].agg({"Num Triplets at Pos": np.count_nonzero})
-        ).reset_index()
-
-        # Total triplets in each gene
-        trips_in_gene = (num_per_position.groupby(["gene"]))["Num Triplets at Pos"].agg(
-            {"Num Triplets at Gene": np.sum}
-        )
-
-        trips_in_gene = trips_in_gene.reset_index()
-
-        num_per_position = num_per_position.merge(trips_in_gene, how="left")
+        A triplet is the (cell, rmt, position) of a read in a gene. A molecule (gene,
+        cell, rmt) whose reads all share one position is a lonely triplet. For each
+        (gene, position) with lonely triplets, a hypergeometric test with
+        Benjamini-Hochberg correction decides whether the position holds more of the
+        gene's lonely triplets than its share of the gene's reads explains. All active
+        reads at rejected positions are marked lonely_triplet.
 
-        # for each (c,rmt) in df check in grouped2 if it is lonely
-        # determine number of lonely triplets at each position
-        grouped2 = df.groupby(["gene", "cell", "rmt"])
-        # lonely_triplets = grouped2["position"].apply(lambda x: len(x.unique()))
-        # This is a list of each gene, cell, rmt combo and the positions with that criteria
-        lonely_triplets = grouped2["position"].apply(np.unique)
-        lonely_triplets = pd.DataFrame(lonely_triplets)
+        Counts are run lengths over sorted keys, so memory is bounded by a few arrays
+        the size of the active reads.
 
-        # if the length is one, this is a lonely triplet
-        lonely_triplets_u = lonely_triplets["position"].apply(len)
-        lonely_triplets_u = pd.DataFrame(lonely_triplets_u)
+        :param float alpha: false discovery rate of the test
+        :return None: method sets the status vector of the filtered reads
+        """
 
-        lonely_triplets_u = lonely_triplets_u.reset_index()
-        lonely_triplets = lonely_triplets.reset_index()
+        from statsmodels.sandbox.stats.multicomp import multipletests as mt
 
-        # Rename the columns
-        lonely_triplets = lonely_triplets.rename(
-            columns=lambda x: x.replace("position", "lonely position")
-        )
-        lonely_triplets_u = lonely_triplets_u.rename(
-            columns=lambda x: x.replace("position", "num")
-        )
+        use_inds = np.flatnonzero(self.data["status"] == 0)
+        gene = self.genes[use_inds]
+        position = self.positions[use_inds]
 
-        # merge the column that is the length of the positions array
-        # take the ones with length 1
-        lonely_triplets = lonely_triplets.merge(lonely_triplets_u, how="left")
-        lonely_triplets = lonely_triplets.loc[lonely_triplets.loc[:, "num"] == 1, :]
-
-        # This is the gene, cell, rmt combo and the position that is lonely
-        # We need to convert the array to a scalar
-        scalar = lonely_triplets["lonely position"].apply(np.asscalar)
-        lonely_triplets["lonely position"] = scalar
-        # Now if we group as such, we can determine how many (c, rmt) paris exist at each position
-        # This would be the number of lonely pairs at a position
-        grouped3 = lonely_triplets.groupby(["gene", "lonely position"])
-        l_num_at_position = (grouped3["cell"].agg(["count"])).reset_index()
-        l_num_at_position = l_num_at_position.rename(
-            columns=lambda x: x.replace("count", "lonely triplets at pos")
+        # runs of (gene, position), and the number of reads at each with a position
+        order = np.lexsort((position, gene))
+        sorted_gene, sorted_position = gene[order], position[order]
+        new_pair = np.ones(len(order), dtype=bool)
+        new_pair[1:] = (sorted_gene[1:] != sorted_gene[:-1]) | (
+            sorted_position[1:] != sorted_position[:-1]
         )
-        l_num_at_position = l_num_at_position.rename(
-            columns=lambda x: x.replace("lonely position", "position")
+        pair_starts = np.flatnonzero(new_pair)
+        if not len(pair_starts):
+            return
+        reads_at_pos = np.add.reduceat(
+            (sorted_position != 0).astype(np.int64), pair_starts
         )
-        # lonely pairs in each gene
-        l_num_at_gene = (lonely_triplets.groupby(["gene"]))["lonely position"].agg(
-            ["count"]
+        pair_gene = sorted_gene[pair_starts]
+        pair = np.empty(len(order), dtype=np.int64)  # (gene, position) of each read
+        pair[order] = np.cumsum(new_pair) - 1
+        del order, sorted_gene, sorted_position, new_pair
+
+        # reads with a position in the gene of each (gene, position)
+        new_gene = np.ones(len(pair_starts), dtype=bool)
+        new_gene[1:] = pair_gene[1:] != pair_gene[:-1]
+        gene_of_pair = np.cumsum(new_gene) - 1
+        reads_in_gene = np.add.reduceat(reads_at_pos, np.flatnonzero(new_gene))
+
+        # molecules whose reads share a single position are lonely triplets
+        cell = self.data["cell"][use_inds]
+        rmt = self.data["rmt"][use_inds]
+        order = np.lexsort((position, rmt, cell, gene))
+        cell, rmt = cell[order], rmt[order]
+        gene, position = gene[order], position[order]
+        new_molecule = np.ones(len(order), dtype=bool)
+        new_molecule[1:] = (
+            (gene[1:] != gene[:-1]) | (cell[1:] != cell[:-1]) | (rmt[1:] != rmt[:-1])
         )
-        l_num_at_gene = l_num_at_gene.reset_index()
-        l_num_at_gene = l_num_at_gene.rename(
-            columns=lambda x: x.replace("count", "lonely triplets at gen")
+        new_position = new_molecule.copy()
+        new_position[1:] |= position[1:] != position[:-1]
+        molecule_starts = np.flatnonzero(new_molecule)
+        n_positions = np.add.reduceat(new_position.astype(np.int64), molecule_starts)
+        lonely = pair[order[molecule_starts[n_positions == 1]]]
+        del cell, rmt, gene, position, order, new_molecule, new_position
+
+        lonely_at_pos = np.bincount(lonely, minlength=len(pair_starts))
+        lonely_in_gene = np.bincount(gene_of_pair, weights=lonely_at_pos).astype(
+            np.int64
         )
 
-        # aggregate
-        total = l_num_at_position.merge(l_num_at_gene, how="left")
-        total = total.merge(num_per_position, how="left")
-
-        # scipy hypergeom
-        p = total.apply(self._hypergeom_wrapper, axis=1)
-        p = 1 - p
-
-        from statsmodels.sandbox.stats.multicomp import multipletests as mt
-
-        adj_p = mt(p, alpha=alpha, method="fdr_bh")
-
-        keep = pd.DataFrame(adj_p[0])
-        total["remove"] = keep
-
-        remove = total[total["remove"] == True]
-
-        final = df.merge(remove, how="left")
-        final = final[final["remove"] == True]
+        # test the (gene, position) pairs holding lonely triplets
+        tested = np.flatnonzero(lonely_at_pos)
+        if not len(tested):
+            return
+        genes_tested = gene_of_pair[tested]
+        p = 1 - hypergeom.cdf(
+            lonely_at_pos[tested],
+            reads_in_gene[genes_tested],
+            lonely_in_gene[genes_tested],
+            reads_at_pos[tested],
+        )
+        reject = mt(p, alpha=alpha, method="fdr_bh")[0]
 
         # Indicies to remove
-        remove_inds = use_inds[final.index.values]
+        removed = np.zeros(len(pair_starts), dtype=bool)
+        removed[tested[reject]] = True
+        remove_inds = use_inds[removed[pair]]
 
         self.data["status"][remove_inds] |= self.filter_codes["lonely_triplet"]
 
-    def _hypergeom_wrapper(self, x):
-
-        from scipy.stats import hypergeom
-
-        p = hypergeom.cdf(
-            x["lonely triplets at pos"],
-            x["Num Triplets at Gene"],
-            x["lonely triplets at gen"],
-            x["Num Triplets at Pos"],
-        )
-        return p
-
     def to_count_matrix(
         self, csv_path=None, sparse_frame=False, genes_to_symbols=False
     ):
@@ -612,49 +1008,499 @@ class ReadArray:
         Since the matrix is sparse we represent it with 3 columns: row (cell),
          col (gene), value if not 0 (reads/molecules)
 
+        Active reads are sorted by (cell, gene, rmt). Runs of equal (cell, gene) are the
+        non-zero entries of the matrix, and the runs of equal rmt within them are its
+        molecules.
+
         :param str csv_path: file prefix for .csv output
         :param bool sparse_frame: if True, return sparse frame objects
         :param genes_to_symbols: if SparseFrame is True, integer gene IDs are converted
-          to symbols in the returned SparseFrame objects
+          to symbols in the returned SparseFrame objects, see SparseFrame.from_dict
         :return str, str, dict, dict:
           filename (read counts),
           filename (mol counts),
           dict of (cell, rmt) -> read counts
           dict of (cell, rmt) -> molecule counts
         """
-        reads_mat = {}
-        mols_mat = {}
-        for i, data, gene, pos in self.iter_active():
-
-            try:
-                reads_mat[data["cell"], gene] += 1
-            except KeyError:
-                reads_mat[data["cell"], gene] = 1
-
-            try:
-                rmt = data["rmt"]
-                if rmt not in mols_mat[data["cell"], gene]:
-                    mols_mat[data["cell"], gene].append(rmt)
-            except KeyError:
-                mols_mat[data["cell"], gene] = [rmt]
+        active = self.data["status"] == 0
+        if self._ambiguous_genes:  # first gene of each read, as yielded by __iter__
+            genes = self.genes.getcol(0).toarray().ravel()[active]
+        else:
+            genes = self.genes[active]
+        cells = self.data["cell"][active]
+        rmts = self.data["rmt"][active]
+
+        if not self.is_sorted:
+            order = np.lexsort((rmts, genes, cells))
+            cells, genes, rmts = cells[order], genes[order], rmts[order]
+        new_entry = np.ones(len(cells), dtype=bool)
+        new_entry[1:] = (cells[1:] != cells[:-1]) | (genes[1:] != genes[:-1])
+        new_molecule = new_entry.copy()
+        new_molecule[1:] |= rmts[1:] != rmts[:-1]
+
+        starts = np.flatnonzero(new_entry)
+        entry_cells, entry_genes = cells[starts], genes[starts]
+        read_counts = np.diff(np.append(starts, len(cells)))
+        molecule_starts = np.cumsum(new_molecule)[starts] - 1
+        molecule_counts = np.diff(
+            np.append(molecule_starts, np.count_nonzero(new_molecule))
+        )
 
         if sparse_frame:
             return (
-                SparseFrame.from_dict(reads_mat, genes_to_symbols=genes_to_symbols),
-                SparseFrame.from_dict(
-                    {k: len(v) for k, v in mols_mat.items()},
+                SparseFrame.from_arrays(
+                    entry_cells,
+                    entry_genes,
+                    read_counts,
+                    genes_to_symbols=genes_to_symbols,
+                ),
+                SparseFrame.from_arrays(
+                    entry_cells,
+                    entry_genes,
+                    molecule_counts,
                     genes_to_symbols=genes_to_symbols,
                 ),
             )
 
+        keys = list(zip(entry_cells.tolist(), entry_genes.tolist()))
+        reads_mat = dict(zip(keys, read_counts.tolist()))
+        mols_mat = dict(
+            zip(
+                keys,
+                (
+                    m.tolist()
+                    for m in np.split(rmts[new_molecule], molecule_starts[1:])
+                ),
+            )
+        )
+
         if csv_path is None:
             return reads_mat, mols_mat
 
         # todo convert gene integers to symbols before saving csv
-        f = open(csv_path + "reads_count.csv", "w")
-        for data["cell"], gene in reads_mat:
-            f.write(
-                "{},{},{}\n".format(data["cell"], gene, reads_mat[data["cell"], gene])
+        with open(csv_path + "reads_count.csv", "w") as f:
+            for (cell, gene), count in reads_mat.items():
+                f.write("{},{},{}\n".format(cell, gene, count))
+
+
+class ReadArrayArchive:
+    """Read-only view of an hdf5 archive written by ReadArray.save.
+
+    Nothing is read when the archive is opened. Columns, the cell index, the status
+    summary and the read names are read on request, and iter_blocks() streams blocks
+    of whole cells, so e.g. a summary or a count matrix can be computed without
+    loading the full ReadArray:
+
+    >>> with ReadArrayArchive("sample.h5") as archive:
+    ...     for start, stop, block in archive.iter_blocks(["status", "cell"]):
+    ...         ...
+
+    Archives written before format version 2 (a single table and arrays, not sorted by
+    cell, without index, summary or read names) can still be read; their blocks are
+    plain row ranges.
+    """
+
+    _data_fields = tuple(name for name, _ in ReadArray._dtype)
+
+    def __init__(self, archive_name):
+        """
+        :param str archive_name: name of a .h5 archive containing a saved ReadArray
+        """
+        self._file = tb.open_file(archive_name, mode="r")
+        attrs = self._file.root._v_attrs
+        if "format_version" in attrs:
+            self.format_version = int(attrs.format_version)
+        else:
+            self.format_version = 1
+        if self.format_version > ReadArray._archive_version:
+            self._file.close()
+            raise ValueError(
+                "%s has ReadArray format version %d; this version of seqc reads up to "
+                "%d" % (archive_name, self.format_version, ReadArray._archive_version)
+            )
+
+        if self.format_version == 1:
+            self._columns = self._file.root
+            self.ambiguous_genes = "/genes" not in self._file
+            self._n_reads = self._file.root.data.nrows
+            self._n_alignments = None
+        else:
+            self._columns = self._file.root.columns
+            self.ambiguous_genes = bool(attrs.ambiguous_genes)
+            self._n_reads = int(attrs.n_reads)
+            self._n_alignments = (
+                int(attrs.n_alignments) if self.ambiguous_genes else None
+            )
+        self._cells = None
+        self._cell_offsets = None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._n_reads
+
+    @property
+    def columns(self):
+        return self._data_fields + ("genes", "positions")
+
+    def read_column(self, name, start=0, stop=None):
+        """read rows start to stop (exclusive) of a column
+
+        :param str name: one of self.columns
+        :param int start: first row
+        :param int stop: end row, defaults to the number of reads
+        :return np.ndarray | csr_matrix: column values; genes and positions are
+          csr_matrix if the saved genes were ambiguous
+        """
+        if stop is None:
+            stop = len(self)
+        if name not in self.columns:
+            raise ValueError(
+                "%s is not a ReadArray column. Please select from %s"
+                % (repr(name), repr(self.columns))
+            )
+        if name in self._data_fields:
+            if self.format_version == 1:
+                return self._file.root.data.read(start, stop, field=name)
+            return self._columns[name][start:stop]
+        if not self.ambiguous_genes:
+            return self._columns[name][start:stop]
+
+        indptr = self._columns.indptr[start : stop + 1]
+        values = self._columns["gene_data" if name == "genes" else "positions_data"]
+        values = values[indptr[0] : indptr[-1]]
+        indices = self._columns.indices[indptr[0] : indptr[-1]]
+        if self._n_alignments is None:  # format version 1 did not record the shape
+            return csr_matrix((values, indices, indptr - indptr[0]))
+        return csr_matrix(
+            (values, indices, indptr - indptr[0]),
+            shape=(stop - start, self._n_alignments),
+        )
+
+    def _require_index(self):
+        if self.format_version == 1:
+            raise ValueError(
+                "ReadArray format version 1 archives have no cell index; load and "
+                "save the ReadArray to upgrade the archive"
+            )
+
+    @property
+    def cells(self):
+        """sorted cell barcodes present in the archive"""
+        self._require_index()
+        if self._cells is None:
+            self._cells = self._file.root.index.cells.read()
+        return self._cells
+
+    @property
+    def cell_offsets(self):
+        """the reads of cells[i] are rows cell_offsets[i] to cell_offsets[i + 1]"""
+        self._require_index()
+        if self._cell_offsets is None:
+            self._cell_offsets = self._file.root.index.cell_offsets.read()
+        return self._cell_offsets
+
+    def cell_rows(self, cell):
+        """return the (start, stop) range of rows holding the reads of cell
+
+        :param int cell: encoded cell barcode
+        :return (int, int): row range, empty if the cell has no reads
+        """
+        i = np.searchsorted(self.cells, cell)
+        if i == len(self.cells) or self.cells[i] != cell:
+            start = int(self.cell_offsets[i])
+            return start, start
+        return int(self.cell_offsets[i]), int(self.cell_offsets[i + 1])
+
+    def iter_blocks(self, columns=None, block_size=1 << 20):
+        """iterate over blocks of rows, reading only the requested columns
+
+        blocks of format version 2 archives hold whole cells; a block is larger than
+        block_size only if it consists of a single cell with more reads.
+
+        :param [str] columns: columns to read, defaults to all columns
+        :param int block_size: approximate number of rows per block
+        :yields (int, int, dict): start and stop row of the block, and a dictionary
+          of the requested columns
+        """
+        columns = self.columns if columns is None else columns
+        bounds = np.arange(0, len(self), block_size)
+        if self.format_version > 1:
+            offsets = self.cell_offsets
+            bounds = np.unique(offsets[np.searchsorted(offsets, bounds)])
+        bounds = np.append(bounds[bounds < len(self)], len(self))
+        for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            yield start, stop, {
+                name: self.read_column(name, start, stop) for name in columns
+            }
+
+    def summary(self):
+        """number of reads in the archive, number of active reads and number of reads
+        failing each filter
+
+        :return OrderedDict: counts keyed by "total", "active" and the names in
+          ReadArray.filter_codes
+        """
+        if self.format_version == 1:
+            status, counts = np.unique(self.read_column("status"), return_counts=True)
+        else:
+            status = self._file.root.summary.status.read()
+            counts = self._file.root.summary.counts.read()
+        summary = OrderedDict(
+            [("total", int(counts.sum())), ("active", int(counts[status == 0].sum()))]
+        )
+        for name, code in ReadArray.filter_codes.items():
+            summary[name] = int(counts[(status & code) > 0].sum())
+        return summary
+
+    def read_names(self):
+        """return the saved read names, or None if the archive has none
+
+        :return list | None: name of each read, in row order
+        """
+        if "/read_names" not in self._file:
+            return None
+        return [name.decode() for name in self._file.root.read_names.read()]
+
+    def to_read_array(self):
+        """load all columns into a ReadArray
+
+        :return ReadArray:
+        """
+        if self.format_version == 1:
+            data = self._file.root.data.read()
+        else:
+            data = np.empty(
+                len(self),
+                dtype=[(name, self._columns[name].dtype) for name in self._data_fields],
+            )
+            for name in self._data_fields:
+                data[name] = self._columns[name].read()
+        ra = ReadArray(data, self.read_column("genes"), self.read_column("positions"))
+        if self.format_version > 1:
+            # rows are grouped by cell, but not sorted within cells
+            ra._cell_indptr = self.cell_offsets
+            ra.invalidate_sort("rmt")
+        return ra
+
+
+def _narrow(array):
+    """return array cast to the smallest integer type that holds all of its values"""
+    if not len(array):
+        return array.astype(np.uint8)
+    dtype = np.promote_types(
+        np.min_scalar_type(array.min()), np.min_scalar_type(array.max())
+    )
+    return array.astype(dtype, copy=False)
+
+
+class CompactReadArray:
+    """Memory efficient encoding of a ReadArray, see from_read_array() and
+    to_read_array().
+
+    Cell barcodes are dictionary encoded as uint32 ids into the sorted table self.cells
+    and genes as ids into the sorted table self.genes, whose first entry is the empty
+    gene (0). Rmts, positions and gene ids are stored in the smallest integer type that
+    holds their values. The first alignment of each read is kept in dense arrays; reads
+    with several alignments (or whose single alignment is not in column 0) are kept in
+    a separate csr overflow: overflow_reads[i] has the alignments
+    overflow_indptr[i] to overflow_indptr[i + 1].
+
+    For 10-base rmts and unambiguous genes a read takes 16 bytes instead of the 34
+    bytes of a ReadArray with int64 genes and positions.
+    """
+
+    def __init__(
+        self,
+        status,
+        n_poly_t,
+        cell_ids,
+        cells,
+        rmts,
+        gene_ids,
+        genes,
+        positions,
+        overflow=None,
+        n_alignments=None,
+        dtypes=None,
+    ):
+        """
+        :param np.ndarray status: status of each read
+        :param np.ndarray n_poly_t: number of poly_t of each read
+        :param np.ndarray cell_ids: index into cells of each read
+        :param np.ndarray cells: sorted, unique cell barcodes
+        :param np.ndarray rmts: rmt of each read
+        :param np.ndarray gene_ids: index into genes of each read's first alignment
+        :param np.ndarray genes: sorted, unique genes; genes[0] == 0
+        :param np.ndarray positions: position of each read's first alignment
+        :param tuple overflow: (reads, indptr, indices, gene_ids, positions) csr arrays
+          of the reads stored in the overflow, or None
+        :param int n_alignments: number of columns of the ReadArray's genes csr_matrix,
+          None if the ReadArray's genes were not ambiguous
+        :param dict dtypes: dtypes of the ReadArray's genes and positions
+        """
+        self.status = status
+        self.n_poly_t = n_poly_t
+        self.cell_ids = cell_ids
+        self.cells = cells
+        self.rmts = rmts
+        self.gene_ids = gene_ids
+        self.genes = genes
+        self.positions = positions
+        if overflow is None:
+            empty = np.zeros(0, dtype=np.uint8)
+            overflow = (empty, np.zeros(1, dtype=np.uint8), empty, empty, empty)
+        (
+            self.overflow_reads,
+            self.overflow_indptr,
+            self.overflow_indices,
+            self.overflow_gene_ids,
+            self.overflow_positions,
+        ) = overflow
+        self.n_alignments = n_alignments
+        self._dtypes = dtypes or {"genes": np.int64, "positions": np.int64}
+
+    def __len__(self):
+        return len(self.status)
+
+    @property
+    def nbytes(self):
+        """number of bytes taken by the arrays of the encoding"""
+        return sum(
+            a.nbytes
+            for a in (
+                self.status,
+                self.n_poly_t,
+                self.cell_ids,
+                self.cells,
+                self.rmts,
+                self.gene_ids,
+                self.genes,
+                self.positions,
+                self.overflow_reads,
+                self.overflow_indptr,
+                self.overflow_indices,
+                self.overflow_gene_ids,
+                self.overflow_positions,
+            )
+        )
+
+    @classmethod
+    def from_read_array(cls, ra):
+        """encode a ReadArray
+
+        :param ReadArray ra: read array; genes and positions may be csr_matrix or
+          np.ndarray
+        :return CompactReadArray:
+        """
+        cells, cell_ids = np.unique(ra.data["cell"], return_inverse=True)
+        if len(cells) > np.iinfo(np.uint32).max:
+            raise ValueError("%d cells do not fit uint32 cell ids" % len(cells))
+
+        dtypes = {"genes": ra.genes.dtype, "positions": ra.positions.dtype}
+        if ra._ambiguous_genes:
+            genes, positions = ra.genes, ra.positions
+            n_alignments = genes.shape[1]
+            nnz = np.diff(genes.indptr)
+            first = genes.indptr[:-1]
+
+            # a single alignment in column 0 is stored densely
+            single = np.flatnonzero(nnz == 1)
+            dense = nnz == 0
+            dense[single] = (genes.indices[first[single]] == 0) & (
+                genes.data[first[single]] != 0
             )
+            gene = np.zeros(len(nnz), dtype=genes.dtype)
+            position = np.zeros(len(nnz), dtype=positions.dtype)
+            single = single[dense[single]]
+            gene[single] = genes.data[first[single]]
+            position[single] = positions.data[first[single]]
+
+            overflow_reads = np.flatnonzero(~dense)
+            overflow_genes = genes[overflow_reads]
+            overflow_positions = positions[overflow_reads]
+            gene_table = np.unique(
+                np.concatenate([[0], gene, overflow_genes.data]).astype(genes.dtype)
+            )
+            overflow = (
+                _narrow(overflow_reads),
+                _narrow(overflow_genes.indptr),
+                _narrow(overflow_genes.indices),
+                _narrow(np.searchsorted(gene_table, overflow_genes.data)),
+                _narrow(overflow_positions.data),
+            )
+        else:
+            gene, position = ra.genes, ra.positions
+            n_alignments = None
+            gene_table = np.unique(np.append(np.zeros(1, dtype=gene.dtype), gene))
+            overflow = None
+
+        return cls(
+            ra.data["status"].copy(),
+            ra.data["n_poly_t"].copy(),
+            cell_ids.astype(np.uint32),
+            cells,
+            _narrow(ra.data["rmt"]),
+            _narrow(np.searchsorted(gene_table, gene)),
+            gene_table,
+            _narrow(position),
+            overflow,
+            n_alignments,
+            dtypes,
+        )
+
+    def to_read_array(self):
+        """decode into a ReadArray with the layout of the encoded one
 
-        f.close()
+        :return ReadArray:
+        """
+        data = np.recarray((len(self),), ReadArray._dtype)
+        data["status"] = self.status
+        data["cell"] = self.cells[self.cell_ids]
+        data["rmt"] = self.rmts
+        data["n_poly_t"] = self.n_poly_t
+
+        gene = self.genes[self.gene_ids].astype(self._dtypes["genes"])
+        position = self.positions.astype(self._dtypes["positions"])
+        if self.n_alignments is None:
+            return ReadArray(data, gene, position)
+
+        # rows without genes are empty, overflow rows hold their alignments and the
+        # remaining rows hold a single alignment in column 0
+        overflow_reads = self.overflow_reads.astype(np.int64)
+        overflow_indptr = self.overflow_indptr.astype(np.int64)
+        overflow_nnz = np.diff(overflow_indptr)
+        nnz = (gene != 0).astype(np.int64)
+        nnz[overflow_reads] = overflow_nnz
+        indptr = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(nnz, out=indptr[1:])
+
+        indices = np.zeros(indptr[-1], dtype=self.overflow_indices.dtype)
+        genes = np.empty(indptr[-1], dtype=self._dtypes["genes"])
+        positions = np.empty(indptr[-1], dtype=self._dtypes["positions"])
+        single = np.flatnonzero(nnz)
+        single = single[
+            np.isin(single, overflow_reads, assume_unique=True, invert=True)
+        ]
+        genes[indptr[single]] = gene[single]
+        positions[indptr[single]] = position[single]
+        slots = np.repeat(
+            indptr[overflow_reads] - overflow_indptr[:-1], overflow_nnz
+        ) + np.arange(overflow_indptr[-1])
+        indices[slots] = self.overflow_indices
+        genes[slots] = self.genes[self.overflow_gene_ids]
+        positions[slots] = self.overflow_positions
+
+        shape = (len(self), self.n_alignments)
+        return ReadArray(
+            data,
+            csr_matrix((genes, indices, indptr), shape=shape),
+            csr_matrix((positions, indices, indptr), shape=shape),
+        )
@@ -1,6 +1,10 @@
 import os
 import gzip
 import bz2
+import shlex
+import threading
+from queue import Queue
+from subprocess import Popen, PIPE
 
 
 class Reader:
@@ -31,18 +35,122 @@ class Reader:
         """
         return sum(1 for _ in self)
 
+    @staticmethod
+    def _open(f, decompressor=None):
+        """open f for binary reading
+
+        :param str f: filename
+        :param str decompressor: optional command that decompresses a file to stdout
+          (e.g. "pigz -dc"); used instead of gzip/bz2 for compressed files
+        :return (file, Popen | None): readable file object, and the decompression
+          process if one was started
+        """
+        if decompressor and f.endswith(('.gz', '.bz2')):
+            proc = Popen(shlex.split(decompressor) + [f], stdout=PIPE)
+            return proc.stdout, proc
+        if f.endswith('.gz'):
+            return gzip.open(f, 'rb'), None
+        elif f.endswith('.bz2'):
+            return bz2.open(f, 'rb'), None
+        else:
+            return open(f, 'rb'), None
+
     def __iter__(self):
         for f in self._files:
-            if f.endswith('.gz'):
-                file_input = gzip.open(f, 'rb')
-            elif f.endswith('.bz2'):
-                file_input = bz2.open(f, 'rb')
-            else:
-                file_input = open(f, 'rb')
+            file_input, _ = self._open(f)
             for record in file_input:
                 yield record
             file_input.close()
 
+    def _iter_file_blocks(self, f, block_size, lines_per_record, decompressor):
+        file_input, proc = self._open(f, decompressor)
+        try:
+            tail = b''
+            while True:
+                data = file_input.read(block_size)
+                if not data:
+                    break
+                block = tail + data
+                # cut after the last complete record in the block
+                n_lines = block.count(b'\n')
+                end = len(block)
+                for _ in range(n_lines % lines_per_record + 1):
+                    end = block.rfind(b'\n', 0, end)
+                end += 1
+                if end:
+                    yield block[:end]
+                tail = block[end:]
+            if proc is not None and proc.wait() != 0:
+                raise ChildProcessError(
+                    '%s exited with status %d while decompressing %s'
+                    % (decompressor, proc.returncode, f))
+            if tail:
+                yield tail if tail.endswith(b'\n') else tail + b'\n'
+        finally:
+            file_input.close()
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    def iter_blocks(self, block_size=1 << 22, lines_per_record=1, decompressor=None,
+                    threaded=False):
+        """iterate over large buffers of raw file content instead of single lines
+
+        Each block holds whole records of lines_per_record lines, except that the last
+        block of a file carries whatever trails its last complete record. Blocks never
+        span two files, and a missing final newline is added.
+
+        :param int block_size: number of decompressed bytes read at once; a block may
+          be longer by the part of a record carried over from the previous read
+        :param int lines_per_record: number of lines in each record (e.g. 4 for fastq)
+        :param str decompressor: optional command that decompresses a file to stdout,
+          e.g. "pigz -dc". Compressed files are then decompressed by a subprocess
+          instead of the gzip/bz2 modules
+        :param bool threaded: if True, read and decompress the next blocks in a
+          background thread while the current block is processed
+        :yields bytes: blocks of records
+        """
+        blocks = (
+            block
+            for f in self._files
+            for block in self._iter_file_blocks(
+                f, block_size, lines_per_record, decompressor)
+        )
+        if not threaded:
+            yield from blocks
+            return
+
+        done = object()
+        pending = Queue(maxsize=4)
+        stop = threading.Event()
+
+        def read_ahead():
+            try:
+                for block in blocks:
+                    if stop.is_set():
+                        break
+                    pending.put(block)
+                pending.put(done)
+            except BaseException as e:
+                pending.put(e)
+            finally:
+                blocks.close()
+
+        threading.Thread(target=read_ahead, daemon=True).start()
+        try:
+            while True:
+                block = pending.get()
+                if block is done:
+                    return
+                if isinstance(block, BaseException):
+                    raise block
+                yield block
+        finally:
+            # unblock the reader if iteration stopped early, so that it closes the file
+            stop.set()
+            while not pending.empty():
+                pending.get_nowait()
+
     @property
     def size(self) -> int:
         """return the collective size of all files being read in bytes"""
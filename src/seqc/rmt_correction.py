@@ -2,8 +2,10 @@ import os
 import pickle
 import math
 import time
+import heapq
 import psutil
 import pandas as pd
+from multiprocessing import Pool, shared_memory
 import numpy as np
 from tqdm import tqdm
 from scipy.special import gammainc
@@ -12,8 +14,7 @@ from seqc.read_array import ReadArray
 import dask
 from distributed import Client, LocalCluster
 from dask.distributed import wait, performance_report
-from tlz import partition_all
-from numba import jit, njit
+from numba import njit
 from collections import defaultdict
 
 
@@ -34,36 +35,34 @@ def DNA3Bit_seq_len(i: int) -> int:
     return l
 
 
-@njit
-def generate_close_seq(seq):
-    """Return a list of all sequences that are up to 2 hamm distance from seq
-    :param seq:
-    """
-    DNA3Bit_bin2strdict = {
-        0b100: b"A",
-        0b110: b"C",
-        0b101: b"G",
-        0b011: b"T",
-        0b111: b"N",
-    }
+# DNA3Bit codes of A, C, G, T and N, in the order substitutions are enumerated
+_DNA3Bit_codes = np.array([0b100, 0b110, 0b101, 0b011, 0b111], dtype=np.int64)
+
+# the longest sequence that fits in an int64
+_max_seq_len = 21
 
-    # res = []
-    res = np.empty(0, dtype=np.int64)
 
+@njit
+def _fill_close_seqs(seq, out):
+    """write all sequences that are hamming distance 1 and then 2 from seq to out
+
+    :param int seq: encoded sequence
+    :param np.ndarray out: buffer of at least 4 * l + 16 * l * (l - 1) / 2 elements,
+      where l is the length of seq
+    :return int: number of sequences written to out
+    """
     l = DNA3Bit_seq_len(seq)
+    n = 0
 
     # generate all sequences that are dist 1
     for i in range(l):
         mask = 0b111 << (i * 3)
         cur_chr = (seq & mask) >> (i * 3)
-        res = np.append(
-            res,
-            [
-                seq & (~mask) | (new_chr << (i * 3))
-                for new_chr in DNA3Bit_bin2strdict.keys()
-                if new_chr != cur_chr
-            ],
-        )
+        for new_chr in _DNA3Bit_codes:
+            if new_chr != cur_chr:
+                out[n] = seq & (~mask) | (new_chr << (i * 3))
+                n += 1
+
     # generate all sequences that are dist 2
     for i in range(l):
         mask_i = 0b111 << (i * 3)
@@ -72,63 +71,122 @@ def generate_close_seq(seq):
             mask_j = 0b111 << (j * 3)
             chr_j = (seq & mask_j) >> (j * 3)
             mask = mask_i | mask_j
-            res = np.append(
-                res,
-                [
-                    seq & (~mask) | (new_chr_i << (i * 3)) | (new_chr_j << (j * 3))
-                    for new_chr_i in DNA3Bit_bin2strdict.keys()
-                    if new_chr_i != chr_i
-                    for new_chr_j in DNA3Bit_bin2strdict.keys()
-                    if new_chr_j != chr_j
-                ],
-            )
-
-    return list(res)
+            for new_chr_i in _DNA3Bit_codes:
+                if new_chr_i == chr_i:
+                    continue
+                for new_chr_j in _DNA3Bit_codes:
+                    if new_chr_j != chr_j:
+                        out[n] = (
+                            seq & (~mask)
+                            | (new_chr_i << (i * 3))
+                            | (new_chr_j << (j * 3))
+                        )
+                        n += 1
+    return n
 
 
 @njit
-def probability_for_convert_d_to_r_float(d_seq, r_seq, err_rate):
+def generate_close_seq(seq):
+    """Return a list of all sequences that are up to 2 hamm distance from seq
+    :param seq:
     """
-    Return the probability of d_seq turning into r_seq based on the err_rate table
-    (all binary)
+    l = DNA3Bit_seq_len(seq)
+    res = np.empty(4 * l + 8 * l * (l - 1), dtype=np.int64)
+    _fill_close_seqs(seq, res)
+    return list(res)
+
+
+def _error_table(err_rate):
+    """tabulate the probability of one base being read as another
 
-    :param err_rate: for 10x e.g. 0.02
-    :param r_seq:
-    :param d_seq:
+    :param float | dict err_rate: a single error rate (e.g. 0.02 for 10x) or a dict
+      of rates keyed by (donor base, read base) (e.g. {(4, 6): 0.00078, ...} for
+      indrop)
+    :return np.ndarray: (8, 8) table indexed by donor and read DNA3Bit codes
     """
+    if isinstance(err_rate, float):
+        return np.full((8, 8), err_rate)
+    table = np.zeros((8, 8))
+    for (d_base, r_base), rate in err_rate.items():
+        table[d_base, r_base] = rate
+    return table
 
-    if DNA3Bit_seq_len(d_seq) != DNA3Bit_seq_len(r_seq):
-        return 1
 
-    p = 1.0
-    while d_seq > 0:
-        if d_seq & 0b111 != r_seq & 0b111:
-            p *= err_rate
-        d_seq >>= 3
-        r_seq >>= 3
-    return p
+@njit
+def _is_subset(positions, start, stop, other_start, other_stop):
+    """return True if each of the sorted positions[start:stop] is present in the
+    sorted positions[other_start:other_stop]"""
+    j = other_start
+    for i in range(start, stop):
+        while j < other_stop and positions[j] < positions[i]:
+            j += 1
+        if j == other_stop or positions[j] != positions[i]:
+            return False
+    return True
 
 
-def probability_for_convert_d_to_r_dict(d_seq, r_seq, err_rate):
+@njit
+def _find_rmt_donors(rmts, positions, rmt_starts, gene_starts, error_table):
+    """find the donors of each rmt in a set of (cell, gene) groups
+
+    reads must be sorted by cell, gene, rmt and position. Reads rmt_starts[k] to
+    rmt_starts[k + 1] form run k of identical rmts, and runs gene_starts[g] to
+    gene_starts[g + 1] are the distinct rmts of (cell, gene) group g.
+
+    :param np.ndarray rmts: rmt of each read
+    :param np.ndarray positions: position of each read
+    :param np.ndarray rmt_starts: offsets of the runs of identical rmts
+    :param np.ndarray gene_starts: offsets of the runs of each (cell, gene) group
+    :param np.ndarray error_table: (8, 8) table of base error rates, see _error_table
+    :return (np.ndarray, np.ndarray): the expected number of reads of each run that
+      are errors of an rmt within hamming distance 2, and the first such run whose
+      positions contain those of the run (the jaitin donor), or -1
     """
-    Return the probability of d_seq turning into r_seq based on the err_rate table
-    (all binary)
+    n_runs = len(rmt_starts) - 1
+    expected_errors = np.zeros(n_runs)
+    donors = np.full(n_runs, -1, dtype=np.int64)
+    close_seqs = np.empty(
+        4 * _max_seq_len + 8 * _max_seq_len * (_max_seq_len - 1), dtype=np.int64
+    )
 
-    :param err_rate: for indrop e.g. {(4, 6): 0.0007813189167391277, (4, 5): 0.0013484052272755914, ...}
-    :param r_seq:
-    :param d_seq:
-    """
+    for g in range(len(gene_starts) - 1):
+        first, last = gene_starts[g], gene_starts[g + 1]
+        if last - first < 2:
+            continue
+        gene_rmts = rmts[rmt_starts[first:last]]  # sorted and unique
+
+        for k in range(first, last):
+            rmt = gene_rmts[k - first]
+            for m in range(_fill_close_seqs(rmt, close_seqs)):
+                donor_rmt = close_seqs[m]
 
-    if DNA3Bit_seq_len(d_seq) != DNA3Bit_seq_len(r_seq):
-        return 1
+                # Check if donor is detected
+                d = np.searchsorted(gene_rmts, donor_rmt)
+                if d == last - first or gene_rmts[d] != donor_rmt:
+                    continue
+                d += first
 
-    p = 1.0
-    while d_seq > 0:
-        if d_seq & 0b111 != r_seq & 0b111:
-            p *= err_rate[(d_seq & 0b111, r_seq & 0b111)]
-        d_seq >>= 3
-        r_seq >>= 3
-    return p
+                # Probability of converting donor to target
+                p_dtr = 1.0
+                d_seq, r_seq = donor_rmt, rmt
+                while d_seq > 0:
+                    if d_seq & 0b111 != r_seq & 0b111:
+                        p_dtr *= error_table[d_seq & 0b111, r_seq & 0b111]
+                    d_seq >>= 3
+                    r_seq >>= 3
+                expected_errors[k] += (rmt_starts[d + 1] - rmt_starts[d]) * p_dtr
+
+                # Is reference a subset of the donor? (in terms of position)
+                if donors[k] < 0 and _is_subset(
+                    positions,
+                    rmt_starts[k],
+                    rmt_starts[k + 1],
+                    rmt_starts[d],
+                    rmt_starts[d + 1],
+                ):
+                    donors[k] = d
+
+    return expected_errors, donors
 
 
 def in_drop(read_array, error_rate, alpha=0.05):
@@ -142,84 +200,73 @@ def in_drop(read_array, error_rate, alpha=0.05):
     return _correct_errors(read_array, error_rate, alpha)
 
 
-# a method called by each process to correct RMT for each cell
-def _correct_errors_by_cell_group(ra, cell_group, err_rate, p_value):
-
-    # Breaks for each gene
-    gene_inds = cell_group[np.argsort(ra.genes[cell_group])]
-    breaks = np.where(np.diff(ra.genes[gene_inds]))[0] + 1
-    splits = np.split(gene_inds, breaks)
+def _find_rmt_errors(ra, reads, groups, err_rate, p_value, presorted=False):
+    """find the rmt errors among reads, each of which belongs to one cell group
 
-    del gene_inds
-    del breaks
-
-    rmt_groups = defaultdict(list)
-    res = []
-
-    for inds in splits:
-        # RMT groups
-        for ind in inds:
-            rmt = ra.data["rmt"][ind]
-            rmt_groups[rmt].append(ind)
+    :param ReadArray ra: read array with resolved genes and positions
+    :param np.ndarray reads: read indices
+    :param np.ndarray groups: cell group of each read
+    :param float | dict err_rate: see _error_table
+    :param float p_value: rmts whose probability of being an error exceeds p_value
+      are corrected
+    :param bool presorted: True if the reads of each group are contiguous and sorted
+      by gene, rmt and position, e.g. increasing rows of a sorted ReadArray
+    :return np.ndarray: (n, 2) array of read indices and the index of a read of their
+      donor rmt
+    """
 
-        if len(rmt_groups) == 1:
-            continue
+    rmts = ra.data["rmt"][reads]
+    genes = np.asarray(ra.genes)[reads]
+    positions = np.asarray(ra.positions)[reads].astype(np.int64)
+    if not presorted:
+        order = np.lexsort((positions, rmts, genes, groups))
+        reads, rmts, positions = reads[order], rmts[order], positions[order]
+        genes, groups = genes[order], groups[order]
+
+    # runs of identical (cell, gene, rmt) and (cell, gene)
+    new_gene = np.ones(len(reads), dtype=bool)
+    new_gene[1:] = (genes[1:] != genes[:-1]) | (groups[1:] != groups[:-1])
+    new_rmt = new_gene.copy()
+    new_rmt[1:] |= rmts[1:] != rmts[:-1]
+    rmt_starts = np.append(np.flatnonzero(new_rmt), len(reads))
+    gene_starts = np.append(np.flatnonzero(new_gene[new_rmt]), len(rmt_starts) - 1)
+
+    expected_errors, donors = _find_rmt_donors(
+        rmts, positions, rmt_starts, gene_starts, _error_table(err_rate)
+    )
 
-        # This logic retains RMTs with N if no donor is found and contributes to the
-        # molecule count
-        for rmt in rmt_groups.keys():
+    # Probability that the RMT is an error
+    n_reads = np.diff(rmt_starts)
+    p_val_err = gammainc(n_reads, expected_errors)
+
+    # Remove Jaitin corrected reads if probability of RMT == error is high
+    corrected = np.flatnonzero((p_val_err > p_value) & (donors >= 0))
+    lengths = n_reads[corrected]
+    res = np.empty((lengths.sum(), 2), dtype=np.int64)
+    res[:, 0] = reads[
+        np.repeat(rmt_starts[corrected] - np.cumsum(lengths) + lengths, lengths)
+        + np.arange(len(res))
+    ]
+    res[:, 1] = np.repeat(reads[rmt_starts[donors[corrected]]], lengths)
+    return res
 
-            # Enumerate all possible RMTs with hamming distances 1 and/or 2
-            # to build a probablitiy that this particular RMT was not an error
-            # Simulatenously, check if Jaitin error correction can be applied
-            jaitin_corrected = False
-            expected_errors = 0
-            for donor_rmt in generate_close_seq(rmt):
 
-                # Check if donor is detected
-                if donor_rmt in rmt_groups:
-                    donor_count = len(rmt_groups[donor_rmt])
-                else:
-                    continue
-
-                # Build likelihood
-                # Probability of converting donor to target
-                if type(err_rate) is float:
-                    # e.g. 10x: err_rate=0.02
-                    p_dtr = probability_for_convert_d_to_r_float(
-                        donor_rmt, rmt, err_rate
-                    )
-                else:
-                    # e.g. indrop: err_rate={(4, 6): 0.0007813189167391277, (4, 5): 0.0013484052272755914, ...}
-                    p_dtr = probability_for_convert_d_to_r_dict(
-                        donor_rmt, rmt, err_rate
-                    )
-                # Number of occurrences
-                expected_errors += donor_count * p_dtr
-
-                # Check if jaitin correction is feasible
-                if not jaitin_corrected:
-                    ref_positions = ra.positions[rmt_groups[rmt]]
-                    donor_positions = ra.positions[rmt_groups[donor_rmt]]
-
-                    # Is reference a subset of the donor? (in terms of position)
-                    if (set(ref_positions)).issubset(donor_positions):
-                        jaitin_corrected = True
-                        jaitin_donor = donor_rmt
-
-            # Probability that the RMT is an error
-            p_val_err = gammainc(len(rmt_groups[rmt]), expected_errors)
-
-            # Remove Jaitin corrected reads if probability of RMT == error is high
-            if p_val_err > p_value and jaitin_corrected:
-                # Save the RMT donor
-                # save the index of the read and index of donor rmt read
-                for i in rmt_groups[rmt]:
-                    res.append((i, rmt_groups[jaitin_donor][0]))
-
-        rmt_groups.clear()
+# a method called by each process to correct RMT for each cell
+def _correct_errors_by_cell_group(ra, cell_group, err_rate, p_value):
+    """find the rmt errors of a single cell
 
-    return res
+    :return np.ndarray: (n, 2) array of read indices and the index of a read of their
+      donor rmt
+    """
+    cell_group = np.asarray(cell_group, dtype=np.int64)
+    return _find_rmt_errors(
+        ra,
+        cell_group,
+        np.zeros(len(cell_group), dtype=np.int64),
+        err_rate,
+        p_value,
+        presorted=ra.is_sorted,
+    )
 
 
 def _correct_errors_by_cell_group_chunks(ra, cell_group_chunks, err_rate, p_value):
@@ -270,32 +317,215 @@ def _calc_max_workers(ra):
     return 1 if n == 0 else n
 
 
-def _correct_errors(ra, err_rate, p_value=0.05):
+def _get_n_workers(n_workers):
+    """apply the SEQC_MAX_WORKERS override to an estimated number of workers"""
 
-    # True: use Dask's broadcast (ra transfer via inproc/tcp)
-    # False: each worker reacs ra.pickle from disk
-    use_dask_broadcast = False
+    if int(os.environ.get("SEQC_MAX_WORKERS", 0)) > 0:
+        n_workers = int(os.environ.get("SEQC_MAX_WORKERS"))
+        log.debug(
+            "n_workers overridden with SEQC_MAX_WORKERS: {}".format(n_workers),
+            module_name="rmt_correction",
+        )
+    return n_workers
 
+
+# read array and cell groups attached by each shared memory worker,
+# see _attach_shared_read_array
+_shared = {}
+
+
+def _share_array(array, blocks):
+    """copy array into a new shared memory block, which is appended to blocks
+
+    :return (str, tuple, np.dtype): name of the block, shape and dtype of array
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    blocks.append(shm)
+    return shm.name, array.shape, array.dtype
+
+
+def _attach_shared_read_array(descriptors, err_rate, p_value, presorted=False):
+    """pool initializer: attach, without copying, to the shared memory blocks created
+    by _correct_errors_shared_memory"""
+
+    arrays = {}
+    for key, (name, shape, dtype) in descriptors.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared.setdefault("blocks", []).append(shm)  # keep the mapping open
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    _shared["ra"] = ReadArray(arrays["data"], arrays["genes"], arrays["positions"])
+    _shared["indices"] = arrays["indices"]
+    _shared["offsets"] = arrays["offsets"]
+    _shared["err_rate"] = err_rate
+    _shared["p_value"] = p_value
+    _shared["presorted"] = presorted
+
+
+def _partition_cell_groups(ra, indices_grouped_by_cells, n_units):
+    """pack cell groups into work units of similar cost
+
+    The cost of a cell group is estimated as its number of reads times its number of
+    distinct rmts. Groups are assigned, most expensive first, to the work unit with
+    the lowest total cost (longest processing time first). Groups with a single
+    distinct rmt cannot contain rmt errors and are not assigned to any unit.
+
+    :param ReadArray ra: read array
+    :param [np.ndarray] indices_grouped_by_cells: read indices of each cell group
+    :param int n_units: maximum number of work units
+    :return [np.ndarray]: indices of the cell groups in each work unit, in decreasing
+      order of unit cost
+    """
+
+    n_reads = np.fromiter((len(g) for g in indices_grouped_by_cells), dtype=np.int64)
+    if not len(n_reads):
+        return []
+
+    # distinct rmts of each cell group
+    groups = np.repeat(np.arange(len(n_reads)), n_reads)
+    rmts = ra.data["rmt"][np.concatenate(indices_grouped_by_cells)]
+    order = np.lexsort((rmts, groups))
+    groups, rmts = groups[order], rmts[order]
+    new_rmt = np.ones(len(rmts), dtype=bool)
+    new_rmt[1:] = (groups[1:] != groups[:-1]) | (rmts[1:] != rmts[:-1])
+    n_rmts = np.bincount(groups[new_rmt], minlength=len(n_reads))
+    del groups, rmts, order, new_rmt
+
+    costs = n_reads * n_rmts
+    candidates = np.flatnonzero(n_rmts > 1)
     log.debug(
-        "Available CPU / RAM: {} / {} GB".format(
-            _get_cpu_count(), int(_get_available_memory() / 1024 ** 3)
+        "Skipping {} of {} cell groups with a single rmt".format(
+            len(n_reads) - len(candidates), len(n_reads)
         ),
         module_name="rmt_correction",
     )
+    candidates = candidates[np.argsort(-costs[candidates], kind="stable")]
 
-    n_workers = _calc_max_workers(ra)
+    # longest processing time first: each group goes to the least loaded unit
+    units = [(0, i, []) for i in range(min(n_units, len(candidates)))]
+    for group in candidates:
+        load, i, unit = heapq.heappop(units)
+        unit.append(group)
+        heapq.heappush(units, (load + costs[group], i, unit))
+
+    units.sort(key=lambda u: (-u[0], u[1]))
+    return [np.array(unit, dtype=np.int64) for _, _, unit in units]
+
+
+def _correct_errors_by_cell_groups(group_ids):
+    """correct the given cell groups of the shared read array
 
+    :param np.ndarray group_ids: indices of the cell groups to correct
+    :return (np.ndarray, int, float): (n, 2) array of read indices and the index of a
+      read of their donor rmt, the worker's process id and the time spent
+    """
+
+    start = time.time()
+    indices, offsets = _shared["indices"], _shared["offsets"]
+    lengths = offsets[group_ids + 1] - offsets[group_ids]
+    ends = np.cumsum(lengths)
+    reads = indices[
+        np.repeat(offsets[group_ids] - ends + lengths, lengths) + np.arange(ends[-1])
+    ]
+    groups = np.repeat(group_ids, lengths)
+    res = _find_rmt_errors(
+        _shared["ra"],
+        reads,
+        groups,
+        _shared["err_rate"],
+        _shared["p_value"],
+        _shared["presorted"],
+    )
+    return res, os.getpid(), time.time() - start
+
+
+def _correct_errors_shared_memory(ra, indices_grouped_by_cells, err_rate, p_value):
+    """correct errors in a pool of processes that attach to a single shared memory
+    copy of the read array and receive cost balanced work units of cell groups
+
+    :return [np.ndarray]: (n, 2) arrays of read indices and donor read indices
+    """
+
+    n_workers = _get_n_workers(_get_cpu_count())
     log.debug(
-        "Estimated optimum n_workers: {}".format(n_workers),
-        module_name="rmt_correction",
+        "Shared memory processes={}".format(n_workers), module_name="rmt_correction"
     )
 
-    if int(os.environ.get("SEQC_MAX_WORKERS", 0)) > 0:
-        n_workers = int(os.environ.get("SEQC_MAX_WORKERS"))
+    # several units per worker; as the most expensive units are dispatched first,
+    # workers that finish early pick up the remaining cheap ones
+    units = _partition_cell_groups(ra, indices_grouped_by_cells, n_workers * 4)
+    if not units:
+        return []
+
+    # concatenated cell groups; group i is indices[offsets[i]:offsets[i + 1]]
+    lengths = np.fromiter(
+        (len(g) for g in indices_grouped_by_cells), dtype=np.int64
+    )
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    indices = np.concatenate(indices_grouped_by_cells)
+
+    blocks = []
+    try:
+        descriptors = {
+            "data": _share_array(ra.data, blocks),
+            "genes": _share_array(np.asarray(ra.genes), blocks),
+            "positions": _share_array(np.asarray(ra.positions), blocks),
+            "indices": _share_array(indices, blocks),
+            "offsets": _share_array(offsets, blocks),
+        }
+        del indices
+
         log.debug(
-            "n_workers overridden with SEQC_MAX_WORKERS: {}".format(n_workers),
+            "Submitting {} work units...".format(len(units)),
             module_name="rmt_correction",
         )
+        results = []
+        busy = defaultdict(float)
+        with Pool(
+            n_workers,
+            initializer=_attach_shared_read_array,
+            initargs=(descriptors, err_rate, p_value, ra.is_sorted),
+        ) as pool:
+            for res, pid, elapsed in pool.imap_unordered(
+                _correct_errors_by_cell_groups, units
+            ):
+                results.append(res)
+                busy[pid] += elapsed
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    log.debug(
+        "Worker busy time (s): "
+        + " ".join("{}={:.1f}".format(pid, t) for pid, t in sorted(busy.items())),
+        module_name="rmt_correction",
+    )
+
+    return results
+
+
+def _correct_errors_dask(ra, indices_grouped_by_cells, err_rate, p_value):
+    """correct errors on a dask LocalCluster. Each worker reads its own copy of the
+    read array, so the number of workers is limited by the available memory
+
+    :return [list]: lists of (read index, donor read index) tuples
+    """
+
+    # True: use Dask's broadcast (ra transfer via inproc/tcp)
+    # False: each worker reacs ra.pickle from disk
+    use_dask_broadcast = False
+
+    n_workers = _calc_max_workers(ra)
+
+    log.debug(
+        "Estimated optimum n_workers: {}".format(n_workers),
+        module_name="rmt_correction",
+    )
+
+    n_workers = _get_n_workers(n_workers)
 
     # n_workers = 1
     # p_value = 0.005
@@ -338,10 +568,6 @@ def _correct_errors(ra, err_rate, p_value=0.05):
     )
     log.debug("Dask Dashboard=" + client.dashboard_link, module_name="rmt_correction")
 
-    # group by cells (same cell barcodes as one group)
-    log.debug("Grouping...", module_name="rmt_correction")
-    indices_grouped_by_cells = ra.group_indices_by_cell()
-
     if use_dask_broadcast:
         # send readarray in advance to all workers (i.e. broadcast=True)
         # this way, we reduce the serialization time
@@ -357,9 +583,11 @@ def _correct_errors(ra, err_rate, p_value=0.05):
     with performance_report(filename="dask-report.html"):
         futures = []
 
-        # distribute chunks to workers evenly
-        n_chunks = math.ceil(len(indices_grouped_by_cells) / n_workers)
-        chunks = partition_all(n_chunks, indices_grouped_by_cells)
+        # distribute chunks of similar cost to workers
+        chunks = [
+            [indices_grouped_by_cells[i] for i in unit]
+            for unit in _partition_cell_groups(ra, indices_grouped_by_cells, n_workers)
+        ]
 
         for chunk in tqdm(chunks, disable=None):
 
@@ -404,6 +632,37 @@ def _correct_errors(ra, err_rate, p_value=0.05):
     client.shutdown()
     client.close()
 
+    return results
+
+
+def _correct_errors(ra, err_rate, p_value=0.05):
+
+    log.debug(
+        "Available CPU / RAM: {} / {} GB".format(
+            _get_cpu_count(), int(_get_available_memory() / 1024 ** 3)
+        ),
+        module_name="rmt_correction",
+    )
+
+    # "shared_memory" (default) or "dask"
+    backend = os.environ.get("SEQC_RMT_CORRECTION_BACKEND", "shared_memory")
+    if backend not in ("shared_memory", "dask"):
+        raise ValueError(
+            "SEQC_RMT_CORRECTION_BACKEND must be 'shared_memory' or 'dask', not %s"
+            % repr(backend)
+        )
+
+    # group by cells (same cell barcodes as one group)
+    log.debug("Grouping...", module_name="rmt_correction")
+    indices_grouped_by_cells = ra.group_indices_by_cell()
+
+    if backend == "dask":
+        results = _correct_errors_dask(ra, indices_grouped_by_cells, err_rate, p_value)
+    else:
+        results = _correct_errors_shared_memory(
+            ra, indices_grouped_by_cells, err_rate, p_value
+        )
+
     # iterate through the list of returned read indices and donor rmts
     # create a mapping tble of pre-/post-correction
     mapping = set()
@@ -429,6 +688,7 @@ def _correct_errors(ra, err_rate, p_value=0.05):
 
     # iterate through the list of returned read indices and donor rmts
     # actually, update the read array object with corrected UMI
+    corrected = []
     for result in results:
         for idx, idx_corrected_rmt in result:
 
@@ -441,5 +701,8 @@ def _correct_errors(ra, err_rate, p_value=0.05):
 
             # report error
             ra.data["status"][idx] |= ra.filter_codes["rmt_error"]
+            corrected.append(idx)
+
+    ra.invalidate_sort("rmt", np.array(corrected, dtype=np.int64))
 
     return pd.DataFrame(mapping, columns=["CB", "UR", "UB"])
@@ -1,4 +1,11 @@
+import os
+import hashlib
+import tempfile
+from itertools import combinations, product
+from scipy.special import comb
+import numpy as np
 from seqc.sequence.encodings import DNA3Bit
+from seqc import log
 from sys import maxsize
 
 # todo document me
@@ -20,6 +27,302 @@ def generate_hamming_dist_1(seq):
     return res
 
 
+def generate_hamming_dist_1_array(codes):
+    """
+    Batch version of generate_hamming_dist_1
+
+    :param np.ndarray codes: int64 array of encoded sequences
+    :return np.ndarray: (len(codes), 5 * l) int64 matrix, where l is the length of the
+      longest sequence. Row i lists the neighbours of codes[i] in the order of
+      generate_hamming_dist_1(codes[i]); columns that would not change the base, or
+      that lie past the end of a shorter sequence, are 0
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    lengths = DNA3Bit.seq_len_array(codes)
+    width = int(lengths.max()) if len(codes) else 0
+    new_chrs = np.array(list(DNA3Bit.bin2strdict.keys()), dtype=np.int64)
+    shifts = 3 * np.arange(width, dtype=np.int64)  # position i counts from the LSB
+    current = (codes[:, None] >> shifts) & 0b111
+    res = ((codes[:, None, None] & ~(0b111 << shifts)[None, :, None]) |
+           (new_chrs[None, None, :] << shifts[None, :, None]))
+    unchanged = ((new_chrs[None, None, :] == current[:, :, None]) |
+                 (np.arange(width)[None, :, None] >= lengths[:, None, None]))
+    res[unchanged] = 0
+    return res.reshape(len(codes), width * len(new_chrs))
+
+
+# _substitutions[code, c] is the c-th base that can replace the base with 3-bit code
+_bases = sorted(DNA3Bit.bin2strdict.keys())
+_substitutions = np.zeros((8, len(_bases) - 1), dtype=np.int64)
+for _b in _bases:
+    _substitutions[_b] = [b for b in _bases if b != _b]
+del _b
+
+
+def hamming_neighbours(codes, length, distance):
+    """
+    Batch version of generate_hamming_dist_1 for any distance: return all sequences that
+    are exactly distance substitutions away from each of codes
+
+    :param np.ndarray codes: int64 array of encoded sequences, all of the same length
+    :param int length: length of the sequences in codes
+    :param int distance: number of substituted bases
+    :return np.ndarray: (len(codes), n) int64 matrix; row i contains the neighbours of
+      codes[i]
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    if distance == 0:
+        return codes[:, None]
+    shifts = 3 * np.arange(length - 1, -1, -1, dtype=np.int64)  # MSB is the first base
+    bases = (codes[:, None] >> shifts) & 0b111
+
+    # deltas[i, 4 * p + c] flips base p of codes[i] to its c-th substitution
+    n_subs = _substitutions.shape[1]
+    deltas = ((bases[:, :, None] ^ _substitutions[bases]) << shifts[None, :, None])
+    deltas = deltas.reshape(len(codes), length * n_subs)
+
+    columns = np.array(
+        [[n_subs * p + c for p, c in zip(positions, choice)]
+         for positions in combinations(range(length), distance)
+         for choice in product(range(n_subs), repeat=distance)],
+        dtype=np.int64).reshape(-1, distance)
+    # substitutions touch disjoint bits, so summing the deltas combines them
+    return codes[:, None] ^ deltas[:, columns].sum(axis=2)
+
+
+class BarcodeIndex:
+    """
+    Sorted index of valid (whitelisted) barcodes that finds the nearest valid barcode to
+    an observed barcode without scanning the whitelist. Neighbours of the observed
+    barcode are generated at increasing hamming distance and looked up with a binary
+    search, so queries cost O(neighbours * log(whitelist size)).
+
+    :method find: nearest valid barcode to a single barcode
+    :method find_many: nearest valid barcode to each barcode in an array
+    """
+
+    # number of neighbours generated at once by find_many, bounds its memory use
+    max_neighbours = 1 << 22
+
+    def __init__(self, barcodes):
+        """
+        :param Iterable barcodes: encoded valid barcodes
+        """
+        if not isinstance(barcodes, np.ndarray):
+            barcodes = np.fromiter(barcodes, dtype=np.int64)
+        self._barcodes = np.unique(barcodes.astype(np.int64))
+
+    @classmethod
+    def from_file(cls, *barcode_files):
+        """
+        :param str barcode_files: files with one valid barcode sequence per line. The
+          index contains the union of their barcodes
+        :return BarcodeIndex:
+        """
+        encoded = []
+        for barcode_file in barcode_files:
+            with open(barcode_file, 'rb') as f:
+                encoded.append(DNA3Bit.encode_array(np.array(f.read().split())))
+        return cls(np.concatenate(encoded) if encoded else np.zeros(0, np.int64))
+
+    @classmethod
+    def neighbourhood(cls, barcode_file, max_ed=1):
+        """
+        Index of the barcodes of barcode_file together with every sequence that
+        differs from one of them at exactly max_ed positions, e.g. all observed cb2 that
+        in_drop_v5.check_cb2 accepts
+
+        :param str barcode_file: file with one valid barcode sequence per line
+        :param int max_ed: number of substituted positions
+        :return BarcodeIndex:
+        """
+        whitelist = cls.from_file(barcode_file).barcodes
+        lengths = DNA3Bit.seq_len_array(whitelist)
+        encoded = [whitelist]
+        for length in np.unique(lengths):
+            codes = whitelist[lengths == length]
+            if max_ed <= length:
+                encoded.append(hamming_neighbours(codes, length, max_ed).ravel())
+        return cls(np.concatenate(encoded))
+
+    @staticmethod
+    def neighbourhood_cache_filename(barcode_file, max_ed=1, cache_dir=None,
+                                     file_hash=None):
+        """
+        name of the cache file holding the neighbourhood of barcode_file
+
+        :param str barcode_file: file with one valid barcode sequence per line
+        :param int max_ed: see neighbourhood()
+        :param str cache_dir: directory of the cache file. Defaults to the directory
+          containing barcode_file
+        :param str file_hash: content hash of barcode_file, if already computed
+        :return str: filename of the cache file
+        """
+        if file_hash is None:
+            file_hash = _content_hash(barcode_file)
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(barcode_file))
+        return os.path.join(cache_dir, '%s.%s.%d.neighbourhood.npy' % (
+            os.path.basename(barcode_file), file_hash[:16], max_ed))
+
+    @classmethod
+    def cached_neighbourhood(cls, barcode_file, max_ed=1, cache_dir=None):
+        """
+        return neighbourhood(barcode_file, max_ed), loading it from its cache file if
+        one exists. Otherwise, the neighbourhood is constructed and saved for
+        subsequent runs; failing to save it is not an error.
+
+        :param str barcode_file: file with one valid barcode sequence per line
+        :param int max_ed: see neighbourhood()
+        :param str cache_dir: directory of the cache file, see
+          neighbourhood_cache_filename()
+        :return BarcodeIndex:
+        """
+        filename = cls.neighbourhood_cache_filename(barcode_file, max_ed, cache_dir)
+        if os.path.isfile(filename):
+            try:
+                index = cls.load(filename)
+            except (ValueError, OSError) as e:
+                log.warn('Ignoring barcode cache %s: %s' % (filename, e))
+            else:
+                log.info('Loaded barcode neighbourhood from %s.' % filename)
+                return index
+
+        index = cls.neighbourhood(barcode_file, max_ed)
+        try:
+            index.save(filename)
+        except OSError as e:
+            log.warn('Could not write barcode cache %s: %s' % (filename, e))
+        else:
+            log.info('Saved barcode neighbourhood to %s.' % filename)
+        return index
+
+    def save(self, filename):
+        """
+        write the sorted barcodes to filename as a uint64 .npy array. The file is
+        written to a temporary name and then moved into place, so that concurrent runs
+        never read a partial file.
+
+        :param str filename: name of the cache file
+        """
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, self._barcodes.astype(np.uint64))
+            os.replace(temp, filename)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """
+        load an index written by save()
+
+        :param str filename: name of the cache file
+        :param bool mmap: if True, the barcodes are memory-mapped instead of read into
+          memory
+        :return BarcodeIndex:
+        """
+        barcodes = np.load(filename, mmap_mode='r' if mmap else None)
+        if barcodes.dtype != np.uint64 or barcodes.ndim != 1:
+            raise ValueError('%s is not a barcode cache file' % repr(filename))
+        index = cls.__new__(cls)
+        # the file is sorted and unique; all encoded sequences are below 2 ** 63
+        index._barcodes = barcodes.view(np.int64)
+        return index
+
+    @property
+    def barcodes(self):
+        """sorted array of valid barcodes"""
+        return self._barcodes
+
+    def __len__(self):
+        return len(self._barcodes)
+
+    def __contains__(self, code):
+        return bool(self.contains_many(np.array([code], dtype=np.int64))[0])
+
+    def contains_many(self, codes):
+        """
+        :param np.ndarray codes: encoded barcodes
+        :return np.ndarray: boolean array, True where codes are valid barcodes
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if not len(self._barcodes):
+            return np.zeros(codes.shape, dtype=bool)
+        i = np.minimum(np.searchsorted(self._barcodes, codes), len(self._barcodes) - 1)
+        return self._barcodes[i] == codes
+
+    def find(self, code, max_dist=1):
+        """
+        Find the valid barcode closest to code, within max_dist substitutions
+
+        :param int code: encoded barcode
+        :param int max_dist: maximum hamming distance of the returned barcode
+        :return (int, int, bool): closest valid barcode (0 if none was found), its
+          hamming distance from code (sys.maxsize if none was found), and whether other
+          valid barcodes are equally close. Of equally close barcodes, the smallest
+          encoded barcode is returned
+        """
+        barcodes, distances, ambiguous = self.find_many([code], max_dist)
+        return int(barcodes[0]), int(distances[0]), bool(ambiguous[0])
+
+    def find_many(self, codes, max_dist=1):
+        """
+        Batch version of find
+
+        :param np.ndarray codes: encoded barcodes
+        :param int max_dist: maximum hamming distance of the returned barcodes
+        :return (np.ndarray, np.ndarray, np.ndarray): closest valid barcodes (0 where
+          none was found), their hamming distances (sys.maxsize where none was found),
+          and whether other valid barcodes are equally close
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        barcodes = np.zeros(len(codes), dtype=np.int64)
+        distances = np.full(len(codes), maxsize, dtype=np.int64)
+        ambiguous = np.zeros(len(codes), dtype=bool)
+
+        exact = self.contains_many(codes)
+        barcodes[exact] = codes[exact]
+        distances[exact] = 0
+
+        lengths = DNA3Bit.seq_len_array(codes)
+        for length in np.unique(lengths[~exact]):
+            pending = np.flatnonzero(~exact & (lengths == length))
+            for distance in range(1, min(max_dist, length) + 1):
+                n_neighbours = (
+                    comb(length, distance, exact=True) * _substitutions.shape[1] ** distance)
+                step = max(1, self.max_neighbours // n_neighbours)
+                unresolved = []
+                for start in range(0, len(pending), step):
+                    rows = pending[start:start + step]
+                    neighbours = hamming_neighbours(codes[rows], length, distance)
+                    found = self.contains_many(neighbours)
+                    n_found = found.sum(axis=1)
+                    hit = n_found > 0
+                    # smallest valid neighbour of each row
+                    best = np.where(found, neighbours, np.iinfo(np.int64).max).min(axis=1)
+                    barcodes[rows[hit]] = best[hit]
+                    distances[rows[hit]] = distance
+                    ambiguous[rows[hit]] = n_found[hit] > 1
+                    unresolved.append(rows[~hit])
+                pending = np.concatenate(unresolved) if unresolved else pending
+                if not len(pending):
+                    break
+        return barcodes, distances, ambiguous
+
+
+def _content_hash(filename):
+    """sha1 hex digest of the contents of filename"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def find_correct_barcode(code, barcodes_list, exact_match=False):
     """
     For a given barcode find the closest correct barcode to it from the list (limited to
@@ -1,3 +1,5 @@
+import numpy as np
+
 
 class DNA3Bit(object):
     """
@@ -14,6 +16,22 @@ class DNA3Bit(object):
                    'A': 0b100, 'C': 0b110, 'G': 0b101, 'T': 0b011, 'N': 0b111,
                    'a': 0b100, 'c': 0b110, 'g': 0b101, 't': 0b011, 'n': 0b111}
     bin2strdict = {0b100: b'A', 0b110: b'C', 0b101: b'G', 0b011: b'T', 0b111: b'N'}
+
+    # lookup tables for the batch (*_array) methods. byte 0 is the padding numpy uses
+    # for short entries of fixed-width 'S' arrays and maps to code 0 (skipped);
+    # other bytes without an encoding map to 0b1000 (invalid).
+    _encode_table = np.full(256, 0b1000, dtype=np.uint8)
+    _encode_table[0] = 0
+    for _k, _v in str2bindict.items():
+        if isinstance(_k, int):
+            _encode_table[_k] = _v
+    _decode_table = np.zeros(8, dtype=np.uint8)
+    for _k, _v in bin2strdict.items():
+        _decode_table[_k] = ord(_v)
+    del _k, _v
+
+    # number of 3-bit bases that fit in a non-negative int64
+    max_array_seq_len = 21
     
     @staticmethod
     def encode(b) -> int:
@@ -112,6 +130,119 @@ class DNA3Bit(object):
             seq >>= 3
         return res
     
+    @staticmethod
+    def _as_base_matrix(seqs) -> np.ndarray:
+        """view seqs as a 2-d uint8 array with one row per sequence"""
+        seqs = np.asarray(seqs)
+        if seqs.dtype.kind == 'U':
+            seqs = seqs.astype('S')
+        if seqs.dtype.kind == 'S':
+            width = seqs.dtype.itemsize
+            seqs = np.ascontiguousarray(seqs.ravel())
+            return seqs.view(np.uint8).reshape(-1, width)
+        if seqs.dtype == np.uint8 and seqs.ndim == 2:
+            return seqs
+        raise TypeError('seqs must be an array of bytes (dtype S) or a 2-d uint8 array '
+                        'of bases, not %s' % repr(seqs.dtype))
+
+    @staticmethod
+    def encode_array(seqs) -> np.ndarray:
+        """
+        Batch version of encode. Sequences may be shorter than the array width; numpy
+        pads these with null bytes, which are skipped, so each result is identical to
+        encode() of the corresponding sequence.
+
+        :param np.ndarray seqs: fixed-width 'S' dtype array of sequences (or anything
+          np.asarray converts to one), or a 2-d uint8 array of base characters with one
+          sequence per row, padded with 0
+        :return np.ndarray: int64 array of encoded sequences
+        """
+        codes = np.asfortranarray(DNA3Bit._encode_table[DNA3Bit._as_base_matrix(seqs)])
+        if np.any(codes == 0b1000):
+            raise ValueError('seqs contain characters other than ACGTN')
+        if codes.shape[1] > DNA3Bit.max_array_seq_len and np.any(
+                np.count_nonzero(codes, axis=1) > DNA3Bit.max_array_seq_len):
+            raise ValueError('sequences longer than %d bases do not fit in an int64'
+                             % DNA3Bit.max_array_seq_len)
+        res = np.zeros(codes.shape[0], dtype=np.int64)
+        shift = np.empty(codes.shape[0], dtype=np.int64)
+        for column in codes.T:  # shift only where the column holds a base
+            np.multiply(column != 0, 3, out=shift)
+            res <<= shift
+            res |= column
+        return res
+
+    @staticmethod
+    def decode_array(ints) -> np.ndarray:
+        """
+        Batch version of decode.
+
+        :param np.ndarray ints: array of encoded sequences
+        :return np.ndarray: 'S' dtype array of sequences, as wide as the longest one
+        """
+        ints = np.asarray(ints, dtype=np.int64).ravel()
+        if np.any(ints < 0):
+            raise ValueError('ints must be unsigned (positive) integers')
+        lengths = DNA3Bit.seq_len_array(ints)
+        width = max(int(lengths.max()) if lengths.size else 0, 1)
+        shifts = 3 * (lengths[:, None] - 1 - np.arange(width)[None, :])
+        valid = shifts >= 0
+        codes = (ints[:, None] >> np.where(valid, shifts, 0)) & 0b111
+        if np.any(valid & (DNA3Bit._decode_table[codes] == 0)):
+            raise ValueError('ints contain invalid 3-bit codes')
+        bases = np.where(valid, DNA3Bit._decode_table[codes], 0).astype(np.uint8)
+        return bases.view('S%d' % width).ravel()
+
+    @staticmethod
+    def seq_len_array(ints) -> np.ndarray:
+        """
+        Batch version of seq_len.
+
+        :param np.ndarray ints: array of encoded sequences
+        :return np.ndarray: int64 array of sequence lengths
+        """
+        ints = np.array(ints, dtype=np.int64)
+        res = np.zeros(ints.shape, dtype=np.int64)
+        for _ in range(DNA3Bit.max_array_seq_len):
+            res += ints > 0
+            ints >>= 3
+        return res
+
+    @staticmethod
+    def count_array(seqs, char_bin) -> np.ndarray:
+        """
+        Batch version of count.
+
+        :param np.ndarray seqs: array of encoded sequences
+        :param int char_bin: encoded value of one of the bases
+        :return np.ndarray: int64 array, the number of times char_bin occurs in each seq
+        """
+        if char_bin not in DNA3Bit.bin2strdict.keys():
+            raise ValueError("DNA3Bit.count_array was called with an invalid char code "
+                             "- {}".format(char_bin))
+        seqs = np.array(seqs, dtype=np.int64)
+        res = np.zeros(seqs.shape, dtype=np.int64)
+        for _ in range(DNA3Bit.max_array_seq_len):
+            res += (seqs > 0) & ((seqs & 0b111) == char_bin)
+            seqs >>= 3
+        return res
+
+    @staticmethod
+    def contains_array(seqs, char: int) -> np.ndarray:
+        """
+        Batch version of contains.
+
+        :param np.ndarray seqs: array of encoded sequences
+        :param int char: encoded character (one must be only one nucleotide)
+        :return np.ndarray: boolean array, True where char is contained in seq
+        """
+        seqs = np.array(seqs, dtype=np.int64)
+        res = np.zeros(seqs.shape, dtype=bool)
+        for _ in range(DNA3Bit.max_array_seq_len):
+            res |= (seqs > 0) & ((seqs & 0b111) == char)
+            seqs >>= 3
+        return res
+
 
 # TODO: this was written for tests, not sure it's being used anymore
 #   @staticmethod
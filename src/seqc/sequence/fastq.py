@@ -1,6 +1,13 @@
 import os
+import shlex
+from collections import deque, Counter
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from subprocess import Popen, PIPE
 import numpy as np
 from seqc import reader
+from seqc.sequence.sidecar import BarcodeSidecar
 
 
 class FastqRecord:
@@ -115,12 +122,146 @@ class FastqRecord:
         )
 
 
+class FastqBatch:
+    """Block of fastq records that share one bytes buffer
+
+    Records are not unpacked into objects; the batch stores the offset of the start of
+    each line, so that fields of all records can be sliced out of the buffer at once:
+    :property buffer: bytes holding the records
+    :property line_starts: np.ndarray(int64), offset of each of the 4 * len(self) lines,
+      followed by the offset at which the last record ends
+    :method field: start and end offsets of one field (0-3) of every record
+    :method sequence_lengths: length of each sequence, without its newline
+    :method sequence_array: the first bases of every sequence as a 2-d uint8 array
+    :method records: iterator over (name, sequence, name2, quality) tuples
+    :method split: divide the batch in two without copying the buffer
+    """
+
+    __slots__ = ["buffer", "line_starts"]
+
+    def __init__(self, buffer: bytes, line_starts: np.ndarray):
+        self.buffer = buffer
+        self.line_starts = line_starts
+
+    @classmethod
+    def from_buffer(cls, buffer: bytes):
+        """parse a buffer of newline-terminated fastq lines, as produced by
+        Reader.iter_blocks(lines_per_record=4). Lines after the last complete record
+        are ignored.
+
+        :param bytes buffer: fastq records
+        :return FastqBatch: batch of the records in buffer
+        """
+        newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == 10)
+        n_lines = len(newlines) - len(newlines) % 4
+        line_starts = np.zeros(n_lines + 1, dtype=np.int64)
+        line_starts[1:] = newlines[:n_lines] + 1
+        return cls(buffer, line_starts)
+
+    def __len__(self):
+        return (len(self.line_starts) - 1) // 4
+
+    def __bytes__(self) -> bytes:
+        return self.buffer[self.line_starts[0] : self.line_starts[-1]]
+
+    def __iter__(self):
+        for record in self.records():
+            yield FastqRecord(record)
+
+    def field(self, i) -> (np.ndarray, np.ndarray):
+        """
+        :param int i: 0 for names, 1 for sequences, 2 for name2 and 3 for qualities
+        :return np.ndarray, np.ndarray: start and end offsets (including the
+          terminating newline) of field i of each record
+        """
+        return self.line_starts[i:-1:4], self.line_starts[i + 1 :: 4]
+
+    def sequence_lengths(self) -> np.ndarray:
+        starts, ends = self.field(1)
+        return ends - starts - 1
+
+    def sequence_array(self, length: int) -> np.ndarray:
+        """
+        :param int length: number of leading bases to extract; every sequence in the
+          batch must be at least this long
+        :return np.ndarray: (len(self), length) uint8 array of ascii bases
+        """
+        if len(self) and self.sequence_lengths().min() < length:
+            raise ValueError(
+                "batch contains sequences shorter than %d bases" % length
+            )
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        return data[self.field(1)[0][:, np.newaxis] + np.arange(length)]
+
+    def records(self):
+        """iterate over the raw records of the batch
+
+        :yields (bytes, bytes, bytes, bytes): (name, sequence, name2, quality) lines,
+          each with its newline
+        """
+        buffer = self.buffer
+        offsets = self.line_starts.tolist()
+        for i in range(0, len(offsets) - 1, 4):
+            yield (
+                buffer[offsets[i] : offsets[i + 1]],
+                buffer[offsets[i + 1] : offsets[i + 2]],
+                buffer[offsets[i + 2] : offsets[i + 3]],
+                buffer[offsets[i + 3] : offsets[i + 4]],
+            )
+
+    def annotate(self, annotations) -> bytes:
+        """prepend an annotation to the name of each record, as
+        FastqRecord.add_annotation does
+
+        :param [bytes] annotations: one annotation per record, each the ":"-joined
+          annotation fields
+        :return bytes: the annotated records
+        """
+        buffer = self.buffer
+        record_starts = self.line_starts[::4].tolist()
+        pieces = [b"@", None, b";", None] * len(self)
+        pieces[1::4] = annotations
+        pieces[3::4] = [
+            buffer[start + 1 : end]
+            for start, end in zip(record_starts[:-1], record_starts[1:])
+        ]
+        return b"".join(pieces)
+
+    def rename(self, names) -> bytes:
+        """replace the name line of each record
+
+        :param [bytes] names: one name line per record, including "@" and "\\n"
+        :return bytes: the renamed records
+        """
+        buffer = self.buffer
+        line_starts = self.line_starts.tolist()
+        pieces = [None, None] * len(self)
+        pieces[0::2] = names
+        pieces[1::2] = [
+            buffer[start:end]
+            for start, end in zip(line_starts[1::4], line_starts[4::4])
+        ]
+        return b"".join(pieces)
+
+    def split(self, n) -> ("FastqBatch", "FastqBatch"):
+        """
+        :param int n: number of records in the first batch
+        :return FastqBatch, FastqBatch: the first n records and the remaining records,
+          both viewing self.buffer
+        """
+        return (
+            FastqBatch(self.buffer, self.line_starts[: 4 * n + 1]),
+            FastqBatch(self.buffer, self.line_starts[4 * n :]),
+        )
+
+
 class Reader(reader.Reader):
     """
     Fastq Reader, defines some special methods for reading and summarizing fastq data:
 
     :method __iter__: Iterator over fastq Record objects
     :method __len__: return number of records in file
+    :method iter_batches: Iterator over FastqBatch objects
     :method estimate_sequence_length: estimate the length of fastq sequences in file
     """
 
@@ -130,8 +271,24 @@ class Reader(reader.Reader):
         return zip(*args)
 
     def __iter__(self):
-        for record in self.record_grouper(super().__iter__()):
-            yield FastqRecord(record)
+        for batch in self.iter_batches():
+            yield from batch
+
+    def iter_batches(self, block_size=1 << 22, decompressor=None, threaded=False):
+        """iterate over batches of records parsed from large decompressed blocks
+
+        :param int block_size: approximate number of bytes per batch
+        :param str decompressor: optional command that decompresses a file to stdout,
+          e.g. "pigz -dc"; see reader.Reader.iter_blocks
+        :param bool threaded: if True, read and decompress ahead in a background thread
+        :yields FastqBatch: batches of records; incomplete trailing records are dropped
+        """
+        for block in self.iter_blocks(
+            block_size, lines_per_record=4, decompressor=decompressor, threaded=threaded
+        ):
+            batch = FastqBatch.from_buffer(block)
+            if len(batch):
+                yield batch
 
     def __len__(self):
         """
@@ -141,6 +298,21 @@ class Reader(reader.Reader):
         """
         return sum(1 for _ in self) / 4
 
+    def iter_chunks(self, chunk_size):
+        """iterate over lists of raw records without wrapping them in FastqRecords
+
+        :param int chunk_size: number of records per chunk; the last chunk may be
+          shorter
+        :yields [(bytes, bytes, bytes, bytes)]: lists of (name, sequence, name2,
+          quality) lines
+        """
+        records = (r for batch in self.iter_batches() for r in batch.records())
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
     def estimate_sequence_length(self):
         """
         estimate the sequence length of a fastq file from the first 10000 records of
@@ -149,30 +321,184 @@ class Reader(reader.Reader):
         :return: int mean, float standard deviation, (np.ndarray: observed lengths,
           np.ndarray: counts per length)
         """
-        i = 0
-        records = iter(self)
-        data = np.empty(10000, dtype=int)
-        while i < 10000:
-            try:
-                seq = next(records).sequence
-            except StopIteration:  # for fastq files shorter than 10000 records
-                data = data[:i]
+        lengths = []
+        n = 0
+        for batch in self.iter_batches(block_size=1 << 20):
+            lengths.append(batch.sequence_lengths()[: 10000 - n])
+            n += len(lengths[-1])
+            if n == 10000:
                 break
-            data[i] = len(seq) - 1  # last character is a newline
-            i += 1
+        # fastq files may be shorter than 10000 records
+        data = np.concatenate(lengths) if lengths else np.empty(0, dtype=int)
         return np.mean(data), np.std(data), np.unique(data, return_counts=True)
 
 
-def merge_paired(merge_function, fout, genomic, barcode=None) -> (str, int):
+def _init_merge_worker(merge_function, merge_batch=None):
+    global _merge
+    if merge_batch is None:
+        _merge = partial(_merge_batches, merge_function)
+    else:
+        _merge = merge_batch
+
+
+def _merge_batches(merge_function, genomic, barcode=None, counts=None):
+    """merge the records of a genomic batch and, optionally, a barcode batch of the
+    same length
+
+    :param merge_function: function from merge_functions.py
+    :param FastqBatch genomic: genomic records
+    :param FastqBatch barcode: barcode records, or None
+    :param collections.Counter counts: accepted for compatibility with merge_batch
+      functions; merge_function reports no statistics
+    :return bytes: merged records
+    """
+    if barcode is None:
+        return b"".join(bytes(merge_function(g)) for g in genomic)
+    return b"".join(bytes(merge_function(g, b)) for g, b in zip(genomic, barcode))
+
+
+def _merge_chunk(chunk):
+    """merge a chunk of raw records in a worker process; see merge_paired
+
+    :param tuple chunk: (genomic bytes, barcode bytes or None, first ordinal or None);
+      genomic and barcode hold the same number of fastq records. If the ordinal of the
+      first record is given, annotations are moved into barcode sidecar records
+    :return (bytes, Counter, np.ndarray): merged records, the statistics reported while
+      merging them, and their sidecar records (None without a first ordinal)
+    """
+    genomic, barcode, first_ordinal = chunk
+    counts = Counter()
+    merged = _merge(
+        FastqBatch.from_buffer(genomic),
+        FastqBatch.from_buffer(barcode) if barcode is not None else None,
+        counts,
+    )
+    if first_ordinal is None:
+        return merged, counts, None
+    records, merged = BarcodeSidecar.split_annotations(
+        FastqBatch.from_buffer(merged), first_ordinal
+    )
+    return merged, counts, records
+
+
+def _paired_batches(genomic, barcode, chunk_size, **kwargs):
+    """iterate over batches of genomic and barcode records that hold the same reads
+
+    Batches read from the two files are split wherever either one ends, and into at
+    most chunk_size records; splitting only slices the offsets of a batch.
+
+    :param Reader genomic: genomic records
+    :param Reader barcode: barcode records, or None
+    :param int chunk_size: maximum number of records per batch
+    :param kwargs: keyword arguments for Reader.iter_batches()
+    :yields (FastqBatch, FastqBatch | None): genomic and barcode batches
+    """
+    if barcode is None:
+        for g in genomic.iter_batches(**kwargs):
+            while len(g):
+                chunk, g = g.split(min(chunk_size, len(g)))
+                yield chunk, None
+        return
+
+    g_batches = genomic.iter_batches(**kwargs)
+    b_batches = barcode.iter_batches(**kwargs)
+    g = b = None
+    while True:
+        if g is None or not len(g):
+            g = next(g_batches, None)
+        if b is None or not len(b):
+            b = next(b_batches, None)
+        if g is None or b is None:  # like zip(), stop at the end of the shorter file
+            return
+        g_chunk, g = g.split(min(chunk_size, len(g), len(b)))
+        b_chunk, b = b.split(len(g_chunk))
+        yield g_chunk, b_chunk
+
+
+class _MergedOutput:
+    """file-like sink for merge_paired that writes merged records to fout and,
+    optionally, to a compressed archive at the same time"""
+
+    def __init__(self, fout, compressor=None, archive=None, archive_compressor="gzip"):
+        self._files = []
+        self._processes = []
+        self._sinks = [self._open(fout, compressor)]
+        if archive:
+            self._sinks.append(self._open(archive, archive_compressor))
+
+    def _open(self, filename, compressor):
+        f = open(filename, "wb")
+        self._files.append(f)
+        if not compressor:
+            return f
+        proc = Popen(shlex.split(compressor) + ["-c"], stdin=PIPE, stdout=f)
+        self._processes.append((proc, compressor, filename))
+        return proc.stdin
+
+    def write(self, data):
+        for sink in self._sinks:
+            sink.write(data)
+
+    def close(self):
+        for sink in self._sinks:
+            sink.close()
+        for proc, compressor, filename in self._processes:
+            if proc.wait() != 0:
+                raise ChildProcessError(
+                    "%s exited with status %d while compressing %s"
+                    % (compressor, proc.returncode, filename)
+                )
+        for f in self._files:
+            f.close()
+
+
+def merge_paired(
+    merge_function,
+    fout,
+    genomic,
+    barcode=None,
+    n_processes=1,
+    compressor=None,
+    chunk_size=10000,
+    archive=None,
+    archive_compressor="gzip",
+    decompressor=None,
+    merge_batch=None,
+    counts=None,
+    barcode_sidecar=None,
+) -> (str, int):
     """
     General function to annotate genomic fastq with barcode information from reverse read.
     Takes a merge_function which indicates which kind of platform was used to generate
     the data, and specifies how the merging should be done.
 
+    Records are read in large decompressed blocks (see Reader.iter_batches). When
+    n_processes > 1, chunks of up to chunk_size records are merged by a pool of worker
+    processes. Merged chunks are written in input order, so the output is identical to
+    a single-process merge.
+
     :param merge_function: function from merge_functions.py
-    :param fout: merged output file name
+    :param fout: merged output file name. May be a named pipe, e.g. one read by STAR
     :param genomic: fastq containing genomic data
     :param barcode: fastq containing barcode data
+    :param int n_processes: number of processes used to merge records
+    :param str compressor: optional command that compresses stdin to stdout (e.g.
+      "pigz"). If provided, merged records are streamed through it into fout, which
+      should then carry the matching extension (e.g. .gz)
+    :param int chunk_size: number of records merged per task when n_processes > 1
+    :param str archive: optional second output file. Merged records are also streamed
+      through archive_compressor into this file while fout is written
+    :param str archive_compressor: command used to compress archive
+    :param str decompressor: optional command that decompresses compressed input to
+      stdout (e.g. "pigz -dc"); otherwise input is decompressed with gzip/bz2
+    :param merge_batch: optional function that merges a (genomic, barcode) pair of
+      FastqBatches into bytes, e.g. AbstractPlatform.merge_batch. If provided it is
+      used instead of calling merge_function for each record
+    :param collections.Counter counts: optional counter that collects the merge
+      statistics merge_batch reports (e.g. how each read's spacer was located)
+    :param str barcode_sidecar: optional file name. If provided, the cell, rmt and
+      number of poly-T of each read are written to this BarcodeSidecar, and each merged
+      record is named by its ordinal instead of being annotated
     :return str fout, filename of merged fastq file
 
     """
@@ -180,17 +506,68 @@ def merge_paired(merge_function, fout, genomic, barcode=None) -> (str, int):
     if directory and not os.path.isdir(directory):
         os.makedirs(directory, exist_ok=True)
     genomic = Reader(genomic)
-    if barcode:
-        barcode = Reader(barcode)
-        with open(fout, "wb") as f:
-            for g, b in zip(genomic, barcode):
-                r = merge_function(g, b)
-                f.write(bytes(r))
-    else:
-        with open(fout, "wb") as f:
-            for g in genomic:
-                r = merge_function(g)
-                f.write(bytes(r))
+    barcode = Reader(barcode) if barcode else None
+
+    out = _MergedOutput(fout, compressor, archive, archive_compressor)
+    sidecar = BarcodeSidecar(barcode_sidecar) if barcode_sidecar else None
+    try:
+        # a decompressor subprocess already runs alongside the merge; otherwise
+        # decompress the next blocks in a thread
+        batches = _paired_batches(
+            genomic,
+            barcode,
+            chunk_size,
+            decompressor=decompressor,
+            threaded=decompressor is None,
+        )
+        if n_processes > 1:
+            with Pool(
+                n_processes,
+                initializer=_init_merge_worker,
+                initargs=(merge_function, merge_batch),
+            ) as pool:
+                # bound the number of chunks in flight so that input is not read
+                # faster than it can be merged and written
+                pending = deque()
+                n_dispatched = 0
+
+                def write_next():
+                    merged, chunk_counts, records = pending.popleft().get()
+                    if sidecar is not None:
+                        sidecar.write(records)
+                    out.write(merged)
+                    if counts is not None:
+                        counts.update(chunk_counts)
+
+                for g, b in batches:
+                    chunk = (
+                        bytes(g),
+                        bytes(b) if b is not None else None,
+                        n_dispatched if sidecar is not None else None,
+                    )
+                    n_dispatched += len(g)
+                    pending.append(pool.apply_async(_merge_chunk, (chunk,)))
+                    if len(pending) >= 2 * n_processes:
+                        write_next()
+                while pending:
+                    write_next()
+        else:
+            if merge_batch is None:
+                merge_batch = partial(_merge_batches, merge_function)
+            for g, b in batches:
+                merged = merge_batch(g, b, counts)
+                if sidecar is not None:
+                    records, merged = BarcodeSidecar.split_annotations(
+                        FastqBatch.from_buffer(merged), len(sidecar)
+                    )
+                    sidecar.write(records)
+                out.write(merged)
+    finally:
+        # the sidecar is complete before the end of the merged records is seen, e.g.
+        # by STAR reading them from a named pipe
+        if sidecar is not None:
+            sidecar.close()
+        out.close()
 
     return fout
 
@@ -223,15 +600,20 @@ def truncate(fastq_file, lengths):
         files.append(open(name, "wb"))
 
     i = 0
-    indices = list(range(len(lengths)))
-    for record in r:
+    for batch in r.iter_batches():
+        # keep the first 10e6 + 1 records
+        if i + len(batch) > 10e6 + 1:
+            batch, _ = batch.split(int(10e6 + 1 - i))
+        for j, l in enumerate(lengths):
+            files[j].write(
+                b"".join(
+                    name + seq[:-1][:l] + b"\n" + name2 + qual[:-1][:l] + b"\n"
+                    for name, seq, name2, qual in batch.records()
+                )
+            )
+        i += len(batch)
         if i > 10e6:
             break
-        for j in indices:
-            record.sequence = record.sequence[:-1][: lengths[j]] + b"\n"
-            record.quality = record.quality[:-1][: lengths[j]] + b"\n"
-            files[j].write(bytes(record))
-        i += 1
 
     for f in files:
         f.close()
@@ -1,10 +1,13 @@
 import os
 import re
+import json
+import hashlib
+import tempfile
 import fileinput
 import string
 from collections import defaultdict
-from seqc import reader
-from intervaltree import IntervalTree
+import numpy as np
+from seqc import reader, log
 
 
 class Record:
@@ -145,13 +148,29 @@ def first(iterable):
 
 class GeneIntervals:
     """
-    Encodes genomic ranges in an Intervaltree
+    Encodes genomic ranges as sorted, disjoint segments, each labelled with the unique
+    gene that occupies it
 
     :method translate: translates a genomic coordinate on a stranded chromosome into the
       gene identifier that occupies that location (if any exists)
+    :method translate_many: vectorized translate for arrays of coordinates
+    :method cached: load a translator from its cache file, building and saving it on
+      a cache miss
+    :method save: write the translator and the gene id to symbol map to a cache file
+    :method load: memory-map a translator from a cache file
 
     """
 
+    # segment labels that are not gene identifiers
+    NO_GENE = -1
+    AMBIGUOUS = -2
+
+    # cache file layout: magic, uint64 header length, json header, then the raw arrays
+    # listed in the header, each aligned to _cache_alignment bytes
+    _cache_magic = b"SEQCGTF\x00"
+    _cache_version = 1
+    _cache_alignment = 64
+
     def __init__(self, gtf: str, max_transcript_length=1000):
         """Construct a dictionary containing genomic intervals that map to genes. Allows
         the translation of alignment coordinates (chromosome, strand, position) to
@@ -167,10 +186,235 @@ class GeneIntervals:
           transcript sizes indicates that the majority of non-erroneous fragments of
           mRNA molecules should align within this region.
         """
+        self._gtf = gtf
+        self._gtf_hash = None
+        self._max_transcript_length = max_transcript_length
+        self._gene_id_map = None
         self._chromosomes_to_genes = self.construct_translator(
             gtf, max_transcript_length
         )
 
+    @property
+    def gene_id_map(self):
+        """map of integer gene ids to official gene symbols, see
+        create_gene_id_to_official_gene_symbol_map(). Read from the cache file if the
+        translator was loaded from one, otherwise parsed from the gtf on first access"""
+        if self._gene_id_map is None:
+            self._gene_id_map = create_gene_id_to_official_gene_symbol_map(self._gtf)
+        return self._gene_id_map
+
+    @staticmethod
+    def cache_filename(gtf, max_transcript_length=1000, cache_dir=None, gtf_hash=None):
+        """name of the cache file holding the translator for gtf and
+        max_transcript_length
+
+        :param str gtf: annotation file in GTF format
+        :param int max_transcript_length: see __init__()
+        :param str cache_dir: directory of the cache file. Defaults to the directory
+          containing gtf, i.e. the index
+        :param str gtf_hash: content hash of gtf, if already computed
+        :return str: filename of the cache file
+        """
+        if gtf_hash is None:
+            gtf_hash = gtf_content_hash(gtf)
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(gtf))
+        return os.path.join(
+            cache_dir,
+            "%s.%s.%d.translator"
+            % (os.path.basename(gtf), gtf_hash[:16], max_transcript_length),
+        )
+
+    @classmethod
+    def cached(cls, gtf, max_transcript_length=1000, cache_dir=None):
+        """return the translator for gtf and max_transcript_length, loading it from
+        its cache file if one exists. Otherwise, the translator is constructed and saved
+        for subsequent runs; failing to save it (e.g. to a read-only index) is not an
+        error.
+
+        :param str gtf: annotation file in GTF format. Can be gz or bz2 compressed
+        :param int max_transcript_length: see __init__()
+        :param str cache_dir: directory of the cache file, see cache_filename()
+        :return GeneIntervals: translator
+        """
+        gtf_hash = gtf_content_hash(gtf)
+        filename = cls.cache_filename(gtf, max_transcript_length, cache_dir, gtf_hash)
+        translator = cls._load_cache(filename, gtf_hash, max_transcript_length)
+        if translator is not None:
+            return translator
+
+        translator = cls(gtf, max_transcript_length)
+        try:
+            translator.save(filename, gtf_hash)
+        except OSError as e:
+            log.warn("Could not write translator cache %s: %s" % (filename, e))
+        else:
+            log.info("Saved translator to %s." % filename)
+        return translator
+
+    @classmethod
+    def cached_gene_id_map(cls, gtf, max_transcript_length=1000, cache_dir=None):
+        """return the gene id to symbol map of gtf, read from the translator cache file
+        if one exists. Otherwise, the map is created from gtf without building the
+        translator.
+
+        :param str gtf: annotation file in GTF format
+        :param int max_transcript_length: see __init__()
+        :param str cache_dir: directory of the cache file, see cache_filename()
+        :return dict: gene id to symbol map, see
+          create_gene_id_to_official_gene_symbol_map()
+        """
+        gtf_hash = gtf_content_hash(gtf)
+        filename = cls.cache_filename(gtf, max_transcript_length, cache_dir, gtf_hash)
+        translator = cls._load_cache(filename, gtf_hash, max_transcript_length)
+        if translator is not None:
+            return translator.gene_id_map
+        return create_gene_id_to_official_gene_symbol_map(gtf)
+
+    @classmethod
+    def _load_cache(cls, filename, gtf_hash, max_transcript_length):
+        """load the translator cache filename, if it exists and was built from the gtf
+        with content hash gtf_hash and max_transcript_length
+
+        :return GeneIntervals | None: the cached translator, or None
+        """
+        if not os.path.isfile(filename):
+            return None
+        try:
+            translator = cls.load(filename)
+        except ValueError as e:
+            log.warn("Ignoring translator cache %s: %s" % (filename, e))
+            return None
+        if (
+            translator._gtf_hash == gtf_hash
+            and translator._max_transcript_length == max_transcript_length
+        ):
+            log.info("Loaded translator from %s." % filename)
+            return translator
+        log.warn(
+            "Ignoring translator cache %s: it was built from a different "
+            "annotation." % filename
+        )
+        return None
+
+    def save(self, filename, gtf_hash=None):
+        """write the translator and its gene id to symbol map to filename. The file is
+        written to a temporary name and then moved into place, so that concurrent runs
+        never read a partial file.
+
+        :param str filename: name of the cache file
+        :param str gtf_hash: content hash of the gtf, if already computed
+        """
+        if gtf_hash is None:
+            gtf_hash = self._gtf_hash or gtf_content_hash(self._gtf)
+
+        segments = []
+        boundaries, labels = [], []
+        offset = 0
+        for chromosome in sorted(self._chromosomes_to_genes):
+            for strand in sorted(self._chromosomes_to_genes[chromosome]):
+                b, l = self._chromosomes_to_genes[chromosome][strand]
+                segments.append([chromosome, strand, offset, offset + len(b)])
+                boundaries.append(b)
+                labels.append(l)
+                offset += len(b)
+
+        gene_ids = np.array(sorted(self.gene_id_map), dtype=np.int64)
+        # symbols may contain "-", so they are stored tab separated, one gene per line
+        symbols = "\n".join("\t".join(self.gene_id_map[i]) for i in gene_ids)
+        arrays = {
+            "boundaries": np.concatenate(boundaries or [np.empty(0, np.int64)]),
+            "labels": np.concatenate(labels or [np.empty(0, np.int64)]),
+            "gene_ids": gene_ids,
+            "symbols": np.frombuffer(symbols.encode(), dtype=np.uint8),
+        }
+
+        align = self._cache_alignment
+        position = 0
+        descriptors = {}
+        for name, array in arrays.items():
+            descriptors[name] = [position, array.dtype.str, len(array)]
+            position += -(-array.nbytes // align) * align
+        header = json.dumps(
+            {
+                "version": self._cache_version,
+                "gtf_hash": gtf_hash,
+                "max_transcript_length": self._max_transcript_length,
+                "segments": segments,
+                "arrays": descriptors,
+            }
+        ).encode()
+        prefix = len(self._cache_magic) + 8 + len(header)
+        data_start = -(-prefix // align) * align
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._cache_magic)
+                f.write(np.uint64(len(header)).tobytes())
+                f.write(header)
+                for name, array in arrays.items():
+                    f.seek(data_start + descriptors[name][0])
+                    f.write(array.tobytes())
+                f.truncate(data_start + position)
+            os.replace(temp, filename)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """load a translator written by save()
+
+        :param str filename: name of the cache file
+        :param bool mmap: if True, the interval arrays are memory-mapped instead of read
+          into memory
+        :return GeneIntervals: translator
+        """
+        with open(filename, "rb") as f:
+            magic = f.read(len(cls._cache_magic))
+            header_length = np.frombuffer(f.read(8), dtype=np.uint64)
+            if magic != cls._cache_magic or len(header_length) != 1:
+                raise ValueError("%s is not a translator cache file" % repr(filename))
+            header = json.loads(f.read(int(header_length[0])).decode())
+            if header["version"] != cls._cache_version:
+                raise ValueError(
+                    "unsupported translator cache version %s" % repr(header["version"])
+                )
+            prefix = f.tell()
+
+        if mmap:
+            buffer = np.memmap(filename, dtype=np.uint8, mode="r")
+        else:
+            buffer = np.fromfile(filename, dtype=np.uint8)
+        data_start = -(-prefix // cls._cache_alignment) * cls._cache_alignment
+        arrays = {}
+        for name, (position, dtype, length) in header["arrays"].items():
+            dtype = np.dtype(dtype)
+            start = data_start + position
+            arrays[name] = buffer[start : start + length * dtype.itemsize].view(dtype)
+
+        translator = cls.__new__(cls)
+        translator._gtf = None
+        translator._gtf_hash = header["gtf_hash"]
+        translator._max_transcript_length = header["max_transcript_length"]
+        translator._chromosomes_to_genes = defaultdict(dict)
+        for chromosome, strand, start, stop in header["segments"]:
+            translator._chromosomes_to_genes[chromosome][strand] = (
+                arrays["boundaries"][start:stop],
+                arrays["labels"][start:stop],
+            )
+        translator._chromosomes_to_genes = dict(translator._chromosomes_to_genes)
+
+        symbols = arrays["symbols"].tobytes().decode()
+        gene_id_map = defaultdict(tuple)
+        if len(arrays["gene_ids"]):
+            for gene_id, names in zip(arrays["gene_ids"], symbols.split("\n")):
+                gene_id_map[int(gene_id)] = tuple(names.split("\t"))
+        translator._gene_id_map = gene_id_map
+        return translator
+
     @staticmethod
     def iterate_adjusted_exons(exons, strand, max_transcript_length):
         """
@@ -195,52 +439,84 @@ class GeneIntervals:
                 yield start, end
                 max_transcript_length -= size
 
-    # todo implement me.
     @staticmethod
-    def _remove_overlapping_intervals(dictionary):
-        """
-        The intervaltree is a dictionary-based structure, so automatically stores a
-        unique set of intervals.
+    def _merge_gene_intervals(starts, ends, genes):
+        """merge overlapping or adjacent intervals that belong to the same gene
 
-        we could parse the tree interval by interval by calling overlap queries using
-        each interval. Then, we could update based on the result.
-
-        removing duplicates within the same gene is very easy; we simply replace each
-        duplicate with their union, as all alignments in these intervals correspond to a
-        unique assignment.
-
-        removing overlaps between exons of different genes can be done using symmetric
-        difference, because we want to eliminate overlaps that are ambiguous between more
-        than one gene
-
-        What follows is a skeleton that could be used to parse intervals. I suspect using
-        bisection may be the quickest way to find out which category (above) an interval
-        is in. However, optimization of this function is not critical, as it need only
-        be called once per run.
-
-        :param dict dictionary: result of self.construct_translator()
-        :return dict: dictionary whose intervals correspond to unique gene assignments
+        :param np.ndarray starts: interval starts
+        :param np.ndarray ends: interval ends (exclusive)
+        :param np.ndarray genes: gene of each interval
+        :return (np.ndarray, np.ndarray, np.ndarray): merged starts, ends and genes
         """
+        order = np.lexsort((starts, genes))
+        starts, ends, genes = starts[order], ends[order], genes[order]
+        new_gene = np.ones(len(genes), dtype=bool)
+        new_gene[1:] = genes[1:] != genes[:-1]
+
+        # running maximum of the interval ends, restarted at each gene: offsetting each
+        # gene by more than the largest coordinate keeps the maxima of genes apart
+        offset = (np.cumsum(new_gene) - 1) * (ends.max() + 1)
+        reach = np.maximum.accumulate(ends + offset) - offset
+
+        # an interval opens a new merged interval if it starts beyond the reach of
+        # all previous intervals of its gene
+        opens = new_gene.copy()
+        opens[1:] |= starts[1:] > reach[:-1]
+        closes = np.roll(opens, -1)
+        closes[-1] = True
+        return starts[opens], reach[closes], genes[opens]
+
+    @classmethod
+    def _remove_overlapping_intervals(cls, dictionary):
+        """
+        Convert the intervals of each chromosome and strand into sorted, disjoint
+        segments that each map to a unique gene.
+
+        Duplicate and overlapping intervals within the same gene are first replaced by
+        their union, as all alignments in these intervals correspond to a unique
+        assignment. Overlaps between exons of different genes are ambiguous; these
+        segments are labelled AMBIGUOUS. Segments covered by no interval are labelled
+        NO_GENE.
+
+        :param dict dictionary: {chromosome: {strand: [(start, end, gene), ...]}}, end
+          is exclusive
+        :return dict: {chromosome: {strand: (boundaries, labels)}}. Segment i spans
+          [boundaries[i], boundaries[i + 1]) and maps to labels[i]; positions past the
+          final boundary map to NO_GENE
+        """
+        results = {}
+        for chromosome in dictionary:
+            results[chromosome] = {}
+            for strand, intervals in dictionary[chromosome].items():
+                starts, ends, genes = (
+                    np.array(column, dtype=np.int64) for column in zip(*intervals)
+                )
+                starts, ends, genes = cls._merge_gene_intervals(starts, ends, genes)
 
-        def parse_intervals(query, other, tree):
-            """private function to parse intervals, should side-effect to modify
-            interval_tree
-
-            :param query: the interval tested for overlaps
-            :param set other: set of Interval objects which overlapped the query
-              interval
-            :param tree: the tree which should be modified
-            :return None: side-effecting function
-            """
-            raise NotImplementedError
+                # sweep over interval boundaries, tracking the number of genes and the
+                # sum of their ids; where exactly one gene is present, the sum is its id
+                positions = np.concatenate([starts, ends])
+                count_delta = np.concatenate(
+                    [np.ones(len(starts), np.int64), -np.ones(len(ends), np.int64)]
+                )
+                gene_delta = np.concatenate([genes, -genes])
+                boundaries, inverse = np.unique(positions, return_inverse=True)
+                count = np.zeros(len(boundaries), dtype=np.int64)
+                np.add.at(count, inverse, count_delta)
+                gene_sum = np.zeros(len(boundaries), dtype=np.int64)
+                np.add.at(gene_sum, inverse, gene_delta)
+                count, gene_sum = np.cumsum(count), np.cumsum(gene_sum)
+                labels = np.where(
+                    count == 1,
+                    gene_sum,
+                    np.where(count == 0, cls.NO_GENE, cls.AMBIGUOUS),
+                )
 
-        # get each intervaltree # todo can be parallelized
-        for chromosome in dictionary:
-            for strand, interval_tree in dictionary[chromosome].items():
-                for iv in interval_tree:
-                    intervals = interval_tree.search(iv.begin, iv.end)
-                    if intervals:
-                        parse_intervals(iv, intervals, interval_tree)
+                # drop boundaries that do not change the label
+                keep = np.ones(len(labels), dtype=bool)
+                keep[1:] = labels[1:] != labels[:-1]
+                results[chromosome][strand] = (boundaries[keep], labels[keep])
+        return results
 
     def construct_translator(self, gtf, max_transcript_length):
         """Construct a dictionary containing genomic intervals that map to genes. Allows
@@ -257,10 +533,10 @@ class GeneIntervals:
           transcript sizes indicates that the majority of non-erroneous fragments of
           mRNA molecules should align within this region.
 
-        :return dict: {chromosome: {strand: {position: gene}}}, nested dictionary of
-          chromosome -> strand -> position which returns a gene.
+        :return dict: {chromosome: {strand: (boundaries, labels)}}, see
+          _remove_overlapping_intervals()
         """
-        results_dictionary = defaultdict(dict)
+        results_dictionary = defaultdict(lambda: defaultdict(list))
         for (tx_chromosome, tx_strand, gene_id), exons in Reader(
             gtf
         ).iter_transcripts():
@@ -269,21 +545,15 @@ class GeneIntervals:
             ):
                 if start == end:
                     continue  # zero-length exons apparently occur in the gtf
-                try:
-                    results_dictionary[tx_chromosome][tx_strand].addi(
-                        start, end, gene_id
-                    )
-                except KeyError:
-                    results_dictionary[tx_chromosome][tx_strand] = IntervalTree()
-                    results_dictionary[tx_chromosome][tx_strand].addi(
-                        start, end, gene_id
-                    )
-        return dict(results_dictionary)
+                results_dictionary[tx_chromosome][tx_strand].append(
+                    (start, end, gene_id)
+                )
+        return self._remove_overlapping_intervals(results_dictionary)
 
     def translate(self, chromosome, strand, pos):
         """translates a chromosome, position, and strand into a gene identifier
 
-        Uses the IntervalTree data structure to rapidly search for the corresponding
+        Uses binary search over the sorted segment boundaries to find the corresponding
         identifier.
 
         :param str chromosome: chromosome for this alignment
@@ -292,17 +562,46 @@ class GeneIntervals:
         :return int|None: Returns either an integer gene_id if a unique gene was found
           at the specified position, or None otherwise
         """
-        # todo remove duplicate exons during construction to save time
         try:
-            result = set(
-                x.data for x in self._chromosomes_to_genes[chromosome][strand][pos]
-            )
-            if len(result) == 1:
-                return first(result)  # just right
-            else:
-                return None  # too many genes
+            boundaries, labels = self._chromosomes_to_genes[chromosome][strand]
         except KeyError:
             return None  # no gene
+        i = np.searchsorted(boundaries, pos, side="right") - 1
+        if i < 0:
+            return None  # no gene
+        gene = labels[i]
+        return int(gene) if gene >= 0 else None  # no gene, or too many genes
+
+    def translate_many(self, chromosomes, strands, positions):
+        """vectorized translate()
+
+        :param np.ndarray chromosomes: chromosome of each alignment
+        :param np.ndarray strands: strand of each alignment (one of ['+', '-'])
+        :param np.ndarray positions: position of each alignment within its chromosome
+        :return np.ndarray: int64 array containing the gene_id of each alignment, or
+          NO_GENE (-1) / AMBIGUOUS (-2) where no unique gene was found
+        """
+        chromosomes = np.asarray(chromosomes)
+        strands = np.asarray(strands)
+        positions = np.asarray(positions, dtype=np.int64)
+        result = np.full(len(positions), self.NO_GENE, dtype=np.int64)
+        if not len(positions):
+            return result
+
+        keys, key_index = np.unique(
+            np.char.add(chromosomes.astype(str), strands.astype(str)),
+            return_inverse=True,
+        )
+        for k in range(len(keys)):
+            idx = np.flatnonzero(key_index == k)
+            chromosome, strand = chromosomes[idx[0]], strands[idx[0]]
+            try:
+                boundaries, labels = self._chromosomes_to_genes[chromosome][strand]
+            except KeyError:
+                continue
+            i = np.searchsorted(boundaries, positions[idx], side="right") - 1
+            result[idx] = np.where(i >= 0, labels[np.maximum(i, 0)], self.NO_GENE)
+        return result
 
 
 class Reader(reader.Reader):
@@ -558,6 +857,19 @@ def create_gene_id_to_official_gene_symbol_map(gtf: str):
     return gene_id_map
 
 
+def gtf_content_hash(gtf: str) -> str:
+    """sha1 hex digest of the contents of a gtf file
+
+    :param gtf: str, filename of gtf file
+    :return str: hex digest
+    """
+    digest = hashlib.sha1()
+    with open(gtf, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def ensembl_gene_id_to_official_gene_symbol(ids, gene_id_map):
     """convert data containing ensembl gene ids into an index of gene symbols
 
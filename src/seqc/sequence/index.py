@@ -354,6 +354,29 @@ class Index:
 
         star.create_index(fasta_file, gtf_file, genome_dir, read_length)
 
+    def _create_translator_caches(self, max_transcript_lengths, gtf_file: str = None):
+        """Write translator cache files next to the index, so that runs against the
+        index do not need to parse the annotation; see gtf.GeneIntervals.cached()
+
+        :param max_transcript_lengths: values of max_transcript_length (--max-insert-size)
+          to create caches for
+        :param gtf_file: annotation of the index
+        :return:
+        """
+        if gtf_file is None:
+            gtf_file = os.path.join(
+                self.index_folder_name, self.organism, "annotations.gtf"
+            )
+        gtf_hash = gtf.gtf_content_hash(gtf_file)
+        for max_transcript_length in max_transcript_lengths:
+            translator = gtf.GeneIntervals(gtf_file, max_transcript_length)
+            translator.save(
+                gtf.GeneIntervals.cache_filename(
+                    gtf_file, max_transcript_length, gtf_hash=gtf_hash
+                ),
+                gtf_hash,
+            )
+
     @staticmethod
     def _upload_index(index_directory: str, s3_upload_location: str) -> None:
         """Upload the newly constructed index to s3 at s3_upload_location
@@ -377,12 +400,15 @@ class Index:
         read_length: int,
         valid_biotypes=("protein_coding", "lincRNA"),
         s3_location: str = None,
+        translator_cache_lengths=(),
     ):
         """create an optionally upload an index
 
         :param valid_biotypes: gene biotypes that do not match values in this list will
           be discarded from the annotation and will not appear in final count matrices
         :param s3_location: optional, s3 location to upload the index to.
+        :param translator_cache_lengths: optional, max transcript lengths for which
+          translator cache files are written into the index
         :return:
         """
 
@@ -395,6 +421,10 @@ class Index:
         log.info("Creating STAR index...")
         self._create_star_index(read_length=read_length)
 
+        if translator_cache_lengths:
+            log.info("Creating translator caches...")
+            self._create_translator_caches(translator_cache_lengths)
+
         if s3_location:
             log.info("Uploading...")
             self._upload_index(
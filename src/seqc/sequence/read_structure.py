@@ -0,0 +1,115 @@
+import re
+import numpy as np
+
+
+class ReadStructure:
+    """
+    Declarative layout of a fixed-layout barcode read, e.g. "16C 12U *T" for 10x v3
+    chemistry: 16 bases of cell barcode, 12 bases of rmt, then a poly-T tail that runs
+    to the end of the read.
+
+    Each whitespace-separated segment is a length followed by a kind:
+      C: cell barcode; multiple C segments are concatenated in order
+      U: rmt (UMI); multiple U segments are concatenated in order
+      T: poly-T tail
+      X: skipped bases, e.g. a fixed spacer
+    The length of the last segment may be "*", meaning the rest of the read.
+
+    :property segments: [(int | None, str)], (length, kind) of each segment; the
+      length of a trailing "*" segment is None
+    :property min_length: number of bases covered by the fixed-length segments
+    :method extract: slice cell, rmt and poly-T columns from a block of sequences
+    :method annotate: merge a batch of genomic and barcode records, equivalent to
+      annotating each genomic record with the barcode fields of its mate
+    """
+
+    kinds = "CUTX"
+    _segment = re.compile(r"^(\d+|\*)([%s])$" % kinds)
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.segments = []
+        tokens = spec.split()
+        if not tokens:
+            raise ValueError("read structure %s has no segments" % repr(spec))
+        for i, token in enumerate(tokens):
+            match = self._segment.match(token)
+            if match is None:
+                raise ValueError(
+                    "invalid segment %s in read structure %s"
+                    % (repr(token), repr(spec))
+                )
+            length, kind = match.groups()
+            if length == "*" and i != len(tokens) - 1:
+                raise ValueError(
+                    'only the last segment of read structure %s may be "*"' % repr(spec)
+                )
+            self.segments.append((None if length == "*" else int(length), kind))
+        self.min_length = sum(length or 0 for length, _ in self.segments)
+
+    def __repr__(self):
+        return "ReadStructure(%s)" % repr(self.spec)
+
+    def extract(self, sequences: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+        """slice the barcode fields out of a block of equal-length sequences
+
+        :param np.ndarray sequences: (n, length) uint8 array of ascii bases, with
+          length >= self.min_length
+        :return (np.ndarray, np.ndarray, np.ndarray): (n, *) uint8 arrays of the cell
+          barcode, rmt and poly-T bases of each sequence; kinds that are absent from
+          the structure have zero columns
+        """
+        if sequences.shape[1] < self.min_length:
+            raise ValueError(
+                "sequences of length %d are shorter than read structure %s"
+                % (sequences.shape[1], repr(self.spec))
+            )
+        columns = {kind: [] for kind in self.kinds}
+        start = 0
+        for length, kind in self.segments:
+            stop = sequences.shape[1] if length is None else start + length
+            columns[kind].append(sequences[:, start:stop])
+            start = stop
+        empty = sequences[:, :0]
+        return tuple(
+            np.hstack(columns[kind]) if columns[kind] else empty for kind in "CUT"
+        )
+
+    def annotate(self, genomic, barcode) -> bytes:
+        """merge a batch of genomic records with the barcode records of the same reads
+
+        Each genomic record is annotated as FastqRecord.add_annotation((b"", cell,
+        rmt, poly_t)) would, but for the whole batch at once.
+
+        :param FastqBatch genomic: genomic records
+        :param FastqBatch barcode: barcode records of the same reads
+        :return bytes | None: merged records, or None if the barcode sequences of the
+          batch differ in length or are shorter than self.min_length, in which case
+          the records must be merged one at a time
+        """
+        n = len(genomic)
+        if n != len(barcode):
+            raise ValueError(
+                "genomic and barcode batches hold %d and %d records"
+                % (n, len(barcode))
+            )
+        if not n:
+            return b""
+        lengths = barcode.sequence_lengths()
+        length = lengths[0]
+        if length < self.min_length or np.any(lengths != length):
+            return None
+        cell, rmt, poly_t = self.extract(barcode.sequence_array(length))
+
+        # b":".join((b"", cell, rmt, poly_t)) for every read at once
+        def separator():
+            return np.full((n, 1), ord(":"), dtype=np.uint8)
+
+        annotation = np.hstack(
+            [separator(), cell, separator(), rmt, separator(), poly_t]
+        )
+        width = annotation.shape[1]
+        annotations = annotation.tobytes()
+        return genomic.annotate(
+            [annotations[i : i + width] for i in range(0, n * width, width)]
+        )
@@ -0,0 +1,110 @@
+import numpy as np
+from seqc.sequence.encodings import DNA3Bit
+
+
+class BarcodeSidecar:
+    """
+    Binary file holding the encoded cell barcode, rmt and number of poly-T of each
+    merged read, in the order the reads were merged. The merged fastq then names each
+    read by its ordinal in this file, e.g. "@1234", instead of carrying the annotation
+    "@pool:cell:rmt:poly_t;name" through alignment; ReadArray construction joins
+    alignments to their barcodes by integer index.
+
+    The file is a short magic string followed by records of BarcodeSidecar.dtype.
+
+    usage:
+    sidecar = BarcodeSidecar(filename)
+    records, renamed = BarcodeSidecar.split_annotations(merged_batch, len(sidecar))
+    sidecar.write(records)
+    sidecar.close()
+    barcodes = BarcodeSidecar.load(filename)
+
+    :method split_annotations: move the annotations of merged records into records
+    :method write: append records to the sidecar
+    :method load: read the records of a sidecar file
+    """
+
+    dtype = np.dtype([("cell", np.int64), ("rmt", np.int64), ("n_poly_t", np.uint8)])
+    _magic = b"SEQCBCS1"
+
+    def __init__(self, filename):
+        """
+        :param str filename: sidecar file, created or truncated
+        """
+        self.filename = filename
+        self._file = open(filename, "wb")
+        self._file.write(self._magic)
+        self._n_records = 0
+
+    def __len__(self):
+        return self._n_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, records) -> None:
+        """
+        :param np.ndarray records: records of BarcodeSidecar.dtype, appended in order
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        self._file.write(records.tobytes())
+        self._n_records += len(records)
+
+    def close(self) -> None:
+        self._file.close()
+
+    @classmethod
+    def split_annotations(cls, merged, first_ordinal) -> (np.ndarray, bytes):
+        """move the annotations of a batch of merged records into sidecar records
+
+        :param FastqBatch merged: records annotated as FastqRecord.add_annotation does,
+          i.e. named "@pool:cell:rmt:poly_t;name"
+        :param int first_ordinal: ordinal of the first record in the merged fastq
+        :return (np.ndarray, bytes): the sidecar record of each read, and the merged
+          records with each name replaced by the read's ordinal
+        """
+        n = len(merged)
+        records = np.zeros(n, dtype=cls.dtype)
+        if not n:
+            return records, b""
+        buffer = merged.buffer
+        starts, ends = merged.field(0)
+        fields = [
+            buffer[start + 1 : end].split(b";", 1)[0].split(b":")
+            for start, end in zip(starts.tolist(), ends.tolist())
+        ]
+        records["cell"] = DNA3Bit.encode_array(np.array([f[1] for f in fields]))
+        records["rmt"] = DNA3Bit.encode_array(np.array([f[2] for f in fields]))
+        poly_t = np.array([f[3] for f in fields])
+        bases = poly_t.view(np.uint8).reshape(n, poly_t.itemsize)
+        records["n_poly_t"] = np.count_nonzero(
+            (bases == ord("T")) | (bases == ord("N")), axis=1
+        )
+        names = [b"@%d\n" % i for i in range(first_ordinal, first_ordinal + n)]
+        return records, merged.rename(names)
+
+    @classmethod
+    def load(cls, filename, mmap=True) -> np.ndarray:
+        """
+        :param str filename: sidecar file
+        :param bool mmap: if True, the records are memory-mapped instead of read into
+          memory
+        :return np.ndarray: records of BarcodeSidecar.dtype, indexed by read ordinal
+        """
+        with open(filename, "rb") as f:
+            magic = f.read(len(cls._magic))
+        if magic != cls._magic:
+            raise ValueError("%s is not a barcode sidecar file" % repr(filename))
+        if mmap:
+            buffer = np.memmap(filename, dtype=np.uint8, mode="r")
+        else:
+            buffer = np.fromfile(filename, dtype=np.uint8)
+        buffer = buffer[len(cls._magic) :]
+        if len(buffer) % cls.dtype.itemsize:
+            raise ValueError(
+                "barcode sidecar %s ends with a partial record" % repr(filename)
+            )
+        return buffer.view(cls.dtype)
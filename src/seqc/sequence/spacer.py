@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class SpacerLocator:
+    """
+    Locates the spacer that follows the variable-length first cell barcode of in-drop
+    barcode reads, for a whole batch of reads at once.
+
+    Each read takes one of three paths:
+      exact: the bases at identifier_window match the spacer for one of the cb1
+        lengths; this is the fixed-offset check_spacer() test of the in-drop
+        platforms
+      fuzzy: otherwise, the first cb1 length at which the spacer matches with at most
+        max_mismatches substitutions, and which leaves at least min_trailing bases
+        after the spacer. This reproduces re.match() of
+        "(.{8,11}?)(<spacer>){s<=2}(.{8})(.{6})(.*?)" and friends
+      failed: neither test succeeded
+
+    :property spacer: bytes, spacer sequence
+    :property cb1_lengths: tuple of possible cb1 lengths, in the order they are tried
+    :method locate: find the cb1 length and path of each read in a batch
+    """
+
+    EXACT, FUZZY, FAILED = 0, 1, 2
+    path_names = ("exact", "fuzzy", "failed")
+
+    def __init__(
+        self,
+        spacer: bytes,
+        cb1_lengths=(8, 9, 10, 11),
+        identifier_window=(24, 28),
+        max_mismatches=2,
+        min_trailing=0,
+        fuzzy=True,
+    ):
+        """
+        :param bytes spacer: spacer sequence
+        :param tuple cb1_lengths: possible lengths of the first cell barcode
+        :param (int, int) identifier_window: start and end of the read positions that
+          are compared with the spacer in the exact path
+        :param int max_mismatches: substitutions allowed in the fuzzy path
+        :param int min_trailing: number of bases that must follow the spacer for a
+          fuzzy match (e.g. cb2 + rmt length)
+        :param bool fuzzy: if False, reads that fail the exact path are not searched
+        """
+        start, end = identifier_window
+        if any(not 0 <= start - l <= end - l <= len(spacer) for l in cb1_lengths):
+            raise ValueError(
+                "identifier window %s does not fall inside the spacer for every cb1 "
+                "length" % repr(identifier_window)
+            )
+        self.spacer = spacer
+        self.cb1_lengths = tuple(cb1_lengths)
+        self.identifier_window = identifier_window
+        self.max_mismatches = max_mismatches
+        self.min_trailing = min_trailing
+        self.fuzzy = fuzzy
+
+        # precomputed once: the spacer bases expected in the identifier window for
+        # each cb1 length, and the spacer as an array for the fuzzy comparisons
+        spacer = np.frombuffer(spacer, dtype=np.uint8)
+        self._identifiers = np.array([spacer[start - l : end - l] for l in cb1_lengths])
+        self._spacer = spacer
+        self._width = max(end, max(cb1_lengths) + len(spacer))
+
+    def _padded_sequences(self, barcode):
+        """the first self._width bases of each sequence in barcode, as a 2-d uint8
+        array; positions past the end of a sequence are 0, which matches no base"""
+        lengths = barcode.sequence_lengths()
+        data = np.frombuffer(barcode.buffer, dtype=np.uint8)
+        positions = barcode.field(1)[0][:, np.newaxis] + np.arange(self._width)
+        sequences = data[np.minimum(positions, len(data) - 1)]
+        sequences[np.arange(self._width) >= lengths[:, np.newaxis]] = 0
+        return sequences, lengths
+
+    def locate(self, barcode) -> (np.ndarray, np.ndarray):
+        """
+        :param FastqBatch barcode: barcode reads
+        :return (np.ndarray, np.ndarray): cb1 length of each read (0 if the read
+          failed), and the path (self.EXACT, self.FUZZY or self.FAILED) of each read
+        """
+        n = len(barcode)
+        cb1 = np.zeros(n, dtype=np.int64)
+        paths = np.full(n, self.FAILED, dtype=np.int8)
+        if not n:
+            return cb1, paths
+        sequences, lengths = self._padded_sequences(barcode)
+
+        start, end = self.identifier_window
+        window = sequences[:, start:end]
+        for l, identifier in zip(self.cb1_lengths, self._identifiers):
+            found = (paths == self.FAILED) & np.all(window == identifier, axis=1)
+            cb1[found] = l
+            paths[found] = self.EXACT
+
+        if self.fuzzy:
+            spacer_len = len(self._spacer)
+            for l in self.cb1_lengths:
+                mismatches = np.sum(
+                    sequences[:, l : l + spacer_len] != self._spacer, axis=1
+                )
+                found = (
+                    (paths == self.FAILED)
+                    & (mismatches <= self.max_mismatches)
+                    & (lengths >= l + spacer_len + self.min_trailing)
+                )
+                cb1[found] = l
+                paths[found] = self.FUZZY
+        return cb1, paths
+
+    def count_paths(self, paths) -> dict:
+        """
+        :param np.ndarray paths: paths returned by self.locate
+        :return dict: number of reads that took each path, keyed by path name
+        """
+        counts = np.bincount(paths, minlength=len(self.path_names))
+        return dict(zip(self.path_names, counts.tolist()))
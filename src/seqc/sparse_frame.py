@@ -1,7 +1,7 @@
 import os
 import numpy as np
+import pandas as pd
 from scipy.sparse import coo_matrix
-from collections import OrderedDict
 from seqc.sequence.gtf import create_gene_id_to_official_gene_symbol_map
 from seqc.sequence.gtf import ensembl_gene_id_to_official_gene_symbol
 
@@ -21,6 +21,8 @@ class SparseFrame:
         :property columns: np.ndarray column index
         :property shape: (int, int), number of rows and columns
         :method sum: wrapper of np.sum()
+        :method to_dataframe: dense pd.DataFrame copy of the data
+        :method to_csv: write the data as a dense csv, one block of rows at a time
         """
 
         if not isinstance(data, coo_matrix):
@@ -79,14 +81,55 @@ class SparseFrame:
         """
         return self.data.sum(axis=axis)
 
+    def to_dataframe(self):
+        """
+        materialize the data as a dense pd.DataFrame
+
+        :return pd.DataFrame: counts indexed by self.index, with self.columns as columns
+        """
+        return pd.DataFrame(self.data.toarray(), index=self.index, columns=self.columns)
+
+    def to_csv(self, filename, leading_columns=None, block_size=1000):
+        """
+        write the data as a dense csv identical to self.to_dataframe().to_csv(), but
+        only densify block_size rows at a time.
+
+        :param str filename: name of the output csv file
+        :param dict leading_columns: optional mapping of column name -> np.ndarray of
+          length self.shape[0]; these columns are written, in order, before the data
+          columns
+        :param int block_size: number of rows densified and written at once
+        :return str: filename
+        """
+        leading_columns = leading_columns or {}
+        for name, values in leading_columns.items():
+            if len(values) != self.shape[0]:
+                raise ValueError(
+                    "leading column %s has %d values, expected %d"
+                    % (repr(name), len(values), self.shape[0])
+                )
+        csr = self.data.tocsr()
+        with open(filename, "w") as f:
+            # an empty frame still gets its header line
+            for start in range(0, max(self.shape[0], 1), block_size):
+                stop = min(start + block_size, self.shape[0])
+                block = pd.DataFrame(
+                    csr[start:stop].toarray(),
+                    index=self.index[start:stop],
+                    columns=self.columns,
+                )
+                for loc, (name, values) in enumerate(leading_columns.items()):
+                    block.insert(loc=loc, column=name, value=values[start:stop])
+                block.to_csv(f, header=start == 0)
+        return filename
+
     @classmethod
     def from_dict(cls, dictionary, genes_to_symbols=False):
         """create a SparseFrame from a dictionary
 
         :param dict dictionary: dictionary in form (cell, gene) -> count
-        :param str|bool genes_to_symbols: convert genes into symbols. If not False, user
-          must provide the location of a .gtf file to carry out conversion. Otherwise the
-          column index will retain the original integer ids
+        :param str|dict|bool genes_to_symbols: convert genes into symbols, see
+          from_arrays()
         :return SparseFrame: SparseFrame containing dictionary data
         """
 
@@ -94,25 +137,40 @@ class SparseFrame:
         # reads in the ReadArray
         i, j = (np.array(v, dtype=int) for v in zip(*dictionary.keys()))
         data = np.fromiter(dictionary.values(), dtype=int)
+        return cls.from_arrays(i, j, data, genes_to_symbols=genes_to_symbols)
 
-        # map cells to small values
-        uniq_i = np.unique(i)
-        imap = OrderedDict(zip(uniq_i, np.arange(uniq_i.shape[0])))
-
-        uniq_j = np.unique(j)
-        jmap = OrderedDict(zip(uniq_j, np.arange(uniq_j.shape[0])))
+    @classmethod
+    def from_arrays(cls, i, j, data, genes_to_symbols=False):
+        """create a SparseFrame from coordinate arrays
+
+        :param np.ndarray i: cell of each entry
+        :param np.ndarray j: gene of each entry
+        :param np.ndarray data: count of each entry
+        :param str|dict|bool genes_to_symbols: convert genes into symbols. If not False,
+          user must provide the location of a .gtf file to carry out conversion, or a
+          gene id map such as GeneIntervals.gene_id_map. Otherwise the column index will
+          retain the original integer ids
+        :return SparseFrame: SparseFrame with sorted cells as index and sorted genes as
+          columns
+        """
 
-        i_inds = np.fromiter((imap[v] for v in i), dtype=int)
-        j_inds = np.fromiter((jmap[v] for v in j), dtype=int)
+        # map cells and genes to small values
+        index, i_inds = np.unique(np.asarray(i, dtype=int), return_inverse=True)
+        columns, j_inds = np.unique(np.asarray(j, dtype=int), return_inverse=True)
 
         coo = coo_matrix(
-            (data, (i_inds, j_inds)), shape=(len(imap), len(jmap)), dtype=np.int32
+            (data, (i_inds, j_inds)),
+            shape=(len(index), len(columns)),
+            dtype=np.int32,
         )
 
-        index = np.fromiter(imap.keys(), dtype=int)
-        columns = np.fromiter(jmap.keys(), dtype=int)
-
-        if genes_to_symbols:
+        if isinstance(genes_to_symbols, dict):
+            columns = np.array(
+                ensembl_gene_id_to_official_gene_symbol(
+                    columns, gene_id_map=genes_to_symbols
+                )
+            )
+        elif genes_to_symbols:
             if not os.path.isfile(genes_to_symbols):
                 raise ValueError(
                     "genes_to_symbols argument %s is not a valid annotation "
@@ -239,7 +239,7 @@ class Section:
 
         :param filename:
         :param figure_path:
-        :param pd.DataFrame counts_matrix:
+        :param SparseFrame | pd.DataFrame counts_matrix:
         :return:
         """
         # use full path to generate an image
@@ -247,7 +247,7 @@ class Section:
 
         # Number of cells and molecule count distributions
         image_legend = "Number of cells: {} <br>".format(counts_matrix.shape[0])
-        ms = counts_matrix.sum(axis=1)
+        ms = np.ravel(counts_matrix.sum(axis=1))
         image_legend += "Min number of molecules: {}<br>".format(ms.min())
         for prctile in [25, 50, 75]:
             image_legend += '{}th percentile: {}<br>'.format(prctile, np.percentile(ms, prctile))
@@ -368,7 +368,11 @@ class MiniSummary:
         self.tsne_and_phenograph_fig = os.path.join(output_dir, output_prefix + "_phenograph.png")
 
     def compute_summary_fields(self, read_array, count_mat):
-        self.count_mat = pd.DataFrame(count_mat)
+        """
+        :param read_array: ReadArray
+        :param SparseFrame count_mat: count matrix after filtered; only the genes kept
+          for clustering are densified
+        """
         self.mini_summary_d['unmapped_pct'] = 0.0
         if os.path.isfile(self.alignment_summary_file):
             with open(self.alignment_summary_file, "r") as f:
@@ -396,15 +400,20 @@ class MiniSummary:
         self.mini_summary_d['genomic_read_pct'] = no_gene / len(read_array.data) * 100
 
         # Calculate statistics from count matrix
-        self.mini_summary_d['med_molcs_per_cell'] = np.median(count_mat.sum(1))
-        self.mini_summary_d['molcs_per_cell_25p'] = np.percentile(count_mat.sum(1), 25)
-        self.mini_summary_d['molcs_per_cell_75p'] = np.percentile(count_mat.sum(1), 75)
-        self.mini_summary_d['molcs_per_cell_min'] = np.asscalar(np.min(count_mat.sum(1)))
-        self.mini_summary_d['molcs_per_cell_max'] = np.asscalar(np.max(count_mat.sum(1)))
+        cell_sizes = np.ravel(count_mat.sum(axis=1))
+        self.mini_summary_d['med_molcs_per_cell'] = np.median(cell_sizes)
+        self.mini_summary_d['molcs_per_cell_25p'] = np.percentile(cell_sizes, 25)
+        self.mini_summary_d['molcs_per_cell_75p'] = np.percentile(cell_sizes, 75)
+        self.mini_summary_d['molcs_per_cell_min'] = np.asscalar(np.min(cell_sizes))
+        self.mini_summary_d['molcs_per_cell_max'] = np.asscalar(np.max(cell_sizes))
         self.mini_summary_d['n_cells'] = len(count_mat.index)
 
         # Filter low occurrence genes and median normalization
-        self.counts_filtered = self.count_mat.loc[:, (self.count_mat>0).sum(0) >= min(30,int(self.count_mat.shape[0]*0.2))]
+        counts = count_mat.data.tocsr()
+        detected = np.ravel((counts > 0).sum(axis=0))
+        keep = detected >= min(30, int(counts.shape[0] * 0.2))
+        self.counts_filtered = pd.DataFrame(
+            counts[:, keep].toarray(), index=count_mat.index, columns=count_mat.columns[keep])
         median_counts = np.median(self.counts_filtered.sum(1))
         counts_normalized = self.counts_filtered.divide(self.counts_filtered.sum(1),axis=0).multiply(median_counts)
 
@@ -0,0 +1,130 @@
+from unittest import TestCase
+import os
+import tempfile
+from sys import maxsize
+import nose2
+import numpy as np
+from seqc.sequence.encodings import DNA3Bit
+from seqc.sequence import barcodes
+from seqc.read_array import ReadArray
+from seqc import barcode_correction, platforms
+
+
+class TestBarcodeIndex(TestCase):
+    @classmethod
+    def setUp(cls):
+        rng = np.random.RandomState(0)
+        cls.whitelist = sorted(
+            set(
+                DNA3Bit.encode("".join(rng.choice(list("ACGT"), size=length)))
+                for length in (8, 9, 10)
+                for _ in range(100)
+            )
+        )
+        cls.index = barcodes.BarcodeIndex(cls.whitelist)
+        cls.queries = []
+        for _ in range(500):
+            seq = list(DNA3Bit.decode(rng.choice(cls.whitelist)).decode())
+            for p in rng.choice(len(seq), rng.randint(0, 4), replace=False):
+                seq[p] = rng.choice(list("ACGTN"))
+            cls.queries.append(DNA3Bit.encode("".join(seq)))
+
+    def test_hamming_neighbours_matches_generate_hamming_dist_1(self):
+        code = DNA3Bit.encode("ACGTNACG")
+        neighbours = barcodes.hamming_neighbours([code], 8, 1)[0]
+        self.assertEqual(
+            sorted(neighbours), sorted(barcodes.generate_hamming_dist_1(code))
+        )
+
+    def test_generate_hamming_dist_1_array(self):
+        codes = [DNA3Bit.encode("ACGTNACG"), DNA3Bit.encode("TTAC")]
+        neighbours = barcodes.generate_hamming_dist_1_array(codes)
+        for code, row in zip(codes, neighbours):
+            self.assertEqual(
+                [n for n in row if n], barcodes.generate_hamming_dist_1(code)
+            )
+
+    def test_find_many_matches_linear_scan(self):
+        found, distances, ambiguous = self.index.find_many(self.queries, max_dist=2)
+        for query, bc, dist, amb in zip(self.queries, found, distances, ambiguous):
+            scan = np.array(
+                [barcodes.hamming_dist_bin(query, w) for w in self.whitelist]
+            )
+            if scan.min() > 2:
+                self.assertEqual((bc, dist), (0, maxsize))
+                continue
+            self.assertEqual(dist, scan.min())
+            self.assertEqual(amb, np.sum(scan == scan.min()) > 1)
+            self.assertEqual(barcodes.hamming_dist_bin(query, bc), dist)
+
+    def test_find_exact_match(self):
+        self.assertIn(self.whitelist[0], self.index)
+        self.assertEqual(
+            self.index.find(self.whitelist[0], max_dist=0),
+            (self.whitelist[0], 0, False),
+        )
+
+    def test_cached_neighbourhood(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            barcode_file = os.path.join(cache_dir, "cb2.txt")
+            with open(barcode_file, "w") as f:
+                f.write("ACGTACGT\nACGTACGTA\n")
+            built = barcodes.BarcodeIndex.cached_neighbourhood(barcode_file)
+            # every variant with one substitution from ACGTN, and the barcodes
+            self.assertEqual(len(built), 2 + 4 * 8 + 4 * 9)
+            self.assertIn(DNA3Bit.encode("ACGTNCGT"), built)
+            self.assertNotIn(DNA3Bit.encode("ACGTNCGA"), built)
+            filename = barcodes.BarcodeIndex.neighbourhood_cache_filename(barcode_file)
+            self.assertTrue(os.path.isfile(filename))
+            loaded = barcodes.BarcodeIndex.cached_neighbourhood(barcode_file)
+            self.assertIsInstance(loaded.barcodes, np.memmap)
+            self.assertEqual(list(loaded.barcodes), list(built.barcodes))
+
+
+class TestTenXBarcodeCorrection(TestCase):
+    def test_ten_x_barcode_correction(self):
+        encode = DNA3Bit.encode
+        with tempfile.TemporaryDirectory() as directory:
+            # the valid barcodes are the union of both files; TTTTTA is never observed
+            barcode_files = [
+                os.path.join(directory, name) for name in ("w1.txt", "w2.txt")
+            ]
+            with open(barcode_files[0], "w") as f:
+                f.write("AAAAAA\nCCCCCC\nAAAACC\n")
+            with open(barcode_files[1], "w") as f:
+                f.write("GGGGGG\nTTTTTA\n")
+            observed = (
+                ["AAAAAA"] * 3
+                + ["CCCCCC", "AAAACC"]
+                + ["GGGGGG"] * 2
+                + ["AAAAAT", "CCCCCA", "AAAAAC", "TTTTTT", "TTTTTT"]
+            )
+            data = np.zeros(len(observed), dtype=ReadArray._dtype)
+            data["cell"] = [encode(bc) for bc in observed]
+            genes = np.ones(len(observed), dtype=int)
+            ra = ReadArray(data, genes, np.zeros(len(observed), dtype=int))
+            _, mapping = barcode_correction.ten_x_barcode_correction(
+                ra, platforms.ten_x_v2(), barcode_files
+            )
+
+        # AAAAAC is one substitution from AAAAAA (3 reads) and AAAACC (1 read);
+        # TTTTTT only neighbours the unobserved TTTTTA, so it cannot be corrected
+        expected = observed[:7] + ["AAAAAA", "CCCCCC", "AAAAAA", "TTTTTT", "TTTTTT"]
+        self.assertEqual(list(ra.data["cell"]), [encode(bc) for bc in expected])
+        cell_error = (ra.data["status"] & ra.filter_codes["cell_error"]) > 0
+        self.assertEqual(list(np.flatnonzero(cell_error)), [10, 11])
+        self.assertEqual(
+            sorted(zip(mapping["CR"], mapping["CB"])),
+            sorted(
+                (encode(cr), encode(cb))
+                for cr, cb in [
+                    ("AAAAAT", "AAAAAA"),
+                    ("CCCCCA", "CCCCCC"),
+                    ("AAAAAC", "AAAAAA"),
+                ]
+            ),
+        )
+
+
+if __name__ == "__main__":
+    nose2.main()
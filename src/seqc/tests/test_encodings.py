@@ -0,0 +1,58 @@
+from unittest import TestCase
+import nose2
+import numpy as np
+from seqc.sequence.encodings import DNA3Bit
+
+
+class TestDNA3BitArray(TestCase):
+    @classmethod
+    def setUp(cls):
+        rng = np.random.RandomState(0)
+        cls.seqs = [
+            "".join(rng.choice(list("ACGTN"), size=rng.randint(0, 22)))
+            for _ in range(1000)
+        ]
+        cls.encoded = np.array([DNA3Bit.encode(s) for s in cls.seqs], dtype=np.int64)
+
+    def test_encode_array_matches_encode(self):
+        self.assertTrue(
+            np.array_equal(DNA3Bit.encode_array(self.seqs), self.encoded)
+        )
+        as_bytes = np.array([s.encode() for s in self.seqs])
+        self.assertTrue(np.array_equal(DNA3Bit.encode_array(as_bytes), self.encoded))
+
+    def test_encode_array_base_matrix(self):
+        bases = np.frombuffer(b"ACGT\0\0ACGTNa", dtype=np.uint8).reshape(2, 6)
+        self.assertEqual(
+            list(DNA3Bit.encode_array(bases)),
+            [DNA3Bit.encode("ACGT"), DNA3Bit.encode("ACGTNa")],
+        )
+
+    def test_encode_array_invalid(self):
+        with self.assertRaises(ValueError):
+            DNA3Bit.encode_array(["ACGX"])
+        with self.assertRaises(ValueError):
+            DNA3Bit.encode_array(["A" * 22])
+
+    def test_decode_array_matches_decode(self):
+        decoded = DNA3Bit.decode_array(self.encoded)
+        self.assertEqual(list(decoded), [DNA3Bit.decode(int(i)) for i in self.encoded])
+
+    def test_seq_len_count_contains_array(self):
+        self.assertEqual(
+            list(DNA3Bit.seq_len_array(self.encoded)),
+            [DNA3Bit.seq_len(int(i)) for i in self.encoded],
+        )
+        for char in DNA3Bit.bin2strdict:
+            self.assertEqual(
+                list(DNA3Bit.count_array(self.encoded, char)),
+                [DNA3Bit.count(int(i), char) for i in self.encoded],
+            )
+            self.assertEqual(
+                list(DNA3Bit.contains_array(self.encoded, char)),
+                [DNA3Bit.contains(int(i), char) for i in self.encoded],
+            )
+
+
+if __name__ == "__main__":
+    nose2.main()
@@ -0,0 +1,157 @@
+from unittest import TestCase
+import os
+import uuid
+import shutil
+import gzip
+from collections import Counter
+import nose2
+import numpy as np
+from seqc.sequence import fastq
+from seqc.sequence.read_structure import ReadStructure
+from seqc.sequence.sidecar import BarcodeSidecar
+from seqc.sequence.encodings import DNA3Bit
+from seqc import platforms
+
+
+class TestFastqBatches(TestCase):
+    @classmethod
+    def setUp(cls):
+        cls.path_temp = os.path.join(
+            os.environ["TMPDIR"], "seqc-test", str(uuid.uuid4())
+        )
+        os.makedirs(cls.path_temp, exist_ok=True)
+        cls.records = [
+            (b"@r%d\n" % i, b"ACGT" * n + b"\n", b"+\n", b"IIII" * n + b"\n")
+            for i, n in enumerate([1, 2, 3, 4, 5] * 20)
+        ]
+        cls.fastq = os.path.join(cls.path_temp, "test.fastq.gz")
+        with gzip.open(cls.fastq, "wb") as f:
+            f.write(b"".join(b"".join(r) for r in cls.records))
+
+    @classmethod
+    def tearDown(self):
+        if os.path.isdir(self.path_temp):
+            shutil.rmtree(self.path_temp, ignore_errors=True)
+
+    def test_iter_batches(self):
+        reader = fastq.Reader(self.fastq)
+        for kwargs in (
+            dict(block_size=7),
+            dict(block_size=1 << 10, threaded=True),
+            dict(block_size=1 << 10, decompressor="gzip -dc"),
+        ):
+            batches = list(reader.iter_batches(**kwargs))
+            self.assertEqual([r for b in batches for r in b.records()], self.records)
+        self.assertEqual([tuple(r._data) for r in reader], self.records)
+
+    def test_sequence_array(self):
+        batch = next(fastq.Reader(self.fastq).iter_batches())
+        self.assertEqual(list(batch.sequence_lengths()[:3]), [4, 8, 12])
+        self.assertEqual(bytes(batch.sequence_array(4)[1]), b"ACGT")
+        with self.assertRaises(ValueError):
+            batch.sequence_array(5)
+
+    def test_split(self):
+        batch = next(fastq.Reader(self.fastq).iter_batches())
+        first, rest = batch.split(10)
+        self.assertEqual((len(first), len(rest)), (10, 90))
+        self.assertEqual(list(rest.records())[0], self.records[10])
+        self.assertEqual(bytes(first) + bytes(rest), bytes(batch))
+
+    def test_merge_with_barcode_sidecar(self):
+        platform = platforms.ten_x_v2()
+        barcode = os.path.join(self.path_temp, "barcode.fastq")
+        with open(barcode, "wb") as f:
+            for i in range(len(self.records)):
+                seq = b"ACGTACGTACGTACGT" + b"GGGGGCCCCC" + b"TTNTA"[: i % 6]
+                f.write(b"@r%d\n%s\n+\n%s\n" % (i, seq, b"I" * len(seq)))
+        annotated = os.path.join(self.path_temp, "annotated.fastq")
+        merged = os.path.join(self.path_temp, "merged.fastq")
+        sidecar = os.path.join(self.path_temp, "barcodes.bin")
+        fastq.merge_paired(platform.merge_function, annotated, self.fastq, barcode)
+        for n_processes in (1, 2):
+            fastq.merge_paired(
+                platform.merge_function,
+                merged,
+                self.fastq,
+                barcode,
+                n_processes=n_processes,
+                chunk_size=30,
+                barcode_sidecar=sidecar,
+            )
+            records = BarcodeSidecar.load(sidecar)
+            self.assertEqual(len(records), len(self.records))
+            for i, (a, m) in enumerate(
+                zip(fastq.Reader(annotated), fastq.Reader(merged))
+            ):
+                self.assertEqual(m.name, b"@%d\n" % i)
+                self.assertEqual(m.sequence, a.sequence)
+                _, cell, rmt, poly_t = a.annotations
+                self.assertEqual(records[i]["cell"], DNA3Bit.encode(cell))
+                self.assertEqual(records[i]["rmt"], DNA3Bit.encode(rmt))
+                self.assertEqual(
+                    records[i]["n_poly_t"], poly_t.count(b"T") + poly_t.count(b"N")
+                )
+
+
+class TestReadStructure(TestCase):
+    def test_extract(self):
+        structure = ReadStructure("8C 4X 6C 6U *T")
+        seqs = np.frombuffer(b"AAAAAAAACCCCGGGGGGTTTTTTNNN", dtype=np.uint8)
+        cell, rmt, poly_t = structure.extract(seqs[np.newaxis, :])
+        self.assertEqual(bytes(cell[0]), b"AAAAAAAAGGGGGG")
+        self.assertEqual(bytes(rmt[0]), b"TTTTTT")
+        self.assertEqual(bytes(poly_t[0]), b"NNN")
+        for spec in ("", "*C 8U", "8Q"):
+            with self.assertRaises(ValueError):
+                ReadStructure(spec)
+
+    def test_merge_batch_matches_merge_function(self):
+        rng = np.random.RandomState(0)
+        genomic, barcode = [], []
+        for i in range(50):
+            seq = "".join(rng.choice(list("ACGTN"), 40)).encode()
+            genomic.append(b"@r%d 1:N\n%s\n+\n%s\n" % (i, seq, b"I" * 40))
+            seq = "".join(rng.choice(list("ACGTN"), 60)).encode()
+            barcode.append(b"@r%d 2:N\n%s\n+\n%s\n" % (i, seq, b"I" * 60))
+        g = fastq.FastqBatch.from_buffer(b"".join(genomic))
+        b = fastq.FastqBatch.from_buffer(b"".join(barcode))
+        for name in ("ten_x_v2", "ten_x_v3", "drop_seq"):
+            platform = platforms.AbstractPlatform.factory(name)
+            expected = b"".join(
+                bytes(platform.merge_function(gr, br)) for gr, br in zip(g, b)
+            )
+            self.assertIsNotNone(platform.read_structure.annotate(g, b))
+            self.assertEqual(platform.merge_batch(g, b), expected)
+
+
+class TestSpacerLocator(TestCase):
+    def test_in_drop_merge_batch_matches_merge_function(self):
+        rng = np.random.RandomState(0)
+        spacer = list("GAGTGATTGCTTGTGACGCCTT")
+        genomic, barcode = [], []
+        for i in range(500):
+            seq = spacer.copy()
+            for p in rng.choice(len(seq), rng.randint(0, 4), replace=False):
+                seq[p] = rng.choice(list("ACGTN"))  # degrade the spacer
+            seq = rng.choice(list("ACGT"), rng.randint(7, 13)).tolist() + seq
+            seq = "".join(seq + rng.choice(list("ACGT"), 14).tolist() + ["T"] * 5)
+            seq = seq[: rng.randint(20, len(seq) + 1)].encode()
+            genomic.append(b"@r%d\nACGT\n+\nIIII\n" % i)
+            barcode.append(b"@r%d\n%s\n+\n%s\n" % (i, seq, b"I" * len(seq)))
+        g = fastq.FastqBatch.from_buffer(b"".join(genomic))
+        b = fastq.FastqBatch.from_buffer(b"".join(barcode))
+
+        platform = platforms.in_drop()
+        counts = Counter()
+        merged = platform.merge_batch(g, b, counts)
+        expected = b"".join(
+            bytes(platform.merge_function(gr, br)) for gr, br in zip(g, b)
+        )
+        self.assertEqual(merged, expected)
+        self.assertEqual(sum(counts.values()), 500)
+        self.assertTrue(all(counts[path] for path in ("exact", "fuzzy", "failed")))
+
+
+if __name__ == "__main__":
+    nose2.main()
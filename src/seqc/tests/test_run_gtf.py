@@ -61,6 +61,73 @@ class TestGtf(TestCase):
         gene_id = translator.translate("chr19", "-", 60951)
         self.assertEqual(gene_id, 282458)
 
+    def test_translate_many(self):
+        translator = gtf.GeneIntervals(self.annotation)
+        genes = translator.translate_many(
+            ["chr19", "chr19", "chrZ"], ["-", "+", "-"], [60951, 60951, 60951]
+        )
+        self.assertEqual(genes[0], 282458)
+        self.assertEqual(genes[2], gtf.GeneIntervals.NO_GENE)
+        self.assertEqual(
+            translator.translate("chr19", "+", 60951),
+            genes[1] if genes[1] >= 0 else None,
+        )
+
+    def test_cached_translator(self):
+        os.makedirs(self.path_temp, exist_ok=True)
+        translator = gtf.GeneIntervals(self.annotation)
+        # without a cache file, the symbol map is read without building a translator
+        gene_id_map = gtf.GeneIntervals.cached_gene_id_map(
+            self.annotation, cache_dir=self.path_temp
+        )
+        self.assertEqual(os.listdir(self.path_temp), [])
+        self.assertEqual(gene_id_map, translator.gene_id_map)
+        gene_id_map = {i: set(symbols) for i, symbols in gene_id_map.items()}
+        cached = gtf.GeneIntervals.cached(self.annotation, cache_dir=self.path_temp)
+        loaded = gtf.GeneIntervals.cached(self.annotation, cache_dir=self.path_temp)
+        self.assertEqual(len(os.listdir(self.path_temp)), 1)
+        for t in (cached, loaded):
+            self.assertEqual(t.translate("chr19", "-", 60951), 282458)
+        positions = list(range(60000, 80000, 7))
+        genes = translator.translate_many(
+            ["chr19"] * len(positions), ["-"] * len(positions), positions
+        )
+        self.assertEqual(
+            list(genes),
+            list(
+                loaded.translate_many(
+                    ["chr19"] * len(positions), ["-"] * len(positions), positions
+                )
+            ),
+        )
+        self.assertEqual(
+            gtf.ensembl_gene_id_to_official_gene_symbol([282458], loaded.gene_id_map),
+            ["WASH5P"],
+        )
+        # loaded from the cache file
+        cached_map = gtf.GeneIntervals.cached_gene_id_map(
+            self.annotation, cache_dir=self.path_temp
+        )
+        self.assertEqual(
+            {i: set(symbols) for i, symbols in cached_map.items()}, gene_id_map
+        )
+
+    def test_remove_overlapping_intervals(self):
+        intervals = {
+            "chr1": {
+                # gene 1 has two overlapping exons, gene 2 overlaps gene 1
+                "+": [(10, 20, 1), (15, 30, 1), (25, 40, 2)]
+            }
+        }
+        boundaries, labels = gtf.GeneIntervals._remove_overlapping_intervals(
+            intervals
+        )["chr1"]["+"]
+        self.assertEqual(list(boundaries), [10, 25, 30, 40])
+        self.assertEqual(
+            list(labels),
+            [1, gtf.GeneIntervals.AMBIGUOUS, 2, gtf.GeneIntervals.NO_GENE],
+        )
+
 
 if __name__ == "__main__":
     nose2.main()
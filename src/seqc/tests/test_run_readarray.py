@@ -3,10 +3,14 @@ import os
 import uuid
 import shutil
 import nose2
+import numpy as np
+from scipy.sparse import csr_matrix
 from test_dataset import dataset_local
 from seqc.sequence.encodings import DNA3Bit
-from seqc.read_array import ReadArray
+from seqc.read_array import ReadArray, ReadArrayArchive, CompactReadArray
 from seqc.sequence import gtf
+from seqc.sequence.sidecar import BarcodeSidecar
+from seqc.alignment import sam
 
 
 class TestReadArray(TestCase):
@@ -30,6 +34,21 @@ class TestReadArray(TestCase):
         )
         self.assertIsNotNone(ra)
 
+    def test_read_array_native_bam_reader(self, platform="ten_x_v2"):
+        ra_samtools, names_samtools = ReadArray.from_alignment_file(
+            dataset_local.bam % platform, self.translator, required_poly_t=0
+        )
+        ra_native, names_native = ReadArray.from_alignment_file(
+            dataset_local.bam % platform,
+            self.translator,
+            required_poly_t=0,
+            reader="native",
+        )
+        self.assertEqual(names_samtools, names_native)
+        self.assertTrue(np.array_equal(ra_samtools.data, ra_native.data))
+        self.assertEqual((ra_samtools.genes != ra_native.genes).nnz, 0)
+        self.assertEqual((ra_samtools.positions != ra_native.positions).nnz, 0)
+
     def test_read_array_rmt_decode_10x_v2(self):
         platform = "ten_x_v2"
 
@@ -61,5 +80,200 @@ class TestReadArray(TestCase):
             self.assertEqual(len(decoded), 12)
 
 
+class TestReadArraySynthetic(TestCase):
+    """tests on small read arrays constructed in memory, without the test dataset"""
+
+    @classmethod
+    def setUp(cls):
+        cls.path_temp = os.path.join(
+            os.environ["TMPDIR"], "seqc-test", str(uuid.uuid4())
+        )
+
+    @classmethod
+    def tearDown(self):
+        if os.path.isdir(self.path_temp):
+            shutil.rmtree(self.path_temp, ignore_errors=True)
+
+    def test_to_count_matrix(self):
+        data = np.zeros(6, dtype=ReadArray._dtype)
+        data["cell"] = [2, 1, 2, 2, 1, 2]
+        data["rmt"] = [7, 5, 7, 8, 5, 9]
+        data["status"] = [0, 0, 0, 0, 0, 1]  # the last read is filtered
+        genes = np.array([10, 20, 10, 10, 30, 10])
+        ra = ReadArray(data, genes, np.zeros(6, dtype=int))
+
+        reads, mols = ra.to_count_matrix()
+        self.assertEqual(reads, {(1, 20): 1, (1, 30): 1, (2, 10): 3})
+        self.assertEqual(mols, {(1, 20): [5], (1, 30): [5], (2, 10): [7, 8]})
+
+        sp_reads, sp_mols = ra.to_count_matrix(sparse_frame=True)
+        self.assertEqual(list(sp_reads.index), [1, 2])
+        self.assertEqual(list(sp_reads.columns), [10, 20, 30])
+        self.assertEqual(sp_reads.data.toarray().tolist(), [[0, 1, 1], [3, 0, 0]])
+        self.assertEqual(sp_mols.data.toarray().tolist(), [[0, 1, 1], [2, 0, 0]])
+
+        # streaming csv output matches the csv of the dense frame
+        os.makedirs(self.path_temp, exist_ok=True)
+        dense = sp_mols.to_dataframe()
+        dense.insert(loc=0, column="CLUSTER", value=[4, 5])
+        dense.to_csv(os.path.join(self.path_temp, "dense.csv"))
+        sp_mols.to_csv(
+            os.path.join(self.path_temp, "streamed.csv"),
+            leading_columns={"CLUSTER": np.array([4, 5])},
+            block_size=1,
+        )
+        with open(os.path.join(self.path_temp, "dense.csv")) as a, open(
+            os.path.join(self.path_temp, "streamed.csv")
+        ) as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_barcode_sidecar_join(self):
+        os.makedirs(self.path_temp, exist_ok=True)
+        sidecar = os.path.join(self.path_temp, "barcodes.bin")
+        records = np.zeros(4, dtype=BarcodeSidecar.dtype)
+        records["cell"] = [DNA3Bit.encode(c) for c in ("AAAC", "CCCG", "GGGT", "TTTA")]
+        records["rmt"] = [11, 12, 13, 14]
+        records["n_poly_t"] = [5, 6, 7, 8]
+        with BarcodeSidecar(sidecar) as f:
+            f.write(records)
+
+        def alignments(*names):
+            # one alignment per read; translate_many maps every position to gene 1
+            for name in names:
+                fields = [name, "0", "chr1", "100", "255", "4M", "*", "0", "0"]
+                yield (sam.SamRecord(fields + ["ACGT", "IIII", "NH:i:1"]),)
+
+        translator = mock.Mock()
+        translator.translate_many.side_effect = lambda c, s, p: np.ones(len(p), int)
+        ra, names = ReadArray.from_multialignments(
+            alignments("2", "0", "3"), translator, 0, sidecar
+        )
+        self.assertEqual(names, ["2", "0", "3"])
+        self.assertEqual(list(ra.data["cell"]), list(records["cell"][[2, 0, 3]]))
+        self.assertEqual(list(ra.data["rmt"]), [13, 11, 14])
+        self.assertEqual(list(ra.data["n_poly_t"]), [7, 5, 8])
+
+        for names in (["1", "-3"], ["4"], ["::AAAC:GG:TT;r1"]):
+            with self.assertRaises(ValueError):
+                ReadArray.from_multialignments(
+                    alignments(*names), translator, 0, sidecar
+                )
+
+    def test_resolve_ambiguous_alignments(self):
+        # cell 1, rmt 1: reads align to {10, 20} and {10}; 10 is the common gene
+        # cell 1, rmt 2: reads align to {30} and {40}, disjoint gene sets
+        data = np.zeros(4, dtype=ReadArray._dtype)
+        data["cell"] = 1
+        data["rmt"] = [1, 1, 2, 2]
+        data["n_poly_t"] = 5
+        genes = csr_matrix(([20, 10, 10, 30, 40], [0, 1, 0, 0, 0], [0, 2, 3, 4, 5]))
+        positions = csr_matrix(([5, 6, 7, 8, 9], [0, 1, 0, 0, 0], [0, 2, 3, 4, 5]))
+        ra = ReadArray(data, genes, positions)
+        ra.initial_filtering(required_poly_t=0)
+
+        results = ra.resolve_ambiguous_alignments()
+        self.assertEqual(results["unique molecules"], 0)
+        self.assertEqual(results["cell/rmt barcode collisions"], 2)
+        self.assertEqual(results["resolved molecules: disjoint"], 2)
+        self.assertEqual(results["resolved molecules: model"], 1)
+        self.assertEqual(results["ambiguous molecules"], 0)
+        self.assertEqual(list(ra.genes), [10, 10, 30, 40])
+        self.assertEqual(list(ra.positions), [6, 7, 8, 9])
+        self.assertTrue(np.all(ra.data["status"] == 0))
+
+    def test_save_and_load_archive(self):
+        os.makedirs(self.path_temp, exist_ok=True)
+        archive_name = os.path.join(self.path_temp, "ra.h5")
+        data = np.zeros(5, dtype=ReadArray._dtype)
+        data["cell"] = [3, 1, 3, 2, 1]
+        data["rmt"] = [1, 2, 3, 4, 5]
+        data["status"] = [0, 1, 0, 16, 0]
+        genes = np.array([10, 0, 30, 40, 50])
+        ReadArray(data, genes, genes + 1).save(
+            archive_name, read_names=["a", "b", "c", "d", "e"]
+        )
+
+        with ReadArrayArchive(archive_name) as archive:
+            # reads are stored sorted by cell
+            self.assertEqual(archive.read_names(), ["b", "e", "d", "a", "c"])
+            self.assertEqual(list(archive.cells), [1, 2, 3])
+            self.assertEqual(archive.cell_rows(3), (3, 5))
+            summary = archive.summary()
+            self.assertEqual(summary["total"], 5)
+            self.assertEqual(summary["active"], 3)
+            self.assertEqual(summary["no_gene"], 1)
+            # blocks end at cell boundaries
+            blocks = list(archive.iter_blocks(["rmt", "genes"], block_size=2))
+            self.assertEqual(
+                [(start, stop) for start, stop, _ in blocks], [(0, 2), (2, 5)]
+            )
+            self.assertEqual(list(blocks[1][2]["genes"]), [40, 10, 30])
+
+        ra = ReadArray.load(archive_name)
+        self.assertEqual(list(ra.data["rmt"]), [2, 5, 4, 1, 3])
+        self.assertEqual(list(ra.positions), [1, 51, 41, 11, 31])
+
+    def test_compact_read_array_round_trip(self):
+        data = np.zeros(4, dtype=ReadArray._dtype)
+        data["cell"] = [1 << 40, 7, 1 << 40, 7]
+        data["rmt"] = [1, 2, 3, 300]
+        data["status"] = [0, 1, 16, 0]
+        # no alignment, one alignment, two alignments, one alignment in column 1
+        genes = csr_matrix(([10, 20, 30, 40], [0, 0, 1, 1], [0, 0, 1, 3, 4]), (4, 2))
+        positions = csr_matrix(([5, 6, 7, 8], [0, 0, 1, 1], [0, 0, 1, 3, 4]), (4, 2))
+
+        compact = CompactReadArray.from_read_array(ReadArray(data, genes, positions))
+        self.assertEqual(list(compact.cells), [7, 1 << 40])
+        self.assertEqual(compact.rmts.dtype, np.uint16)
+        self.assertEqual(list(compact.overflow_reads), [2, 3])
+        ra = compact.to_read_array()
+        self.assertEqual(ra.data.tolist(), data.tolist())
+        self.assertEqual(ra.genes.toarray().tolist(), genes.toarray().tolist())
+        self.assertEqual(ra.positions.toarray().tolist(), positions.toarray().tolist())
+
+        ra.resolve_ambiguous_alignments()
+        compact = CompactReadArray.from_read_array(ra)
+        self.assertEqual(list(compact.genes), [0, 10, 20])
+        self.assertEqual(list(compact.to_read_array().genes), list(ra.genes))
+
+    def test_sort(self):
+        data = np.zeros(5, dtype=ReadArray._dtype)
+        data["cell"] = [2, 1, 2, 1, 2]
+        data["rmt"] = [5, 4, 3, 2, 1]
+        genes = np.array([1, 1, 1, 1, 2])
+        ra = ReadArray(data, genes, np.zeros(5, dtype=int))
+        order = ra.sort()
+        self.assertTrue(ra.is_sorted)
+        self.assertEqual(list(order), [3, 1, 2, 0, 4])
+        self.assertEqual(list(ra.row_order), [3, 1, 2, 0, 4])
+        self.assertEqual(
+            [list(g) for g in ra.group_indices_by_cell()], [[0, 1], [2, 3, 4]]
+        )
+
+        # changing an rmt re-sorts the reads of its cell only
+        ra.data["rmt"][2] = 9
+        ra.invalidate_sort("rmt", [2])
+        self.assertFalse(ra.is_sorted)
+        self.assertEqual(list(ra.sort()), [0, 1, 3, 2, 4])
+        self.assertEqual(list(ra.data["rmt"]), [2, 4, 5, 9, 1])
+        self.assertEqual(list(ra.row_order), [3, 1, 0, 2, 4])
+
+        ra.invalidate_sort("cell")
+        self.assertFalse(ra.is_sorted)
+
+    def test_filter_low_coverage(self):
+        # 20 molecules with reads at positions 1 and 2, and lonely triplets: ten at
+        # position 5 and one at position 1
+        rmts = np.concatenate([np.repeat(np.arange(20), 2), np.arange(100, 111)])
+        positions = np.concatenate([np.tile([1, 2], 20), [5] * 10, [1]])
+        data = np.zeros(len(rmts), dtype=ReadArray._dtype)
+        data["cell"] = 1
+        data["rmt"] = rmts
+        ra = ReadArray(data, np.ones(len(rmts), dtype=int), positions)
+        ra.filter_low_coverage(alpha=0.25)
+        lonely = (ra.data["status"] & ra.filter_codes["lonely_triplet"]) > 0
+        self.assertEqual(list(np.flatnonzero(lonely)), list(range(40, 50)))
+
+
 if __name__ == "__main__":
     nose2.main()
@@ -4,6 +4,7 @@ import os
 import numpy as np
 from seqc.read_array import ReadArray
 from seqc import rmt_correction
+from seqc.sequence.encodings import DNA3Bit
 
 
 class TestRmtCorrection(TestCase):
@@ -93,5 +94,70 @@ class TestRmtCorrection2(TestCase):
         self.assertEquals([0, 0, 0], x)
 
 
+class TestRmtCorrectionSharedMemory(TestCase):
+    @classmethod
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        bases = np.array([DNA3Bit.encode(b) for b in "ACGT"])
+        # a few 10-base rmts
+        rmts = np.array(
+            [DNA3Bit.encode("".join(rng.choice(list("ACGT"), 10))) for _ in range(5)]
+        )
+        n = 2000
+        data = np.zeros(n, dtype=ReadArray._dtype)
+        data["cell"] = rng.randint(1, 5, n)
+        data["rmt"] = rmts[rng.randint(0, len(rmts), n)]
+        # substitute the last base of some reads with another base to create rmt
+        # errors
+        errors = np.flatnonzero(rng.rand(n) < 0.05)
+        last = np.argmax((data["rmt"][errors] & 0b111)[:, None] == bases, axis=1)
+        substitute = bases[(last + rng.randint(1, 4, len(errors))) % 4]
+        data["rmt"][errors] = (data["rmt"][errors] & ~0b111) | substitute
+        genes = rng.randint(1, 3, n)
+        positions = rng.randint(1, 3, n)
+        self.ra = ReadArray(data, genes, positions)
+
+    @mock.patch("seqc.rmt_correction._get_cpu_count", return_value=2)
+    def test_shared_memory_matches_serial_correction(self, mock_cpu):
+        groups = self.ra.group_indices_by_cell()
+        expected = sorted(
+            tuple(pair)
+            for group in groups
+            for pair in rmt_correction._correct_errors_by_cell_group(
+                self.ra, group, 0.02, 0.05
+            )
+        )
+        results = rmt_correction._correct_errors_shared_memory(
+            self.ra, groups, 0.02, 0.05
+        )
+        self.assertEqual(
+            sorted(map(tuple, np.concatenate(results).tolist())), expected
+        )
+
+    def test_partition_cell_groups(self):
+        data = np.zeros(10, dtype=ReadArray._dtype)
+        data["rmt"] = [1, 1, 1, 2, 1, 2, 3, 1, 2, 3]
+        ra = ReadArray(data, np.ones(10), np.ones(10))
+        # costs: 0 (single rmt), 4, 9 and 9 (two identical groups)
+        groups = [np.arange(0, 3), np.arange(3, 5), np.arange(4, 7), np.arange(7, 10)]
+        units = rmt_correction._partition_cell_groups(ra, groups, 2)
+        self.assertEqual([sorted(u) for u in units], [[1, 2], [3]])
+
+    def test_correct_errors_by_cell_group(self):
+        # 10 reads of one rmt, and one read that differs from it by one base. an rmt
+        # two bases away but at a position the donor lacks is left alone
+        rmt = 0b100110101011100110101011100110
+        data = np.zeros(13, dtype=ReadArray._dtype)
+        data["cell"] = 1
+        data["rmt"] = [rmt] * 10 + [rmt ^ 0b001, rmt ^ 0b001001, rmt ^ 0b001]
+        genes = np.array([1] * 12 + [2])
+        positions = np.array([1] * 11 + [2, 1])
+        ra = ReadArray(data, genes, positions)
+        res = rmt_correction._correct_errors_by_cell_group(
+            ra, np.arange(13), 0.02, 0.05
+        )
+        self.assertEqual(res.tolist(), [[10, 0]])
+
+
 if __name__ == "__main__":
     nose2.main()